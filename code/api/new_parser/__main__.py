@@ -0,0 +1,5 @@
+from .cli import main
+
+# In this file: Lets the batch command line in cli.py run as python -m api.new_parser
+
+main()
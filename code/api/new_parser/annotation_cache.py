@@ -0,0 +1,118 @@
+import sqlite3
+from threading import Lock
+from json import dumps, loads
+from hashlib import sha256
+from time import time
+from os import makedirs
+from os.path import dirname, join
+import logging
+
+# In this file: An on disk cache of spacy annotations so we don't run the transformer on text it has already seen.
+# Sheets get re-uploaded and re-parsed constantly after transcription fixes, and almost all of their smaller entries are unchanged.
+# Maps (smaller entry text, model name, model version, preprocessor version) to the list of (text, ent_type_, tag_)
+# for every token spacy produced for that smaller entry, which is everything preprocess actually reads from spacy.
+# Stored in SQLite under the parser's dump folder, in a subfolder so upload_results leaves it alone.
+# Least recently used entries are evicted once the cache holds more than max_entries.
+
+default_cache_path = join(dirname(__file__), "ParseMe", "cache", "annotations.sqlite3")
+
+# Stand in for a spacy token with only the attributes preprocess reads (and sometimes overwrites).
+# Compares by identity just like spacy tokens from the same doc do.
+class AnnotatedToken:
+    __slots__ = ("text", "ent_type_", "tag_")
+
+    def __init__(self, text: str, ent_type_: str, tag_: str):
+        self.text = text
+        self.ent_type_ = ent_type_
+        self.tag_ = tag_
+
+    def __repr__(self) -> str:
+        return f"AnnotatedToken({self.text!r}, {self.ent_type_!r}, {self.tag_!r})"
+
+# Converts a spacy doc into the serialized form we store
+def serialize_doc(doc) -> str:
+    return dumps([(token.text, token.ent_type_, token.tag_) for token in doc])
+
+def deserialize_tokens(data: str) -> list:
+    return [AnnotatedToken(*token) for token in loads(data)]
+
+# Content address of a smaller entry
+def make_key(text: str, model_name: str, model_version: str, preprocessor_version: int) -> str:
+    return sha256("\x1f".join((model_name, model_version, str(preprocessor_version), text)).encode("UTF-8")).hexdigest()
+
+class AnnotationCache:
+    def __init__(self, path: str = default_cache_path, max_entries: int = 500000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+        makedirs(dirname(path), exist_ok=True)
+        # The connection is shared by every thread in the process, self._lock makes sure only one uses it at a time
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets parser worker processes read while another one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS annotations (key TEXT PRIMARY KEY, tokens TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS annotations_last_used ON annotations (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+
+    # Returns {key: serialized tokens} for every key in keys that is in the cache, and marks them as recently used
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            # Stay well under SQLite's limit on the number of parameters in a query
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                query = f"SELECT key, tokens FROM annotations WHERE key IN ({','.join('?' * len(chunk))})"
+                for key, tokens in self._conn.execute(query, chunk):
+                    found[key] = tokens
+            if found:
+                now = time()
+                self._conn.executemany("UPDATE annotations SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    # Stores {key: serialized tokens} in the cache, evicting the least recently used entries if we are over max_entries
+    def put_many(self, items: dict):
+        if not items:
+            return
+        with self._lock:
+            now = time()
+            self._conn.executemany("INSERT OR REPLACE INTO annotations (key, tokens, last_used) VALUES (?, ?, ?)", [(key, tokens, now) for key, tokens in items.items()])
+            self._conn.commit()
+            self._size += len(items)
+            if self._size > self.max_entries:
+                self._evict()
+
+    # Removes the least recently used entries until we are a bit under max_entries so we don't evict on every insert
+    def _evict(self):
+        self._size = self._conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        to_remove = self._size - int(self.max_entries * 0.9)
+        if to_remove <= 0:
+            return
+        logging.info(f"Evicting {to_remove} entries from the annotation cache")
+        self._conn.execute("DELETE FROM annotations WHERE key IN (SELECT key FROM annotations ORDER BY last_used LIMIT ?)", (to_remove,))
+        self._conn.commit()
+        self._size -= to_remove
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": self._size}
+
+# One cache per path per process, created the first time it is asked for
+_caches = {}
+_caches_lock = Lock()
+
+def get_annotation_cache(path: str = default_cache_path, max_entries: int = 500000) -> AnnotationCache:
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = AnnotationCache(path, max_entries)
+        return _caches[path]
@@ -0,0 +1,95 @@
+from time import perf_counter
+from .british_money import Money
+
+# In this file: Works out which prices of an entry with both colony currency and sterling totals are in which currency.
+# The prices have to split into a sterling part adding up to the sterling total and a currency part adding up to the currency
+# total, and we only use a split if it is the only one. parse used to try every combination of prices for the sterling part,
+# which takes exponentially long in the number of prices. Here the prices are split in two halves and all the sums each half
+# can make are worked out (meet in the middle), so a sterling part is a sum from one half plus a matching sum from the other,
+# found by lookup. Prices are compared as whole numbers of twelfths of a penny, the same way Money compares them.
+# The answer is the one the old search gave, quirks included:
+# - Both parts have to have at least one price in them.
+# - When the two totals are equal, a split and its mirror image (parts swapped) are both valid. If the parts have different
+#   sizes the old search only ever saw the smaller part as sterling, so that is what we use, if they have the same size the
+#   entry is ambiguous.
+
+# Raised when a group of prices doesn't have exactly one split
+class BacksolveAmbiguous(Exception):
+    pass
+
+# Raised when a group of prices has too many prices to look at every split within the time budget
+class BacksolveBudgetExceeded(Exception):
+    pass
+
+# Largest number of sums worked out for one half, 2 ** 22 sums takes about a second and a few hundred MB
+_max_half_sums = 2 ** 22
+
+# Returns the sums of every subset of values, the sum of a subset at the index whose bits say which values are in it
+def _subset_sums(values: list, deadline: float) -> list:
+    if 2 ** len(values) > _max_half_sums:
+        raise BacksolveBudgetExceeded(f"{2 ** len(values)} sums needed")
+    sums = [0]
+    for value in values:
+        if perf_counter() > deadline:
+            raise BacksolveBudgetExceeded("out of time")
+        sums += [x + value for x in sums]
+    return sums
+
+# Returns up to limit subsets (as bitmasks over values) that add up to target and aren't empty or all of values
+def _find_subsets(values: list, target, limit: int, deadline: float) -> list:
+    n = len(values)
+    half = n // 2
+    left = _subset_sums(values[:half], deadline)
+    right = {}
+    for mask, total in enumerate(_subset_sums(values[half:], deadline)):
+        if mask & 0xfff == 0 and perf_counter() > deadline:
+            raise BacksolveBudgetExceeded("out of time")
+        right.setdefault(total, []).append(mask)
+
+    everything = (1 << n) - 1
+    found = []
+    for left_mask, total in enumerate(left):
+        if left_mask & 0xfff == 0 and perf_counter() > deadline:
+            raise BacksolveBudgetExceeded("out of time")
+        for right_mask in right.get(target - total, ()):
+            mask = left_mask | (right_mask << half)
+            if mask == 0 or mask == everything:
+                continue
+            found.append(mask)
+            if len(found) == limit:
+                return found
+    return found
+
+# Splits prices, a list of (index, Money), into the prices in colony currency and the prices in sterling given the currency and
+# sterling totals. Returns (currency indices, sterling indices).
+# Raises BacksolveAmbiguous if there isn't exactly one way to split them and BacksolveBudgetExceeded if finding out would take
+# more than seconds.
+def split_currency(prices: list, curr_sum: Money, ster_sum: Money, seconds: float = 1.0) -> tuple:
+    deadline = perf_counter() + seconds
+    values = [x[1].totalFracCurrency for x in prices]
+    curr = curr_sum.totalFracCurrency
+    ster = ster_sum.totalFracCurrency
+
+    # The currency part is whatever isn't sterling, so nothing works unless the totals add up to all the prices
+    if sum(values) != curr + ster:
+        raise BacksolveAmbiguous("prices don't add up to the totals")
+
+    if ster != curr:
+        # Every sterling part that works is its own split
+        found = _find_subsets(values, ster, 2, deadline)
+        if len(found) != 1:
+            raise BacksolveAmbiguous(f"{len(found)} splits")
+        sterling = found[0]
+    else:
+        # Sterling parts come in pairs, a part and the rest. Only one pair of differently sized parts is a single split.
+        found = _find_subsets(values, ster, 3, deadline)
+        if len(found) != 2:
+            raise BacksolveAmbiguous(f"{len(found) // 2} splits")
+        a, b = found
+        if bin(a).count("1") == bin(b).count("1"):
+            raise BacksolveAmbiguous("a split and its mirror image")
+        sterling = a if bin(a).count("1") < bin(b).count("1") else b
+
+    currency_indices = [x[0] for i, x in enumerate(prices) if not sterling >> i & 1]
+    sterling_indices = [x[0] for i, x in enumerate(prices) if sterling >> i & 1]
+    return currency_indices, sterling_indices
@@ -0,0 +1,88 @@
+from argparse import ArgumentParser
+from itertools import combinations
+from random import Random
+from time import perf_counter
+from ..british_money import Money
+from ..backsolve import split_currency, BacksolveAmbiguous, BacksolveBudgetExceeded
+
+# In this file: Times splitting the prices of synthetic entries with both colony currency and sterling totals (see backsolve.py)
+# against the search parse used to do, which tried every combination of prices.
+# Every group has random prices of a few shillings and pence, a random part of which is sterling, and the totals of both parts.
+# The old search only runs on groups of up to --old-max prices, it takes minutes beyond that. Where both run, they have to agree.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.backsolve [--sizes 8 12 16 20 24 30 36 40] [--groups 5] [--old-max 16]
+
+# The search parse used to do, returns (currency indices, sterling indices) or None if there isn't exactly one split
+def _split_by_combinations(to_backsolve: set, curr_sum: Money, ster_sum: Money):
+    valid_currrency_sums = []
+    valid_sterling_sums = []
+    for i in range(1, (len(to_backsolve) // 2) + 1):
+        for combo in combinations(to_backsolve, i):
+            combo = set(combo)
+            complement = to_backsolve.difference(combo)
+            combo_sum = sum(x[1] for x in combo)
+            complement_sum = sum(x[1] for x in complement)
+            if combo_sum == ster_sum and complement_sum == curr_sum:
+                if combo not in valid_sterling_sums and complement not in valid_currrency_sums:
+                    valid_sterling_sums.append(combo)
+                    valid_currrency_sums.append(complement)
+            elif combo_sum == curr_sum and complement_sum == ster_sum:
+                if combo not in valid_currrency_sums and complement not in valid_sterling_sums:
+                    valid_sterling_sums.append(complement)
+                    valid_currrency_sums.append(combo)
+    if len(valid_currrency_sums) == 1 and len(valid_sterling_sums) == 1:
+        return sorted(x[0] for x in valid_currrency_sums[0]), sorted(x[0] for x in valid_sterling_sums[0])
+    return None
+
+# Returns (prices, currency total, sterling total) for a group of n prices
+def _group(random: Random, n: int) -> tuple:
+    prices = [(i, Money(s=random.randint(0, 19), d=random.randint(0, 11))) for i in range(n)]
+    sterling = set(random.sample(range(n), random.randint(1, n - 1)))
+    ster_sum = sum(x[1] for x in prices if x[0] in sterling)
+    curr_sum = sum(x[1] for x in prices if x[0] not in sterling)
+    return prices, curr_sum, ster_sum
+
+def main():
+    arg_parser = ArgumentParser(description="Time backsolving large synthetic groups of prices")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[8, 12, 16, 20, 24, 30, 36, 40])
+    arg_parser.add_argument("--groups", type=int, default=5, help="groups of every size")
+    arg_parser.add_argument("--old-max", type=int, default=16, help="largest group to run the old search on")
+    arg_parser.add_argument("--seconds", type=float, default=1.0, help="time budget of split_currency")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    random = Random(args.seed)
+    print(f"{'prices':>6} {'old (ms)':>10} {'new (ms)':>10} {'split':>6} {'ambiguous':>10} {'over budget':>12} {'disagree':>9}")
+    for n in args.sizes:
+        old_seconds = 0
+        new_seconds = 0
+        results = {"split": 0, "ambiguous": 0, "over budget": 0}
+        disagree = 0
+        for i in range(args.groups):
+            prices, curr_sum, ster_sum = _group(random, n)
+
+            start = perf_counter()
+            try:
+                currency, sterling = split_currency(prices, curr_sum, ster_sum, args.seconds)
+                new = (sorted(currency), sorted(sterling))
+                results["split"] += 1
+            except BacksolveAmbiguous:
+                new = None
+                results["ambiguous"] += 1
+            except BacksolveBudgetExceeded:
+                new = False
+                results["over budget"] += 1
+            new_seconds += perf_counter() - start
+
+            if n <= args.old_max:
+                start = perf_counter()
+                old = _split_by_combinations(set(prices), curr_sum, ster_sum)
+                old_seconds += perf_counter() - start
+                if new is not False and old != new:
+                    disagree += 1
+
+        old_ms = f"{old_seconds / args.groups * 1000:.1f}" if n <= args.old_max else "-"
+        print(f"{n:>6} {old_ms:>10} {new_seconds / args.groups * 1000:>10.1f} {results['split']:>6} {results['ambiguous']:>10} {results['over budget']:>12} {disagree:>9}")
+
+if __name__ == "__main__":
+    main()
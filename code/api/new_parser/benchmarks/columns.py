@@ -0,0 +1,70 @@
+from argparse import ArgumentParser
+from os import path
+from time import perf_counter
+from ..new_parser import load_sheet
+from ..parser_utils import get_col, frame_rows, canonical_columns
+from .corpus import default_data, find_files
+
+# In this file: Times going through the rows of sheets and reading every cell the parser reads from a row, the way preprocess
+# used to (df.iterrows(), get_col working out which column a name means on every call) against the way it does now
+# (frame_rows, every row sharing a ColumnMap that worked the names out once for the sheet), see parser_utils.py.
+# Checks that both read the same values, with the same types.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.columns [--data ../data] [--folders 1758 Amelia] [--repeat 3]
+
+# Stands in for the value of a column the sheet doesn't have
+_missing = object()
+
+# Reads every canonical column of every row, returns the values
+def _read(rows) -> list:
+    out = []
+    for key, row in rows:
+        for colname in canonical_columns:
+            try:
+                out.append(get_col(row, colname))
+            except KeyError:
+                out.append(_missing)
+    return out
+
+def _same(a, b) -> bool:
+    return a is b or (type(a) is type(b) and (a == b or (a != a and b != b)))
+
+def main():
+    arg_parser = ArgumentParser(description="Compare reading cells through iterrows and get_col against frame_rows and ColumnMap")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    frames = []
+    for file in find_files(args.data, args.folders):
+        try:
+            frames.append(load_sheet(file))
+        except Exception as e:
+            print(f"Skipping {path.basename(file)}: {e}")
+    n_rows = sum(len(df) for df in frames)
+
+    old_seconds = 0
+    new_seconds = 0
+    differing = 0
+    for i in range(args.repeat):
+        for df in frames:
+            start = perf_counter()
+            old = _read(df.iterrows())
+            old_seconds += perf_counter() - start
+
+            start = perf_counter()
+            new = _read(frame_rows(df))
+            new_seconds += perf_counter() - start
+
+            if i == 0:
+                differing += sum(1 for a, b in zip(old, new) if not _same(a, b)) + abs(len(old) - len(new))
+
+    per_row = lambda seconds: seconds / (n_rows * args.repeat) * 1e6
+    print(f"{len(frames)} sheets, {n_rows} rows, {len(canonical_columns)} cells per row")
+    print(f"iterrows + get_col: {per_row(old_seconds):.1f} us per row")
+    print(f"frame_rows + ColumnMap: {per_row(new_seconds):.1f} us per row")
+    print(f"{differing} differing cells")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from random import Random
+from time import perf_counter
+from ..new_parser import parse_file
+from ..config import ParserConfig
+from .corpus import default_data, find_files, group_rows, diff_rows
+
+# In this file: Stress test for parsing several files at the same time in one process.
+# Parses the files one after the other, then parses them again on a pool of threads (in a shuffled order, several rounds)
+# and checks every concurrent result against the sequential one. Since every parse has its own NameRegistry the results should be identical.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.concurrency [--threads 8] [--rounds 3] [--data ../data] [--limit 5]
+
+# Parses file, returning its rows (see group_rows), or the exception it raised as a string
+def _parse(file: str, config: ParserConfig):
+    try:
+        return group_rows(parse_file(file, config))
+    except Exception as e:
+        return repr(e)
+
+def main():
+    arg_parser = ArgumentParser(description="Check that parsing files concurrently gives the same results as parsing them one at a time")
+    arg_parser.add_argument("--threads", type=int, default=8)
+    arg_parser.add_argument("--rounds", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed for shuffling the order files are submitted in")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    files = find_files(args.data, args.folders, args.limit)
+    # Annotations are cached by content so the cache can't change results, but with it off every thread actually runs spacy
+    config = ParserConfig(profile=args.profile, annotation_cache=None)
+
+    start = perf_counter()
+    expected = {file: _parse(file, config) for file in files}
+    sequential_time = perf_counter() - start
+    print(f"Sequential: {len(files)} files in {sequential_time:.2f}s")
+
+    random = Random(args.seed)
+    failures = 0
+    for i in range(args.rounds):
+        order = list(files)
+        random.shuffle(order)
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = dict(zip(order, pool.map(lambda file: _parse(file, config), order)))
+        elapsed = perf_counter() - start
+
+        differing = []
+        for file in files:
+            if isinstance(expected[file], str) or isinstance(results[file], str):
+                if expected[file] != results[file]:
+                    differing.append((file, f"{expected[file]} vs {results[file]}"))
+                continue
+            compared, differs, tagging_differs, fields = diff_rows(expected[file], results[file])
+            if differs or tagging_differs:
+                differing.append((file, f"{differs} rows differ ({', '.join(fields)}), {tagging_differs} tagged differently"))
+        failures += len(differing)
+        print(f"Round {i + 1}: {len(files)} files on {args.threads} threads in {elapsed:.2f}s, {len(differing)} files differ from the sequential run")
+        for file, difference in differing:
+            print(f"    {path.basename(file)}: {difference}")
+
+    print("All concurrent results match" if not failures else f"{failures} concurrent results did not match!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from os import listdir, path
+from json import dumps
+from ..new_parser import load_sheet
+from ..parser_utils import get_col
+
+# In this file: Helpers shared by the benchmarks for finding the sheets in the data folder and comparing parser output.
+
+default_data = path.join(path.dirname(__file__), "..", "..", "..", "..", "data")
+
+# Returns the paths of the spreadsheets in the given subfolders of data (every subfolder if folders is None), at most limit per folder
+def find_files(data: str = default_data, folders: list = None, limit: int = None) -> list:
+    if folders is None:
+        folders = sorted(x for x in listdir(data) if path.isdir(path.join(data, x)))
+    files = []
+    for folder in folders:
+        names = sorted(x for x in listdir(path.join(data, folder)) if ".xls" in x)
+        files += [path.join(data, folder, x) for x in names[:limit]]
+    return files
+
+# Returns every row (as a pandas series) of every sheet in files that has an Entry column
+def load_rows(files: list) -> list:
+    rows = []
+    for file in files:
+        try:
+            df = load_sheet(file)
+            get_col(df, "Entry")
+        except Exception as e:
+            print(f"Skipping {path.basename(file)}: {e}")
+            continue
+        rows += [row for key, row in df.iterrows()]
+    return rows
+
+# Fields that only describe how we got to the output rather than the output itself
+_trace_fields = ("context", "text_as_parsed")
+
+# Groups the transactions of a parse_file result by (group, entry_id), the closest thing we have to a spreadsheet row.
+# group is the index of a transaction group within the result, which is always the transactions of a single sheet.
+def group_rows(result: list) -> dict:
+    rows = {}
+    for group, transactions in enumerate(result):
+        for transaction in transactions:
+            rows.setdefault((group, transaction.get("entry_id")), []).append(transaction)
+    return rows
+
+def _strip(transaction: dict) -> str:
+    return dumps({key: val for key, val in transaction.items() if key not in _trace_fields}, sort_keys=True, default=str)
+
+# Compares rows (from group_rows) of one file against a baseline.
+# Returns (rows compared, rows whose output differs, rows whose tagging differs, {field: rows where field differs})
+def diff_rows(baseline: dict, result: dict):
+    differs = 0
+    tagging_differs = 0
+    fields = {}
+    for key in baseline.keys() | result.keys():
+        base_row = baseline.get(key, [])
+        row = result.get(key, [])
+        if [_strip(x) for x in base_row] != [_strip(x) for x in row]:
+            differs += 1
+            changed = set()
+            if len(base_row) != len(row):
+                changed.add("transaction count")
+            for base_transaction, transaction in zip(base_row, row):
+                for field in base_transaction.keys() | transaction.keys():
+                    if field not in _trace_fields and base_transaction.get(field) != transaction.get(field):
+                        changed.add(field)
+            for field in changed:
+                fields[field] = fields.get(field, 0) + 1
+        if [x.get("context") for x in base_row] != [x.get("context") for x in row]:
+            tagging_differs += 1
+    return len(baseline.keys() | result.keys()), differs, tagging_differs, fields
+
+# Sums diff_rows over every file, returning the same thing
+def diff_outputs(baseline: dict, outputs: dict):
+    compared = differs = tagging_differs = 0
+    fields = {}
+    for file in baseline:
+        file_compared, file_differs, file_tagging_differs, file_fields = diff_rows(baseline[file], outputs[file])
+        compared += file_compared
+        differs += file_differs
+        tagging_differs += file_tagging_differs
+        for field, count in file_fields.items():
+            fields[field] = fields.get(field, 0) + count
+    return compared, differs, tagging_differs, fields
@@ -0,0 +1,56 @@
+from argparse import ArgumentParser
+from time import perf_counter
+import pandas as pd
+from ..new_parser import load_sheet, parse
+from ..parser_utils import get_col
+from ..parse_stats import ParseStats
+from ..config import ParserConfig
+from .corpus import default_data, find_files
+
+# In this file: Times parsing a synthetic sheet on which every row goes wrong, to see what writing errors down costs.
+# Every row has a long entry without a price or an item (so its transactions get errors embedding the whole entry) and,
+# on every other row, colony currency that can't be parsed (so the row gets errors with a traceback, which then get copied
+# into the errors of its transactions).
+# Prints the time per row of the parse and the errors it wrote down by code (see errors.py).
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.errors [--rows 2000] [--data ../data]
+
+_entry = "To Sundries " + " ".join(f"and sundry goods left with the bearer of the note number {i}" for i in range(8))
+
+# Returns a sheet of n rows, all copies of template apart from their EntryID, Entry, GenMat and colony currency
+def _bad_sheet(template: pd.Series, n: int) -> pd.DataFrame:
+    df = pd.DataFrame([template] * n).reset_index(drop=True)
+    df[get_col(df, "EntryID").name] = [f"B_{i + 1}" for i in range(n)]
+    df[get_col(df, "Entry").name] = [_entry] * n
+    df[get_col(df, "GenMat").name] = [0] * n
+    df[get_col(df, "L Currency").name] = ["x" if i % 2 else "-" for i in range(n)]
+    for name in ("s Currency", "d Currency", "L Sterling", "s Sterling", "d Sterling", "Quantity", "Commodity"):
+        df[get_col(df, name).name] = ["-"] * n
+    return df
+
+def main():
+    arg_parser = ArgumentParser(description="Time parsing a synthetic sheet where every row has errors")
+    arg_parser.add_argument("--rows", type=int, default=2000)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--sheet", default=None, help="sheet to take the template row from, the first one in data by default")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    template = load_sheet(args.sheet or find_files(args.data)[0]).iloc[0]
+    config = ParserConfig(profile=args.profile)
+
+    df = _bad_sheet(template, args.rows)
+    # Once to fill the annotation cache, so the timed run is mostly the parser itself
+    parse(df, config)
+    stats = ParseStats(f"bad sheet {args.rows}")
+    start = perf_counter()
+    with stats.collect():
+        parse(df, config)
+    elapsed = perf_counter() - start
+
+    print(f"{args.rows} rows in {elapsed:.2f}s, {elapsed / args.rows * 1000:.3f} ms/row, {stats.counts.get('errors', 0)} errors")
+    for code, n in stats.summary()["errors"].items():
+        print(f"{code:<28} {n:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from argparse import ArgumentParser
+from itertools import chain
+from time import perf_counter
+import logging
+from ..new_parser import parse_file
+from ..config import ParserConfig
+from ..pipelines import get_pipeline
+from ..annotation_cache import serialize_doc, deserialize_tokens
+from ..fast_tagger import tag_formulaic
+from ..preprocessor import _prepare_row, _combine_tokens
+from .corpus import default_data, find_files, load_rows, group_rows, diff_outputs
+
+# In this file: Measures the rule based fast path for formulaic entries (see fast_tagger.py).
+# Reports what fraction of the corpus's smaller entries it tags, how often its tokens (and the combined tokens preprocess produces from them)
+# agree with spacy's, and how much total parse time drops with it turned on.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.fast_path [--profile trf] [--data ../data] [--limit 5] [--show 20]
+
+def _tuples(tokens: list) -> list:
+    return [(x.text, x.ent_type_, x.tag_) for x in tokens]
+
+# Parses every file, returning ({file: rows}, seconds)
+def _parse_all(files: list, config: ParserConfig):
+    outputs = {}
+    start = perf_counter()
+    for file in files:
+        try:
+            outputs[file] = group_rows(parse_file(file, config))
+        except Exception as e:
+            logging.warning(f"Failed to parse {file}: {e}")
+            outputs[file] = {}
+    return outputs, perf_counter() - start
+
+def main():
+    arg_parser = ArgumentParser(description="Measure the coverage, agreement and speed of the formulaic entry fast path")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--show", type=int, default=10, help="number of disagreements to print")
+    args = arg_parser.parse_args()
+
+    files = find_files(args.data, args.folders, args.limit)
+    nlp = get_pipeline(args.profile)
+
+    # Coverage and agreement on every smaller entry in the corpus
+    prepared = [_prepare_row(row) for row in load_rows(files)]
+    fragments = list(chain(*[x[1] for x in prepared if x is not None]))
+    fast = [tag_formulaic(fragment, nlp.tokenizer) for fragment in fragments]
+    handled = [(fragment, tokens) for fragment, tokens in zip(fragments, fast) if tokens is not None]
+    print(f"{len(fragments)} smaller entries, fast path tags {len(handled)} ({len(handled) / max(len(fragments), 1):.1%}), "
+          f"{len({x[0] for x in handled})} of {len(set(fragments))} distinct")
+
+    token_agree = 0
+    combined_agree = 0
+    shown = 0
+    docs = nlp.pipe([x[0] for x in handled])
+    for (fragment, tokens), doc in zip(handled, docs):
+        spacy_tokens = deserialize_tokens(serialize_doc(doc))
+        if _tuples(tokens) == _tuples(spacy_tokens):
+            token_agree += 1
+        combined = _combine_tokens(tokens, set())
+        spacy_combined = _combine_tokens(spacy_tokens, set())
+        if combined == spacy_combined:
+            combined_agree += 1
+        elif shown < args.show:
+            shown += 1
+            print(f"  {fragment!r}")
+            print(f"    spacy: {spacy_combined}")
+            print(f"    fast:  {combined}")
+    print(f"Agreement with spacy on tagged entries: tokens {token_agree / max(len(handled), 1):.1%}, preprocess output {combined_agree / max(len(handled), 1):.1%}")
+
+    # End to end parse time, without the annotation cache which would hide the cost of spacy
+    results = {}
+    for fast_path in (False, True):
+        config = ParserConfig(profile=args.profile, annotation_cache=None, fast_path=fast_path)
+        results[fast_path] = _parse_all(files, config)
+
+    compared, differs, tagging_differs, fields = diff_outputs(results[False][0], results[True][0])
+    print()
+    print(f"Parse time on {len(files)} files: spacy only {results[False][1]:.2f}s, with fast path {results[True][1]:.2f}s "
+          f"({1 - results[True][1] / results[False][1]:.1%} less)")
+    print(f"Rows with different output: {differs} of {compared} ({differs / max(compared, 1):.1%}), different tagging: {tagging_differs}")
+    if fields:
+        print("    fields differing: " + ", ".join(f"{field} {count}" for field, count in sorted(fields.items(), key=lambda x: -x[1])))
+
+if __name__ == "__main__":
+    main()
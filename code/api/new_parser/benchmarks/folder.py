@@ -0,0 +1,77 @@
+from argparse import ArgumentParser
+from os import listdir, path
+from shutil import copy
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from ..new_parser import parse_folder
+from ..config import ParserConfig
+from .corpus import default_data
+
+# In this file: Times parse_folder parsing the files of a folder one after the other against spreading them across worker
+# processes (config.file_workers), on copies of a data folder.
+# Checks that both write the same .json and .exception files, and that progress never goes down and ends at 1.
+# Which order people come out in depends on string hashing, so set PYTHONHASHSEED for both runs to write the same people.
+# Run from the code folder with:
+# PYTHONHASHSEED=0 python -m api.new_parser.benchmarks.folder [--workers 4] [--data ../data] [--folder 1758] [--limit 8]
+
+# Copies the spreadsheets of source into target, returns their names
+def _copy_sheets(source: str, target: str, limit: int = None) -> list:
+    names = sorted(x for x in listdir(source) if x.split(".")[-1] in ["xls", "xlsx"])[:limit]
+    for name in names:
+        copy(path.join(source, name), target)
+    return names
+
+# Returns {output file name: contents} of everything parse_folder wrote into folder
+def _outputs(folder: str) -> dict:
+    outputs = {}
+    for name in listdir(folder):
+        if name.endswith(".json") or name.endswith(".exception"):
+            with open(path.join(folder, name)) as file:
+                text = file.read()
+            # The traceback of an exception says which process it was raised in
+            outputs[name] = text.split("\n")[0] if name.endswith(".exception") else text
+    return outputs
+
+# Runs parse_folder on a copy of source, returns (seconds, outputs, progress values)
+def _run(source: str, limit: int, config: ParserConfig) -> tuple:
+    progress = []
+    with TemporaryDirectory() as folder:
+        _copy_sheets(source, folder, limit)
+        start = perf_counter()
+        parse_folder(folder, progress.append, config)
+        elapsed = perf_counter() - start
+        return elapsed, _outputs(folder), progress
+
+def main():
+    arg_parser = ArgumentParser(description="Compare parsing a folder one file at a time against parsing it on worker processes")
+    arg_parser.add_argument("--workers", type=int, default=4)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folder", default="1758", help="subfolder of data to parse")
+    arg_parser.add_argument("--limit", type=int, default=8, help="only parse the first n files of the folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    source = path.join(args.data, args.folder)
+    # With the annotation or result cache on, whichever run goes second would barely run spacy (or not parse at all)
+    sequential = ParserConfig(profile=args.profile, annotation_cache=None, result_cache=None)
+    parallel = ParserConfig(profile=args.profile, annotation_cache=None, result_cache=None, file_workers=args.workers)
+
+    # Start the workers (and load their models) before timing anything, a server keeps them around between folders
+    _run(source, args.workers, parallel)
+
+    results = {}
+    for name, config in (("sequential", sequential), (f"{args.workers} workers", parallel)):
+        elapsed, outputs, progress = _run(source, args.limit, config)
+        increasing = all(a <= b for a, b in zip(progress, progress[1:]))
+        print(f"{name:>12}: {elapsed:.2f}s, {len(outputs)} outputs, {len(progress)} progress calls, "
+              f"{'never decreasing' if increasing else 'DECREASING'}, last {progress[-1] if progress else None}")
+        results[name] = outputs
+
+    expected, actual = results.values()
+    differing = sorted(x for x in expected.keys() | actual.keys() if expected.get(x) != actual.get(x))
+    print(f"{len(differing)} differing outputs")
+    for name in differing:
+        print(f"  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from argparse import ArgumentParser
+from os import path
+from random import Random
+from shutil import copy
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import logging
+from ..new_parser import parse_file
+from ..config import ParserConfig
+from .corpus import default_data, find_files, group_rows, diff_rows
+
+# In this file: Simulates re-uploading corrected sheets to check and time incremental parsing (see row_cache.py).
+# Every .xlsx sheet is copied to a temporary folder and parsed incrementally once, then a few of its Entry cells get a typo
+# and it is parsed again, incrementally and in full. Both results have to be identical.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.incremental [--edits 3] [--data ../data] [--folders Mahlon] [--limit 5]
+
+# Swaps two neighbouring letters in edits random Entry cells of the sheet at filePath
+def _add_typos(filePath: str, edits: int, random: Random):
+    from openpyxl import load_workbook
+
+    book = load_workbook(filePath)
+    sheet = book.worksheets[0]
+    cells = []
+    entry_column = None
+    for row in sheet.iter_rows():
+        if entry_column is None:
+            for cell in row:
+                if cell.value in ("Entry", "[Entry]"):
+                    entry_column = cell.column - 1
+            continue
+        if entry_column < len(row) and isinstance(row[entry_column].value, str) and len(row[entry_column].value) > 1:
+            cells.append(row[entry_column])
+    for cell in random.sample(cells, min(edits, len(cells))):
+        i = random.randrange(len(cell.value) - 1)
+        cell.value = cell.value[:i] + cell.value[i + 1] + cell.value[i] + cell.value[i + 2:]
+    book.save(filePath)
+
+def _parse(filePath: str, config: ParserConfig):
+    start = perf_counter()
+    try:
+        result = group_rows(parse_file(filePath, config))
+    except Exception as e:
+        result = repr(e)
+    return result, perf_counter() - start
+
+def main():
+    arg_parser = ArgumentParser(description="Check and time incremental re-parses of corrected sheets")
+    arg_parser.add_argument("--edits", type=int, default=3, help="number of entry cells to put typos in")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    # Only .xlsx files, openpyxl can't write .xls
+    files = [x for x in find_files(args.data, args.folders, args.limit) if x.endswith(".xlsx")]
+    # Without the annotation cache, so the time saved is the time spacy would have spent on the unchanged rows
+    full_config = ParserConfig(profile=args.profile, annotation_cache=None)
+    incremental_config = ParserConfig(profile=args.profile, annotation_cache=None, incremental=True)
+    random = Random(args.seed)
+
+    mismatches = 0
+    full_time = 0
+    incremental_time = 0
+    with TemporaryDirectory() as folder:
+        for file in files:
+            sheet = path.join(folder, path.basename(file))
+            copy(file, sheet)
+            _parse(sheet, incremental_config)
+            try:
+                _add_typos(sheet, args.edits, random)
+            except Exception as e:
+                logging.warning(f"Could not edit {path.basename(file)}: {e}")
+                continue
+
+            expected, elapsed = _parse(sheet, full_config)
+            full_time += elapsed
+            result, elapsed = _parse(sheet, incremental_config)
+            incremental_time += elapsed
+
+            if isinstance(expected, str) or isinstance(result, str):
+                differs = expected != result
+            else:
+                compared, differs, tagging_differs, fields = diff_rows(expected, result)
+                differs = differs or tagging_differs
+            if differs:
+                mismatches += 1
+                print(f"{path.basename(file)}: incremental result differs from a full parse")
+
+    print(f"{len(files)} sheets with {args.edits} edited entries each, {len(files) - mismatches} incremental results identical to a full parse")
+    print(f"Full re-parse {full_time:.2f}s, incremental re-parse {incremental_time:.2f}s ({full_time / max(incremental_time, 1e-9):.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
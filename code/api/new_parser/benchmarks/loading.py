@@ -0,0 +1,79 @@
+from argparse import ArgumentParser
+from os import path
+from time import perf_counter
+import pandas as pd
+from ..new_parser import load_sheet
+from ..parser_utils import get_col
+from .corpus import default_data, find_files
+
+# In this file: Compares load_sheet, which reads a sheet once and finds its header row in memory, against the loader it
+# replaced, which read the whole workbook again for every line above the header and reset the index once per matching row.
+# Checks that both give the same frame (values, column names, dtypes, index and the python type of every value) and reports
+# the time each takes per folder.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.loading [--repeat 3] [--data ../data] [--folders 1758 1763 Amelia]
+
+# The loader load_sheet replaced
+def _load_sheet_rereading(filePath) -> pd.DataFrame:
+    df = pd.read_excel(filePath)
+
+    n = 0
+    while "EntryID" not in df and "[EntryID]" not in df:
+        n += 1
+        df = pd.read_excel(filePath, skiprows=n)
+    for idx in range(0, df.shape[0]-1):
+        if "EntryID" in df:
+            if str(df['EntryID'][idx+1])[:-1] == str(df['EntryID'][idx]):
+                df = df.reset_index(drop=True)
+        else:
+            if str(df['[EntryID]'][idx+1])[:-1] == str(df['[EntryID]'][idx]):
+                df = df.reset_index(drop=True)
+
+    df = df[get_col(df, "EntryID") != ""]
+
+    return df
+
+def _same_frame(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    if not a.equals(b) or list(a.columns) != list(b.columns) or list(a.dtypes) != list(b.dtypes):
+        return False
+    if type(a.index) is not type(b.index) or not a.index.equals(b.index):
+        return False
+    return all([type(x) for x in a.iloc[:, i]] == [type(x) for x in b.iloc[:, i]] for i in range(a.shape[1]))
+
+# Returns the fastest of repeat runs of load(file), and what it returned
+def _time(load, file: str, repeat: int):
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        df = load(file)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def main():
+    arg_parser = ArgumentParser(description="Time load_sheet against the loader that re-read the workbook")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=["1758", "1763", "Amelia"])
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    args = arg_parser.parse_args()
+
+    print(f"{'folder':<10} {'sheets':>7} {'rereading (s)':>14} {'load_sheet (s)':>15} {'speedup':>8} {'different':>10}")
+    for folder in args.folders:
+        old_seconds = 0
+        new_seconds = 0
+        different = []
+        files = find_files(args.data, [folder], args.limit)
+        for file in files:
+            seconds, old = _time(_load_sheet_rereading, file, args.repeat)
+            old_seconds += seconds
+            seconds, new = _time(load_sheet, file, args.repeat)
+            new_seconds += seconds
+            if not _same_frame(old, new):
+                different.append(path.basename(file))
+        print(f"{folder:<10} {len(files):>7} {old_seconds:>14.2f} {new_seconds:>15.2f} {old_seconds / max(new_seconds, 1e-9):>7.1f}x {len(different):>10}")
+        for name in different:
+            print(f"    different frame: {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from argparse import ArgumentParser
+from os import path, makedirs
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+from ..new_parser import parse_file
+from ..config import ParserConfig
+from ..transaction import open_output, read_transactions
+from .corpus import default_data, find_files
+
+# In this file: Compares writing the output of a sheet at once (output "json") against writing it one transaction group at a
+# time (output "json-stream" and "jsonl", with and without gzip), see transaction.py.
+# Reports the time, the peak memory python allocated while parsing and writing (tracemalloc, so everything runs slower than
+# usual) and the size of the output of every format, and checks that every format reads back as the same transactions and
+# that json-stream writes exactly the same bytes as json.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.output [--data ../data] [--folders Amelia] [--limit 3]
+
+# Parses file into folder with output / gzipped, returns (seconds, peak bytes, path of the output)
+def _run(file: str, folder: str, output: str, gzipped: bool, config: ParserConfig) -> tuple:
+    config = ParserConfig(**{**config.__dict__, "output": output, "output_gzip": gzipped})
+    target = path.join(folder, f"{output}{'.gz' if gzipped else ''}", path.basename(file))
+    tracemalloc.start()
+    start = perf_counter()
+    with open_output(target, config) as writer:
+        if output == "json":
+            writer.write_all(parse_file(file, config))
+        else:
+            parse_file(file, config, writer=writer)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, writer.path
+
+def main():
+    arg_parser = ArgumentParser(description="Compare peak memory of writing parser output at once and as it is parsed")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=["Amelia"], help="subfolders of data to use")
+    arg_parser.add_argument("--limit", type=int, default=3, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    files = find_files(args.data, args.folders, args.limit)
+    config = ParserConfig(profile=args.profile)
+    formats = [("json", False), ("json-stream", False), ("jsonl", False), ("jsonl", True), ("json", True)]
+
+    # Warm up the model so its loading isn't counted against the first format
+    parse_file(files[0], config)
+
+    with TemporaryDirectory() as folder:
+        for output, gzipped in formats:
+            makedirs(path.join(folder, f"{output}{'.gz' if gzipped else ''}"))
+
+        print(f"{'file':<24} {'format':<12} {'seconds':>8} {'peak (MB)':>10} {'size (KB)':>10} {'same':>5}")
+        for file in files:
+            expected = None
+            expected_bytes = None
+            for output, gzipped in formats:
+                try:
+                    elapsed, peak, written = _run(file, folder, output, gzipped, config)
+                except Exception as e:
+                    print(f"{path.basename(file):<24} {output:<12} failed: {e}")
+                    break
+                groups = list(read_transactions(written))
+                if expected is None:
+                    expected = groups
+                    with open(written, "rb") as f:
+                        expected_bytes = f.read()
+                same = groups == expected
+                if output == "json-stream":
+                    with open(written, "rb") as f:
+                        same = same and f.read() == expected_bytes
+                name = output + (".gz" if gzipped else "")
+                print(f"{path.basename(file):<24} {name:<12} {elapsed:>8.2f} {peak / 2 ** 20:>10.1f} {path.getsize(written) / 1024:>10.1f} {'yes' if same else 'NO':>5}")
+
+if __name__ == "__main__":
+    main()
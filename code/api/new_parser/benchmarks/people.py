@@ -0,0 +1,41 @@
+from argparse import ArgumentParser
+from os import path
+from time import perf_counter
+from ..new_parser import parse_file
+from ..parse_stats import ParseStats
+from ..config import ParserConfig
+from .corpus import default_data, find_files
+
+# In this file: Reports how many person lookups the PersonResolver of every parse answered from memory (see people.py).
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.people [--data ../data] [--folders Mahlon] [--limit 5]
+
+def main():
+    arg_parser = ArgumentParser(description="Count the person lookups saved on every sheet")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    config = ParserConfig(profile=args.profile)
+    total_lookups = 0
+    total_saved = 0
+    print(f"{'sheet':<32} {'lookups':>8} {'saved':>8} {'people (ms)':>12}")
+    start = perf_counter()
+    for file in find_files(args.data, args.folders, args.limit):
+        stats = ParseStats(file)
+        try:
+            parse_file(file, config, stats)
+        except Exception as e:
+            print(f"{path.basename(file):<32} failed: {e!r}")
+            continue
+        lookups = stats.counts.get("person lookups", 0)
+        saved = stats.counts.get("person lookups saved", 0)
+        total_lookups += lookups
+        total_saved += saved
+        print(f"{path.basename(file):<32} {lookups:>8} {saved:>8} {stats.stages.get('people', 0) * 1000:>12.2f}")
+    print(f"{total_saved} of {total_lookups} lookups saved in {perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
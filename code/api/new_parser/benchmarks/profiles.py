@@ -0,0 +1,78 @@
+from argparse import ArgumentParser
+from time import perf_counter
+import logging
+from ..new_parser import parse_file
+from ..config import ParserConfig
+from ..pipelines import profiles, get_pipeline, get_load_times
+from .corpus import default_data, find_files, group_rows, diff_outputs
+
+# In this file: Runs the Amelia and Mahlon corpus through every parser profile (see pipelines.py) and reports
+# how fast each one is and how much its output differs from the trf profile, so we can pick the fastest profile that still parses correctly.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.profiles [--profiles trf sm] [--data ../data] [--limit 5]
+
+default_folders = ("Amelia", "Mahlon")
+
+# Parses every file with one profile.
+# Returns ({filename: rows}, seconds spent parsing, number of rows parsed)
+def _run_profile(profile: str, files: list, batch_size: int):
+    # The annotation cache would make the second run of anything meaningless
+    config = ParserConfig(profile=profile, annotation_cache=None, batch_size=batch_size)
+    outputs = {}
+    total_time = 0
+    total_rows = 0
+    for file in files:
+        start = perf_counter()
+        try:
+            result = parse_file(file, config)
+        except Exception as e:
+            logging.warning(f"{profile}: failed to parse {file}: {e}")
+            result = []
+        total_time += perf_counter() - start
+        outputs[file] = group_rows(result)
+        total_rows += len(outputs[file])
+    return outputs, total_time, total_rows
+
+def main():
+    arg_parser = ArgumentParser(description="Compare the speed and output of the parser profiles")
+    arg_parser.add_argument("--profiles", nargs="+", default=list(profiles), choices=list(profiles))
+    arg_parser.add_argument("--data", default=default_data, help="folder containing the Amelia and Mahlon folders")
+    arg_parser.add_argument("--folders", nargs="+", default=list(default_folders))
+    arg_parser.add_argument("--limit", type=int, default=None, help="only parse the first n files of every folder")
+    arg_parser.add_argument("--batch-size", type=int, default=ParserConfig.batch_size)
+    args = arg_parser.parse_args()
+
+    files = find_files(args.data, args.folders, args.limit)
+
+    # trf is always run first since everything is compared against it
+    to_run = ["trf"] + [x for x in args.profiles if x != "trf"]
+
+    results = {}
+    for profile in to_run:
+        try:
+            get_pipeline(profile)
+        except OSError as e:
+            print(f"Skipping profile {profile}, its model is not installed ({e})")
+            continue
+        print(f"Running profile {profile} on {len(files)} files")
+        results[profile] = _run_profile(profile, files, args.batch_size)
+
+    if "trf" not in results:
+        print("Can't compare profiles without the trf baseline")
+        return
+
+    load_times = get_load_times()
+    baseline = results["trf"][0]
+    print()
+    print(f"{'profile':<10} {'load (s)':>9} {'parse (s)':>10} {'rows':>7} {'rows/s':>8} {'speedup':>8} {'rows differing':>15} {'tags differing':>15}")
+    for profile, (outputs, total_time, total_rows) in results.items():
+        compared, differs, tagging_differs, fields = diff_outputs(baseline, outputs)
+        rows_per_sec = total_rows / total_time if total_time else 0
+        speedup = results["trf"][1] / total_time if total_time else 0
+        print(f"{profile:<10} {load_times.get(profile, 0):>9.2f} {total_time:>10.2f} {total_rows:>7} {rows_per_sec:>8.1f} {speedup:>7.2f}x "
+              f"{f'{differs} ({differs / max(compared, 1):.1%})':>15} {f'{tagging_differs} ({tagging_differs / max(compared, 1):.1%})':>15}")
+        if fields:
+            print("    fields differing: " + ", ".join(f"{field} {count}" for field, count in sorted(fields.items(), key=lambda x: -x[1])))
+
+if __name__ == "__main__":
+    main()
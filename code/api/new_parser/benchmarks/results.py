@@ -0,0 +1,69 @@
+from argparse import ArgumentParser
+from os import listdir, path
+from shutil import copy
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from ..new_parser import parse_folder
+from ..config import ParserConfig
+from ..result_cache import ResultCache
+from .corpus import default_data
+
+# In this file: Times parse_folder on a copy of a data folder with an empty result cache, then again on a fresh copy of the
+# same workbooks (every sheet should be copied from the cache) and again with force_reparse, see result_cache.py.
+# Checks that the outputs of all three runs are the same, then shrinks the cache to half its size to check eviction.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.results [--data ../data] [--folder 1758] [--limit 8]
+
+# Returns {output file name: contents} of everything parse_folder wrote into folder
+def _outputs(folder: str) -> dict:
+    outputs = {}
+    for name in listdir(folder):
+        if ".json" in name or name.endswith(".exception"):
+            with open(path.join(folder, name), "rb") as file:
+                outputs[name] = file.read()
+    return outputs
+
+# Parses a fresh copy of the first limit sheets in source, returns (seconds, outputs)
+def _run(source: str, limit: int, config: ParserConfig) -> tuple:
+    names = sorted(x for x in listdir(source) if x.split(".")[-1] in ["xls", "xlsx"])[:limit]
+    with TemporaryDirectory() as folder:
+        for name in names:
+            copy(path.join(source, name), folder)
+        start = perf_counter()
+        parse_folder(folder, None, config)
+        elapsed = perf_counter() - start
+        return elapsed, _outputs(folder)
+
+# Returns (entries, bytes) in the result cache at folder
+def _size(folder: str) -> tuple:
+    names = [x for x in listdir(folder) if not x.endswith(".stats")]
+    return len(names), sum(path.getsize(path.join(folder, x)) for x in listdir(folder))
+
+def main():
+    arg_parser = ArgumentParser(description="Compare parsing a folder against copying its outputs from the result cache")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folder", default="1758", help="subfolder of data to parse")
+    arg_parser.add_argument("--limit", type=int, default=8, help="only parse the first n files of the folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    source = path.join(args.data, args.folder)
+    with TemporaryDirectory() as cache:
+        config = ParserConfig(profile=args.profile, result_cache=cache)
+        runs = {}
+        for name, run_config in (("cold", config), ("cached", config), ("forced", ParserConfig(**{**config.__dict__, "force_reparse": True}))):
+            elapsed, outputs = _run(source, args.limit, run_config)
+            runs[name] = outputs
+            print(f"{name:>8}: {elapsed:.2f}s, {len(outputs)} outputs")
+
+        for name in ("cached", "forced"):
+            differing = sorted(x for x in runs["cold"].keys() | runs[name].keys() if runs["cold"].get(x) != runs[name].get(x))
+            print(f"{name} vs cold: {len(differing)} differing outputs {' '.join(differing)}")
+
+        entries, size = _size(cache)
+        ResultCache(cache, max_bytes=size // 2).evict()
+        after_entries, after_size = _size(cache)
+        print(f"Eviction to {size // 2} bytes: {entries} entries ({size} bytes) -> {after_entries} entries ({after_size} bytes)")
+
+if __name__ == "__main__":
+    main()
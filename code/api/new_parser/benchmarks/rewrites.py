@@ -0,0 +1,85 @@
+from argparse import ArgumentParser
+from time import perf_counter
+import re
+from ..parser_utils import get_col
+from ..rewrites import get_rewrite_stats, reset_rewrite_stats
+from ..preprocessor import _entry_scanner, _prepare_row, _price_pattern, price_regex
+from .corpus import default_data, find_files, load_rows
+
+# In this file: Micro-benchmark of the preprocessor's regex rewrites over every Entry cell in the data folder.
+# Compares the old chain of uncompiled re.sub calls for dates, fancy prices, £ and tobacco marks against the compiled rewrites run
+# one after the other and against the single scan, checks that all three give the same text, and prints the per-pattern counters of a full _prepare_row pass.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.rewrites [--data ../data] [--repeat 5]
+
+# The four rewrites exactly as the preprocessor used to run them
+def _sub_chain(text: str, rewrites: list) -> str:
+    for rewrite in rewrites:
+        text = re.sub(rewrite.pattern.pattern, rewrite.repl, text)
+    return text
+
+# Runs f over every entry repeat times, returning (outputs, best time)
+def _time(f, entries: list, repeat: int):
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        out = [f(x) for x in entries]
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return out, best
+
+def main():
+    arg_parser = ArgumentParser(description="Benchmark the preprocessor's regex rewrites")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    rows = load_rows(find_files(args.data))
+    entries = [x for x in (get_col(row, "Entry") for row in rows) if isinstance(x, str)]
+    words = [word for entry in entries for word in entry.split()]
+    print(f"{len(entries)} entry cells, {len(words)} words")
+
+    rewrites = _entry_scanner.rewrites
+    chain_out, chain_time = _time(lambda x: _sub_chain(x, rewrites), entries, args.repeat)
+    ordered_out, ordered_time = _time(_entry_scanner._sub_in_order, entries, args.repeat)
+    scan_out, scan_time = _time(_entry_scanner.sub, entries, args.repeat)
+
+    ordered_mismatches = sum(a != b for a, b in zip(chain_out, ordered_out))
+    scan_mismatches = sum(a != b for a, b in zip(chain_out, scan_out))
+
+    print()
+    print(f"{'markers':<28} {'time (ms)':>10} {'us/entry':>9} {'speedup':>8} {'mismatches':>11}")
+    for name, elapsed, mismatches in (("re.sub chain", chain_time, 0), ("compiled, one at a time", ordered_time, ordered_mismatches), ("compiled, single scan", scan_time, scan_mismatches)):
+        print(f"{name:<28} {elapsed * 1000:>10.1f} {elapsed / len(entries) * 1e6:>9.2f} {chain_time / elapsed:>7.2f}x {mismatches:>11}")
+
+    # Token level price checks, run once per token in the token combination pass
+    uncompiled_out, uncompiled_time = _time(lambda x: re.match(price_regex, x) is not None, words, args.repeat)
+    compiled_out, compiled_time = _time(lambda x: _price_pattern.match(x) is not None, words, args.repeat)
+    print()
+    print(f"price_regex per word: re.match {uncompiled_time / len(words) * 1e9:.0f}ns, compiled {compiled_time / len(words) * 1e9:.0f}ns, "
+          f"{sum(a != b for a, b in zip(uncompiled_out, compiled_out))} mismatches")
+
+    # Everything _prepare_row does, broken down by pattern
+    reset_rewrite_stats()
+    start = perf_counter()
+    for row in rows:
+        _prepare_row(row)
+    total = perf_counter() - start
+    print()
+    print(f"_prepare_row: {len(rows)} rows in {total * 1000:.1f}ms ({len(rows) / total:.0f} rows/s)")
+    print(f"{'pattern':<28} {'calls':>8} {'matches':>8} {'time (ms)':>10}")
+    for name, stats in sorted(get_rewrite_stats().items(), key=lambda x: -x[1]["seconds"]):
+        print(f"{name:<28} {stats['calls']:>8} {stats['matches']:>8} {stats['seconds'] * 1000:>10.2f}")
+
+    if ordered_mismatches or scan_mismatches:
+        print()
+        print("Rewrites do not match the re.sub chain!")
+        for a, b, entry in zip(chain_out, scan_out, entries):
+            if a != b:
+                print(repr(entry))
+                print(f"  expected {a!r}")
+                print(f"  got      {b!r}")
+
+if __name__ == "__main__":
+    main()
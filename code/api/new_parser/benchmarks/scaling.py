@@ -0,0 +1,58 @@
+from argparse import ArgumentParser
+from time import perf_counter
+import pandas as pd
+from ..new_parser import load_sheet, parse
+from ..parser_utils import get_col
+from ..parse_stats import ParseStats
+from ..config import ParserConfig
+from .corpus import default_data, find_files
+
+# In this file: Checks that get_transactions scales linearly with the number of rows in a sheet.
+# Builds synthetic sheets from the first row of a real sheet, with made up entries and every row on the same account
+# and without totals, so the whole sheet is one list of transactions (the worst case for anything that scans that list per row).
+# Prints the time per row of the whole parse and of the people fix-ups, which should stay flat as sheets grow.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.scaling [--rows 500 1000 2000 5000] [--data ../data]
+
+_entries = [
+    "To 1 [pound] Tea",
+    "To 2 Yards Linen @ 2/",
+    "To Cash paid John Smith",
+    "To 1 Hat for your Wife",
+    "To 3 Gallons Rum @ 3/",
+    "To Sundries per William Brown",
+]
+
+# Returns a sheet of n rows, all copies of template apart from their EntryID, Entry and GenMat
+def _synthetic_sheet(template: pd.Series, n: int) -> pd.DataFrame:
+    df = pd.DataFrame([template] * n).reset_index(drop=True)
+    df[get_col(df, "EntryID").name] = [f"S_{i + 1}" for i in range(n)]
+    df[get_col(df, "Entry").name] = [_entries[i % len(_entries)] for i in range(n)]
+    df[get_col(df, "GenMat").name] = [i % 2 for i in range(n)]
+    return df
+
+def main():
+    arg_parser = ArgumentParser(description="Time parsing synthetic sheets of growing size")
+    arg_parser.add_argument("--rows", type=int, nargs="+", default=[500, 1000, 2000, 5000])
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--sheet", default=None, help="sheet to take the template row from, the first one in data by default")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    template = load_sheet(args.sheet or find_files(args.data)[0]).iloc[0]
+    config = ParserConfig(profile=args.profile)
+
+    print(f"{'rows':>6} {'transactions':>13} {'total (s)':>10} {'ms/row':>8} {'people ms/row':>14}")
+    for n in args.rows:
+        df = _synthetic_sheet(template, n)
+        stats = ParseStats(f"synthetic {n}")
+        start = perf_counter()
+        with stats.collect():
+            result = parse(df, config)
+        elapsed = perf_counter() - start
+        transactions = sum(len(x) for x in result)
+        people = stats.stages.get("people", 0)
+        print(f"{n:>6} {transactions:>13} {elapsed:>10.2f} {elapsed / n * 1000:>8.3f} {people / n * 1000:>14.3f}")
+
+if __name__ == "__main__":
+    main()
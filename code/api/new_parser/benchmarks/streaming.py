@@ -0,0 +1,117 @@
+from argparse import ArgumentParser
+from os import path
+from time import perf_counter
+import tracemalloc
+from ..new_parser import load_sheet
+from ..sheet_stream import open_sheet, LOOKAHEAD
+from .corpus import default_data, find_files
+
+# In this file: Compares reading sheets with load_sheet (a whole DataFrame, walked with iterrows) against the streaming reader in sheet_stream.py.
+# First checks that every row the stream yields holds the same values, of the same types, as the DataFrame's row,
+# then reports time to the first row, time to read every row and peak memory of both readers, for .xlsx and .xls files apart
+# (xlrd loads every cell of an .xls sheet whichever way it is read).
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.streaming [--data ../data] [--folders Mahlon] [--limit 5] [--lookahead 128]
+
+def _same(a, b) -> bool:
+    if type(a) is not type(b):
+        return False
+    try:
+        if a != a:
+            return b != b
+    except (TypeError, ValueError):
+        pass
+    return a == b
+
+# Returns a description of the first difference between the stream and the DataFrame of file, or None if they match
+def _compare(file: str, lookahead: int):
+    try:
+        df = load_sheet(file)
+    except Exception as e:
+        df_error = repr(e)
+    else:
+        df_error = None
+    try:
+        stream = open_sheet(file, lookahead)
+    except Exception as e:
+        stream_error = repr(e)
+    else:
+        stream_error = None
+    if df_error or stream_error:
+        return None if df_error == stream_error else f"load_sheet raised {df_error}, stream raised {stream_error}"
+
+    if list(df.columns) != stream.columns.names:
+        return f"columns differ: {list(df.columns)} vs {stream.columns.names}"
+    n = 0
+    for (key, row), (stream_key, record) in zip(df.iterrows(), stream):
+        n += 1
+        if key != stream_key:
+            return f"row {n} has index {key} in the df but {stream_key} in the stream"
+        for column, a, b in zip(df.columns, row.values, record.values):
+            if not _same(a, b):
+                return f"row {key} column {column}: {a!r} ({type(a).__name__}) vs {b!r} ({type(b).__name__})"
+    if n != len(df) or sum(1 for x in stream) != len(df):
+        return f"df has {len(df)} rows, stream has {sum(1 for x in stream)}"
+    return None
+
+# Reads every row of file with reader, returning (seconds to the first row, seconds to the last row, peak bytes allocated)
+def _measure(reader, file: str):
+    tracemalloc.start()
+    start = perf_counter()
+    first = None
+    for key, row in reader(file):
+        if first is None:
+            first = perf_counter() - start
+    total = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (first if first is not None else total), total, peak
+
+def _read_df(file: str):
+    return load_sheet(file).iterrows()
+
+def main():
+    arg_parser = ArgumentParser(description="Check and benchmark the streaming sheet reader")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--lookahead", type=int, default=LOOKAHEAD, help="rows the stream reads ahead, see sheet_stream.py")
+    args = arg_parser.parse_args()
+    read_stream = lambda file: open_sheet(file, args.lookahead)
+
+    files = find_files(args.data, args.folders, args.limit)
+
+    mismatches = 0
+    for file in files:
+        difference = _compare(file, args.lookahead)
+        if difference is not None:
+            mismatches += 1
+            print(f"{path.basename(file)}: {difference}")
+    print(f"{len(files) - mismatches} of {len(files)} files read identically")
+
+    print()
+    print(f"{'file':<32} {'first row df/stream (ms)':>25} {'all rows df/stream (ms)':>24} {'peak df/stream (KiB)':>21}")
+    # Extension -> totals of the measurements below
+    totals = {}
+    for file in files:
+        try:
+            measured = _measure(_read_df, file) + _measure(read_stream, file)
+        except Exception:
+            continue
+        df_first, df_total, df_peak, stream_first, stream_total, stream_peak = measured
+        extension = file.split(".")[-1]
+        total = totals.setdefault(extension, [0] * 7)
+        for i, x in enumerate((df_first, stream_first, df_total, stream_total, df_peak, stream_peak)):
+            total[i] = max(total[i], x) if i >= 4 else total[i] + x
+        total[6] += 1
+        print(f"{path.basename(file):<32} {f'{df_first * 1000:.1f} / {stream_first * 1000:.1f}':>25} {f'{df_total * 1000:.1f} / {stream_total * 1000:.1f}':>24} "
+              f"{f'{df_peak // 1024} / {stream_peak // 1024}':>21}")
+    for extension, total in sorted(totals.items()):
+        print()
+        print(f".{extension} ({total[6]} files):")
+        print(f"Total time to first row: df {total[0]:.2f}s, stream {total[1]:.2f}s")
+        print(f"Total time to read every row: df {total[2]:.2f}s, stream {total[3]:.2f}s")
+        print(f"Largest peak memory: df {total[4] // 1024} KiB, stream {total[5] // 1024} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+from ..new_parser import parse_file
+from ..parse_stats import ParseStats
+from ..config import ParserConfig
+from .corpus import default_data, find_files
+
+# In this file: Measures what the token rules of get_transactions (see token_rules.py) cost per token over the corpus,
+# using the "token rules" stage and the token count of the parse stats.
+# Every file is parsed repeat times and its fastest run is used, the annotation cache keeps the runs after the first short.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.token_rules [--repeat 5] [--data ../data] [--folders Mahlon] [--limit 5]
+
+def main():
+    arg_parser = ArgumentParser(description="Time the token rules of get_transactions per token")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    config = ParserConfig(profile=args.profile)
+    seconds = 0
+    tokens = 0
+    files = 0
+    for file in find_files(args.data, args.folders, args.limit):
+        best = None
+        for i in range(args.repeat):
+            stats = ParseStats(file)
+            try:
+                parse_file(file, config, stats)
+            except Exception:
+                break
+            if best is None or stats.stages.get("token rules", 0) < best.stages.get("token rules", 0):
+                best = stats
+        if best is None:
+            continue
+        files += 1
+        seconds += best.stages.get("token rules", 0)
+        tokens += best.counts.get("tokens", 0)
+
+    print(f"{files} files, {tokens} tokens, {seconds * 1000:.1f} ms in token rules, {seconds / max(tokens, 1) * 1e6:.2f} us per token")
+
+if __name__ == "__main__":
+    main()
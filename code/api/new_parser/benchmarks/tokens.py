@@ -0,0 +1,97 @@
+from argparse import ArgumentParser
+from os import path
+from time import perf_counter
+import tracemalloc
+from ..new_parser import load_sheet
+from ..preprocessor import preprocess
+from ..token_stream import TokenStream
+from .corpus import default_data, find_files
+
+# In this file: Measures TokenStream (see token_stream.py) against the lists of (text, info, pos) tuples it replaced,
+# on the token stacks preprocess produces for the largest sheets in the corpus.
+# Memory is what holding every token stack of a sheet costs. The old lists are rebuilt with their own copy of every label,
+# like the ones spacy's annotations were deserialized into.
+# Time is the access pattern of get_transactions and handle_multiple_prices: walking each entry with its neighbours,
+# slicing off the rest of it, and copying it token by token.
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.tokens [--sheets 5] [--repeat 5] [--data ../data]
+
+# Returns the token stacks preprocess produces for the sheet at file
+def _token_stacks(file: str) -> list:
+    stacks = []
+    for parsed_entries_in_row, row in preprocess(load_sheet(file)):
+        stacks += [x for x in parsed_entries_in_row if isinstance(x, TokenStream)]
+    return stacks
+
+def _as_tuples(stacks: list) -> list:
+    return [[(text, info.encode().decode(), tag.encode().decode()) for text, info, tag in stack] for stack in stacks]
+
+# Bytes allocated by build(stacks) that are still held once it returns
+def _memory(build, stacks: list) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build(stacks)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del built
+    return after - before
+
+def _walk(stacks: list):
+    n = 0
+    for entry in stacks:
+        for i, (word, info, pos) in enumerate(entry):
+            if i - 1 >= 0:
+                prev_word, prev_info, prev_pos = entry[i - 1]
+            if i + 1 < len(entry):
+                next_word, next_info, next_pos = entry[i + 1]
+            for w, e_m, tag in entry[i + 1:]:
+                n += 1
+        # handle_multiple_prices copies every token into the entries it splits off
+        if isinstance(entry, TokenStream):
+            copy = TokenStream()
+            for i in range(len(entry)):
+                copy.append_from(entry, i)
+        else:
+            copy = []
+            for word, info, pos in entry:
+                copy.append((word, info, pos))
+    return n
+
+def _time(stacks: list, repeat: int) -> float:
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        _walk(stacks)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    arg_parser = ArgumentParser(description="Compare the memory and speed of TokenStream against lists of tuples")
+    arg_parser.add_argument("--sheets", type=int, default=5, help="number of the largest sheets to use")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--data", default=default_data)
+    args = arg_parser.parse_args()
+
+    sizes = []
+    for file in find_files(args.data):
+        try:
+            sizes.append((len(load_sheet(file)), file))
+        except Exception:
+            continue
+    largest = [file for n, file in sorted(sizes, reverse=True)[:args.sheets]]
+
+    print(f"{'sheet':<28} {'tokens':>7} {'tuples (KiB)':>13} {'stream (KiB)':>13} {'tuples (ms)':>12} {'stream (ms)':>12}")
+    for file in largest:
+        stacks = _token_stacks(file)
+        tuples = _as_tuples(stacks)
+        n_tokens = sum(len(x) for x in stacks)
+        tuple_memory = _memory(_as_tuples, stacks)
+        stream_memory = _memory(lambda x: [TokenStream(stack) for stack in x], tuples)
+        tuple_time = _time(tuples, args.repeat)
+        stream_time = _time(stacks, args.repeat)
+        print(f"{path.basename(file):<28} {n_tokens:>7} {tuple_memory / 1024:>13.1f} {stream_memory / 1024:>13.1f} {tuple_time * 1000:>12.2f} {stream_time * 1000:>12.2f}")
+
+if __name__ == "__main__":
+    main()
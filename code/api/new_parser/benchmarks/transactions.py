@@ -0,0 +1,52 @@
+from argparse import ArgumentParser
+from io import StringIO
+from json import dump
+from time import perf_counter
+from ..new_parser import parse_file
+from ..parse_stats import ParseStats
+from ..config import ParserConfig
+from ..transaction import write_transactions
+from .corpus import default_data, find_files
+
+# In this file: Measures what parse spends on transactions after get_transactions is done with them (the clean pass and
+# backsolving, which used to copy every transaction twice) and what writing them out as json costs, with json.dump and
+# with write_transactions (see transaction.py).
+# Run from the code folder with:
+# python -m api.new_parser.benchmarks.transactions [--data ../data] [--folders Mahlon] [--limit 5]
+
+def main():
+    arg_parser = ArgumentParser(description="Time the clean up and writing out of transactions")
+    arg_parser.add_argument("--data", default=default_data)
+    arg_parser.add_argument("--folders", nargs="+", default=None, help="subfolders of data to use, all of them by default")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first n files of every folder")
+    arg_parser.add_argument("--profile", default=ParserConfig.profile)
+    args = arg_parser.parse_args()
+
+    config = ParserConfig(profile=args.profile)
+    transactions = 0
+    clean_up = 0
+    dump_seconds = 0
+    write_seconds = 0
+    for file in find_files(args.data, args.folders, args.limit):
+        stats = ParseStats(file)
+        try:
+            out = parse_file(file, config, stats)
+        except Exception:
+            continue
+        transactions += stats.counts.get("transactions", 0)
+        clean_up += stats.stages.get("clean pass", 0) + stats.stages.get("backsolve", 0)
+
+        start = perf_counter()
+        dump(out, StringIO())
+        dump_seconds += perf_counter() - start
+
+        start = perf_counter()
+        write_transactions(out, StringIO())
+        write_seconds += perf_counter() - start
+
+    print(f"{transactions} transactions")
+    print(f"clean pass and backsolve: {clean_up * 1000:.1f} ms, {clean_up / max(transactions, 1) * 1e6:.2f} us per transaction")
+    print(f"json.dump: {dump_seconds * 1000:.1f} ms, write_transactions: {write_seconds * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+from argparse import ArgumentParser
+from dataclasses import replace
+from glob import glob, has_magic
+from json import load
+from os import listdir, path, remove
+from sys import stderr
+from time import perf_counter
+import logging
+from .config import default_config
+from .new_parser import parse_sheets
+from .parse_stats import stats_path
+from .transaction import output_extensions
+
+# In this file: Command line for parsing sheets in bulk on a local machine, e.g. every reel under data/ to compare parser versions.
+# Takes any number of folders, sheets and globs, parses them (on --workers processes, see parse_sheets) and prints how long every
+# sheet took, rows per second, how many errors the sheets had by code and the slowest sheets. Everything it reports comes from
+# the stats every parse writes (see parse_stats.py). Sheets copied from the result cache are listed as such and left out of the
+# timings, their stats are those of whatever parse stored them.
+# Run from the code folder with e.g.:
+# python -m api.new_parser.cli ../data --out ../out --workers 4
+# python -m api.new_parser.cli "../data/17*" ../data/Amelia/C_1760_001_FINAL_.xlsx --output jsonl --gzip
+# Settings not given on the command line come from the PARSER_* environment variables like everywhere else (see config.py),
+# except for the result cache, which is only used with --cache so that timings are of actual parses.
+
+def _is_sheet(filename: str) -> bool:
+    return filename.split(".")[-1] in ["xls", "xlsx"]
+
+# Returns (folder, filename) of every sheet in paths, which can be sheets, folders of sheets or globs matching either.
+# A folder with no sheets in it but folders of sheets (like data/) stands for the sheets in those.
+def find_sheets(paths: list) -> list:
+    sheets = []
+    seen = set()
+
+    def add(file: str):
+        file = path.normpath(file)
+        if file not in seen:
+            seen.add(file)
+            sheets.append((path.dirname(file), path.basename(file)))
+
+    for pattern in paths:
+        for match in (sorted(glob(pattern, recursive=True)) if has_magic(pattern) else [pattern]):
+            if path.isdir(match):
+                names = sorted(listdir(match))
+                if not any(_is_sheet(x) for x in names):
+                    names = [path.join(x, y) for x in names if path.isdir(path.join(match, x)) for y in sorted(listdir(path.join(match, x)))]
+                for name in names:
+                    if _is_sheet(name):
+                        add(path.join(match, name))
+            elif path.isfile(match) and _is_sheet(match):
+                add(match)
+            elif not has_magic(pattern):
+                raise FileNotFoundError(f"No sheet or folder at {match}")
+    return sheets
+
+# Returns what parse_sheets left for a sheet in out_folder: its stats summary, or {"exception": first line} if it failed
+def _read_result(filename: str, out_folder: str) -> dict:
+    exception = path.join(out_folder, filename) + ".exception"
+    if path.exists(exception):
+        with open(exception) as file:
+            return {"exception": file.readline().strip()}
+    stats = stats_path(path.join(out_folder, filename))
+    if path.exists(stats):
+        with open(stats) as file:
+            return load(file)
+    return {"exception": "no output"}
+
+def _rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:.1f}" if seconds > 0 and rows > 0 else "-"
+
+def main(args: list = None):
+    arg_parser = ArgumentParser(prog="python -m api.new_parser", description="Parse folders of sheets and report throughput")
+    arg_parser.add_argument("paths", nargs="+", help="sheets, folders of sheets or globs matching them")
+    arg_parser.add_argument("--out", default=None, help="folder to write outputs to (in a subfolder per input folder), next to the sheets by default")
+    arg_parser.add_argument("--workers", type=int, default=default_config.file_workers, help="processes to parse sheets on")
+    arg_parser.add_argument("--output", choices=list(output_extensions), default=default_config.output, help="output format, see transaction.py")
+    arg_parser.add_argument("--gzip", action="store_true", default=default_config.output_gzip, help="gzip outputs")
+    arg_parser.add_argument("--profile", default=default_config.profile, help="spacy profile, see pipelines.py")
+    arg_parser.add_argument("--fast-path", action="store_true", default=default_config.fast_path, help="tag formulaic entries with rules")
+    arg_parser.add_argument("--cache", action="store_true", help="copy outputs of unchanged sheets from the result cache")
+    arg_parser.add_argument("--force", action="store_true", help="with --cache, parse every sheet again anyway")
+    arg_parser.add_argument("--slowest", type=int, default=10, help="number of slowest sheets to list")
+    arg_parser.add_argument("--verbose", action="store_true", help="log everything the parser logs")
+    args = arg_parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    config = replace(default_config, file_workers=args.workers, output=args.output, output_gzip=args.gzip, profile=args.profile,
+                     fast_path=args.fast_path, result_cache=default_config.result_cache if args.cache else None, force_reparse=args.force)
+
+    found = find_sheets(args.paths)
+    if not found:
+        print("No sheets found", file=stderr)
+        return
+    sheets = [(folder, filename, path.join(args.out, path.basename(path.abspath(folder))) if args.out else folder) for folder, filename in found]
+
+    # What is left from earlier runs would be reported as this run's
+    for folder, filename, out_folder in sheets:
+        for stale in (path.join(out_folder, filename) + ".exception", stats_path(path.join(out_folder, filename))):
+            if path.exists(stale):
+                remove(stale)
+
+    # Progress on one line that keeps being overwritten, only if someone is watching
+    set_progress = None
+    if stderr.isatty():
+        set_progress = lambda value: print(f"\rParsed {value:.0%}", end="", file=stderr, flush=True)
+
+    print(f"Parsing {len(sheets)} sheets on {config.file_workers} worker{'s' if config.file_workers != 1 else ''}", file=stderr)
+    start = perf_counter()
+    parse_sheets(sheets, set_progress, config)
+    elapsed = perf_counter() - start
+    if set_progress is not None:
+        print(file=stderr)
+
+    results = [(path.join(folder, filename), _read_result(filename, out_folder)) for folder, filename, out_folder in sheets]
+    width = max(len(x) for x, result in results)
+    print(f"{'sheet':<{width}} {'rows':>6} {'transactions':>12} {'errors':>6} {'seconds':>8} {'rows/s':>8}")
+    for sheet, result in results:
+        if "exception" in result:
+            print(f"{sheet:<{width}} failed: {result['exception']}")
+            continue
+        counts = result["counts"]
+        if result.get("cached"):
+            print(f"{sheet:<{width}} {counts.get('rows', 0):>6} {counts.get('transactions', 0):>12} {counts.get('errors', 0):>6} {'cached':>8}")
+            continue
+        print(f"{sheet:<{width}} {counts.get('rows', 0):>6} {counts.get('transactions', 0):>12} {counts.get('errors', 0):>6} "
+              f"{result['seconds']:>8.2f} {_rate(counts.get('rows', 0), result['seconds']):>8}")
+
+    done = [result for sheet, result in results if "exception" not in result]
+    parsed = [result for result in done if not result.get("cached")]
+    rows = sum(x["counts"].get("rows", 0) for x in parsed)
+    seconds = sum(x["seconds"] for x in parsed)
+    print()
+    print(f"{len(parsed)} sheets parsed, {len(done) - len(parsed)} copied from the cache, {len(results) - len(done)} failed, "
+          f"{rows} rows, {sum(x['counts'].get('transactions', 0) for x in parsed)} transactions parsed")
+    print(f"{elapsed:.2f}s wall, {_rate(rows, elapsed)} rows/s; {seconds:.2f}s parsing, {_rate(rows, seconds)} rows/s per worker")
+
+    # Cached outputs have errors in them all the same
+    errors = {}
+    for result in done:
+        for code, n in result.get("errors", {}).items():
+            errors[code] = errors.get(code, 0) + n
+    if errors:
+        print()
+        print("Errors by code:")
+        for code, n in sorted(errors.items(), key=lambda x: -x[1]):
+            print(f"  {code}: {n}")
+
+    if args.slowest > 0 and parsed:
+        print()
+        print("Slowest sheets:")
+        slowest = sorted((x for x in results if "exception" not in x[1] and not x[1].get("cached")), key=lambda x: -x[1]["seconds"])[:args.slowest]
+        for sheet, result in slowest:
+            print(f"  {sheet}: {result['seconds']:.2f}s, {_rate(result['counts'].get('rows', 0), result['seconds'])} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from os import environ
+from typing import Optional
+from .annotation_cache import default_cache_path
+from .pipelines import default_profile
+from .result_cache import default_result_cache_path
+from .sheet_stream import LOOKAHEAD
+
+# In this file: Settings that control how the parser runs (as opposed to what it outputs).
+# Every parser entry point takes an optional ParserConfig, if none is given default_config is used.
+# default_config can be tuned for a deployment through PARSER_* environment variables, e.g. PARSER_BATCH_SIZE=128.
+
+@dataclass
+class ParserConfig:
+    # Which spacy model (and which of its components) tags the entries, see pipelines.profiles
+    profile: str = default_profile
+
+    # Tag formulaic entries (e.g. "To Cash 5/:") with rules instead of spacy, see fast_tagger.py
+    fast_path: bool = False
+
+    # Number of smaller entries spacy annotates per batch in nlp.pipe
+    batch_size: int = 64
+
+    # Maximum number of smaller entries preprocess reads ahead of the row it is currently yielding
+    lookahead: int = 256
+
+    # Number of processes preprocess spreads rows across, 1 means everything runs in this process
+    workers: int = 1
+
+    # Number of processes parse_folder spreads the files of a folder across, 1 parses them one after the other in this process.
+    # Every file is then parsed entirely in one worker (with workers treated as 1).
+    file_workers: int = 1
+
+    # Number of rows sent to a preprocessing worker at a time
+    worker_chunk_rows: int = 16
+
+    # Path of the SQLite annotation cache, None turns the cache off
+    annotation_cache: Optional[str] = default_cache_path
+
+    # Maximum number of smaller entries kept in the annotation cache
+    annotation_cache_size: int = 500000
+
+    # Read sheets row by row with openpyxl/xlrd instead of loading them into a DataFrame first, see sheet_stream.py
+    streaming: bool = False
+
+    # Rows the stream reads ahead of the one being parsed when streaming. Columns only get the types pandas would give them if
+    # every new kind of value in them shows up within this many rows, see sheet_stream.py.
+    stream_lookahead: int = LOOKAHEAD
+
+    # Reuse what preprocess produced for rows that haven't changed since the sheet was last parsed, see row_cache.py
+    incremental: bool = False
+
+    # Seconds backsolving may spend on the prices of one entry before giving up on it with an error, see backsolve.py
+    backsolve_seconds: float = 1.0
+
+    # Format parse_folder writes the output of a sheet in: "json", "json-stream" or "jsonl", see transaction.py
+    output: str = "json"
+
+    # gzip the output of every sheet
+    output_gzip: bool = False
+
+    # Folder of the cache of whole sheet outputs parse_folder reuses for workbooks it has parsed before, None turns it off.
+    # See result_cache.py.
+    result_cache: Optional[str] = default_result_cache_path
+
+    # Size in bytes the result cache is kept under, and days an output stays in it without being used
+    result_cache_bytes: int = 2 * 2 ** 30
+    result_cache_days: float = 30
+
+    # Parse every sheet again even if the result cache has its output (the new output still goes into the cache)
+    force_reparse: bool = False
+
+    # File name (or path) of a sheet to run under cProfile, its profile is written to stats/<sheet name>.prof next to it
+    cprofile: Optional[str] = None
+
+    # Creates a config from PARSER_* environment variables, using the defaults above for anything not set
+    @classmethod
+    def from_env(cls):
+        config = cls()
+        if "PARSER_PROFILE" in environ:
+            config.profile = environ["PARSER_PROFILE"]
+        if "PARSER_FAST_PATH" in environ:
+            config.fast_path = environ["PARSER_FAST_PATH"].lower() in ("1", "true", "yes")
+        if "PARSER_BATCH_SIZE" in environ:
+            config.batch_size = int(environ["PARSER_BATCH_SIZE"])
+        if "PARSER_LOOKAHEAD" in environ:
+            config.lookahead = int(environ["PARSER_LOOKAHEAD"])
+        if "PARSER_WORKERS" in environ:
+            config.workers = int(environ["PARSER_WORKERS"])
+        if "PARSER_FILE_WORKERS" in environ:
+            config.file_workers = int(environ["PARSER_FILE_WORKERS"])
+        if "PARSER_ANNOTATION_CACHE" in environ:
+            # An empty value turns the cache off
+            config.annotation_cache = environ["PARSER_ANNOTATION_CACHE"] or None
+        if "PARSER_ANNOTATION_CACHE_SIZE" in environ:
+            config.annotation_cache_size = int(environ["PARSER_ANNOTATION_CACHE_SIZE"])
+        if "PARSER_STREAMING" in environ:
+            config.streaming = environ["PARSER_STREAMING"].lower() in ("1", "true", "yes")
+        if "PARSER_STREAM_LOOKAHEAD" in environ:
+            config.stream_lookahead = int(environ["PARSER_STREAM_LOOKAHEAD"])
+        if "PARSER_INCREMENTAL" in environ:
+            config.incremental = environ["PARSER_INCREMENTAL"].lower() in ("1", "true", "yes")
+        if "PARSER_BACKSOLVE_SECONDS" in environ:
+            config.backsolve_seconds = float(environ["PARSER_BACKSOLVE_SECONDS"])
+        if "PARSER_OUTPUT" in environ:
+            config.output = environ["PARSER_OUTPUT"]
+        if "PARSER_OUTPUT_GZIP" in environ:
+            config.output_gzip = environ["PARSER_OUTPUT_GZIP"].lower() in ("1", "true", "yes")
+        if "PARSER_RESULT_CACHE" in environ:
+            # An empty value turns the cache off
+            config.result_cache = environ["PARSER_RESULT_CACHE"] or None
+        if "PARSER_RESULT_CACHE_BYTES" in environ:
+            config.result_cache_bytes = int(environ["PARSER_RESULT_CACHE_BYTES"])
+        if "PARSER_RESULT_CACHE_DAYS" in environ:
+            config.result_cache_days = float(environ["PARSER_RESULT_CACHE_DAYS"])
+        if "PARSER_FORCE_REPARSE" in environ:
+            config.force_reparse = environ["PARSER_FORCE_REPARSE"].lower() in ("1", "true", "yes")
+        if "PARSER_CPROFILE" in environ:
+            config.cprofile = environ["PARSER_CPROFILE"] or None
+        return config
+
+default_config = ParserConfig.from_env()
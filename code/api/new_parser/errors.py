@@ -0,0 +1,77 @@
+from traceback import TracebackException
+
+# In this file: The errors the parser writes into the "errors" of transactions.
+# An error used to be its finished message, built with an f-string (often embedding a whole entry) or traceback.format_exc()
+# right where it happened, even though most of them are only ever read once the sheet's output is written.
+# A ParserError keeps a code, a message template, the values that go into it, the row it came from and the traceback of the
+# exception behind it (if any), and only turns into its message when the output is written (see render_errors), by then it reads exactly as before.
+# The codes also let parse_file count the errors of a sheet by kind into its stats (see parse_stats.py).
+
+# Error codes
+BAD_ENTRY = "bad_entry"
+NO_ITEM = "no_item"
+NO_PRICE = "no_price"
+NO_PRICE_OR_COMMODITY = "no_price_or_commodity"
+PRICE_PARSING = "price_parsing"
+ROW_CONTEXT = "row_context"
+GENMAT_NO_PEOPLE = "genmat_no_people"
+QUANTITY_PARSING = "quantity_parsing"
+COLONY_CURRENCY_PARSING = "colony_currency_parsing"
+STERLING_CURRENCY_PARSING = "sterling_currency_parsing"
+COMMODITY_TOTALING = "commodity_totaling"
+CURRENCY_TOTALING = "currency_totaling"
+TOBACCO_WEIGHTS = "tobacco_weights"
+TOBACCO_FINAL_WEIGHT = "tobacco_final_weight"
+COMPLEX_NOTE = "complex_note"
+CONJUNCTION = "conjunction"
+AMOUNT_PARSING = "amount_parsing"
+FRACTION = "fraction"
+BACKSOLVE = "backsolve"
+BACKSOLVE_BUDGET = "backsolve_budget"
+BACKSOLVE_INTERNAL = "backsolve_internal"
+# Errors that were written down as plain strings
+OTHER = "other"
+
+class ParserError:
+    __slots__ = ("code", "template", "args", "row", "traceback", "_text")
+
+    # template is formatted with args (str.format), followed by the traceback of exception if there is one.
+    # Anything in args has to stay as it is until the error is rendered.
+    def __init__(self, code: str, template: str, *args, row=None, exception: BaseException = None):
+        self.code = code
+        self.template = template
+        self.args = args
+        # Index of the row of the sheet the error came from, None if unknown
+        self.row = row
+        # Only what it takes to print the traceback later. Keeping the exception itself would keep every frame it went through
+        # alive, with their locals (the sheet's DataFrame, its transactions, ...), until the error is rendered.
+        self.traceback = None
+        if exception is not None:
+            self.traceback = TracebackException(type(exception), exception, exception.__traceback__, lookup_lines=False)
+        self._text = None
+
+    # The message, as it used to be written into the transaction
+    def render(self) -> str:
+        if self._text is None:
+            text = self.template.format(*self.args) if self.args else self.template
+            if self.traceback is not None:
+                text += "".join(self.traceback.format())
+            self._text = text
+        return self._text
+
+    def __str__(self) -> str:
+        return self.render()
+
+    # Errors of a row end up inside the message of its transactions' errors as a list, which shows the messages' reprs
+    def __repr__(self) -> str:
+        return repr(self.render())
+
+# Returns the code of an error in an errors list
+def error_code(error) -> str:
+    if type(error) is ParserError:
+        return error.code
+    return OTHER
+
+# Returns errors with every ParserError turned into its message
+def render_errors(errors: list) -> list:
+    return [x.render() if type(x) is ParserError else x for x in errors]
@@ -0,0 +1,61 @@
+from re import compile
+from typing import Optional
+from .indices import item_set, amount_set
+from .annotation_cache import AnnotatedToken
+
+# In this file: A rule based tagger for formulaic smaller entries like "To Cash 5/:", "By Ballance 3/4/6" or "To 1 quart Rum 1/3",
+# so they don't have to go through the transformer.
+# It produces the same kind of tokens _annotate gets from spacy (text, ent_type_, tag_), so the token combination pass
+# runs exactly as it does on spacy's output. It only takes entries it is sure about and returns None for everything else:
+# a transaction word, an optional number and unit, words we know are items or accounts (never people), and a price at the end.
+# The tags are the ones the transformer gives these words almost all of the time, not a guarantee, which is why this is opt in
+# (see ParserConfig.fast_path) and why benchmarks/fast_path.py measures how often it agrees with spacy.
+
+_trans_words = frozenset(["To", "By"])
+
+# Words that name an account rather than an item or a person
+_account_words = frozenset(["cash", "ballance", "balance", "sundries", "sundrys", "sundry"])
+
+# Every single word we are willing to tag without spacy
+_known_words = frozenset(x for x in item_set | amount_set | _account_words if x.isalpha())
+
+_number_pattern = compile(r"\d+")
+# Prices isProbablyPrice recognizes, matched against the whole token
+_price_pattern = compile(r"\d+[Lsdp]|((\:|\d+)\/)?(\:|\d+)\/(\:|\d+)")
+
+# Returns the tag the transformer would give a known word
+def _word_tag(word: str) -> str:
+    if word[0].isupper():
+        return "NNP"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return "NNS"
+    return "NN"
+
+# Returns the tokens of text if it is formulaic, otherwise None.
+# tokenizer is the tokenizer of the pipeline that would otherwise tag text, so we split it into exactly the same tokens.
+def tag_formulaic(text: str, tokenizer) -> Optional[list]:
+    words = [token.text for token in tokenizer(text)]
+    if len(words) < 3 or words[0] not in _trans_words or not _price_pattern.fullmatch(words[-1]):
+        return None
+
+    tokens = [AnnotatedToken(words[0], "", "IN")]
+    middle = words[1:-1]
+    i = 0
+    # Optional quantity and unit
+    if _number_pattern.fullmatch(middle[0]):
+        tokens.append(AnnotatedToken(middle[0], "CARDINAL", "CD"))
+        i = 1
+        if i < len(middle) and middle[i].lower() in amount_set:
+            tokens.append(AnnotatedToken(middle[i], "", "NN"))
+            i += 1
+
+    # At least one item or account word, and nothing else
+    if i == len(middle):
+        return None
+    for word in middle[i:]:
+        if not word.isalpha() or word.lower() not in _known_words:
+            return None
+        tokens.append(AnnotatedToken(word, "", _word_tag(word)))
+
+    tokens.append(AnnotatedToken(words[-1], "", "CD"))
+    return tokens
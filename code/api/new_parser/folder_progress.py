@@ -0,0 +1,71 @@
+from time import perf_counter
+
+# In this file: Progress of parse_folder, worked out from how far through its sheet every file is.
+# parse_folder used to report progress once a file was done, so a folder of a few big sheets sat at 0 for a long time.
+# FolderProgress counts a file that is being parsed as the fraction of its rows that are done and hands the average over all
+# files to the set_progress callback parse_folder was given. set_progress can be slow (parser_manager uploads every value to S3),
+# so values from rows are passed on at most once per interval seconds, only a file finishing is always passed on.
+# When files are parsed in worker processes, rows are reported to the parent through a queue (see throttled), and the parent
+# feeds them to its FolderProgress.
+
+class FolderProgress:
+    def __init__(self, filenames: list, set_progress, interval: float = 1.0):
+        self.set_progress = set_progress
+        self.total = len(filenames)
+        self.interval = interval
+        # filename -> fraction of it that is done
+        self.fractions = {}
+        self.finished = set()
+        self.last_time = None
+        self.last_value = None
+
+    # Whether anyone is listening, there is no point in reporting rows otherwise
+    @property
+    def reporting(self) -> bool:
+        return self.set_progress is not None
+
+    # Returns a function taking (rows done, rows in the sheet) for filename, or None if nobody is listening
+    def rows_callback(self, filename: str):
+        if not self.reporting:
+            return None
+        return lambda done, total: self.rows(filename, done, total)
+
+    def rows(self, filename: str, done: int, total: int):
+        if filename in self.finished or total <= 0:
+            return
+        self.fractions[filename] = max(self.fractions.get(filename, 0), min(done / total, 1))
+        self._report(False)
+
+    def file_done(self, filename: str):
+        self.finished.add(filename)
+        self.fractions[filename] = 1
+        self._report(True)
+
+    def value(self) -> float:
+        return sum(self.fractions.values()) / self.total
+
+    def _report(self, force: bool):
+        if not self.reporting:
+            return
+        now = perf_counter()
+        if not force and self.last_time is not None and now - self.last_time < self.interval:
+            return
+        value = self.value()
+        # Progress never goes backwards
+        if not force and self.last_value is not None and value <= self.last_value:
+            return
+        self.last_time = now
+        self.last_value = value
+        self.set_progress(value)
+
+# Returns a function taking (rows done, rows in the sheet) that puts (filename, done, total) on queue at most once per interval seconds
+def throttled(queue, filename: str, interval: float = 0.5):
+    last = [None]
+
+    def report(done: int, total: int):
+        now = perf_counter()
+        if last[0] is None or now - last[0] >= interval:
+            last[0] = now
+            queue.put((filename, done, total))
+
+    return report
@@ -1,20 +1,34 @@
 import pandas as pd
-from sys import argv
+from pandas.io.parsers import TextParser
+from pandas.errors import EmptyDataError
 from os import listdir
-from os import path
+from os import path, makedirs
 import traceback
 from re import sub
 from .british_money import Money
-from json import dump
 from .parser_utils import add_error, get_col, month_to_number
 from .indices import drink_set
 from unicodedata import numeric
 import logging
-from itertools import combinations
+from .backsolve import split_currency, BacksolveAmbiguous, BacksolveBudgetExceeded
 from .parse_transactions import print_debug, get_transactions
+from .config import ParserConfig, default_config
+from .sheet_stream import open_sheet
+from .row_cache import open_row_cache
+from .parse_stats import ParseStats, stage, timed, count, count_errors, stats_path
+from .errors import ParserError, error_code, AMOUNT_PARSING, FRACTION, BACKSOLVE, BACKSOLVE_BUDGET, BACKSOLVE_INTERNAL
+from .transaction import Transaction, TransactionWriter, open_output, output_path, output_extension
+from .result_cache import open_result_cache
+from .folder_progress import FolderProgress, throttled
+from .preprocessor import get_worker_pool
+from concurrent.futures import wait, FIRST_COMPLETED
+from dataclasses import replace
+from queue import Empty
+import multiprocessing
+import cProfile
 
-# Performs a clean up on parser output, destroys the dict you give it
-def _clean_pass(entry: dict):
+# Performs a clean up on parser output, in place
+def _clean_pass(entry: Transaction):
     if "item" in entry:
         # Replace ballance with balance
         if entry["item"].lower() == "ballance":
@@ -44,7 +58,7 @@ def _clean_pass(entry: dict):
                         else:
                             entry["amount"] = f"{quarts} quarts"
                     except:
-                        add_error(entry, f"Failed to parse amount: {entry['amount']}", "")
+                        add_error(entry, ParserError(AMOUNT_PARSING, "Failed to parse amount: {}", entry['amount']), "")
 
     if "amount" in entry:
         if type(entry["amount"]) is str:
@@ -57,9 +71,9 @@ def _clean_pass(entry: dict):
                 entry["amount"] = sub(r"(\d+)?\s*([\u00BC-\u00BE\u2150-\u215E])", lambda x: str(int(x.group(1) if x.group(1) != None else 0) + numeric(x.group(2))), entry["amount"])
             except:
                 if "errors" in entry:
-                    entry["errors"].append("Failed to convert fraction to decimal.")
+                    entry["errors"].append(ParserError(FRACTION, "Failed to convert fraction to decimal."))
                 else:
-                    entry["errors"] = ["Failed to convert fraction to decimal.", ]
+                    entry["errors"] = [ParserError(FRACTION, "Failed to convert fraction to decimal."), ]
 
     if "context" in entry:
         entry["text_as_parsed"] = " ".join([x if type(x) is str else x[0] for x in entry["context"]])
@@ -98,13 +112,22 @@ def _clean_pass(entry: dict):
 
 
 # Chains all the parsing functions together to actually parse df.
-def parse(df: pd.DataFrame):
+def parse(df: pd.DataFrame, config: ParserConfig = None, row_cache = None):
+    return list(parse_groups(df, config, row_cache))
+
+# Same as parse, except the transaction groups are yielded one at a time as soon as they are finished
+def parse_groups(df: pd.DataFrame, config: ParserConfig = None, row_cache = None):
     logging.info("Parsing")
-    out = get_transactions(df)
-    todump = []
+    if config is None:
+        config = default_config
+    out = timed(get_transactions(df, config, row_cache), "get_transactions")
+    n_transactions = 0
+    # Code of every error in the output
+    error_codes = []
     for transaction in out:
         # Do some basic cleanup
-        toOut = [_clean_pass({key: val for key, val in x.items() if key != "money_obj" and key != "money_obj_ster"}) for x in transaction]
+        with stage("clean pass"):
+            toOut = [_clean_pass(x) for x in transaction]
 
         # Group all entrys with the same id together in order to attempt to backsolve currency types on entries with both currency and sterling
         # also used to fix dates when we see specific strings that should change the date
@@ -141,7 +164,8 @@ def parse(df: pd.DataFrame):
                     toOut[i]["_Month"] = month_to_number[curr_date["date_month"].lower()]
                     toOut[i]["Day"] = curr_date["date_day"]
 
-        # For all entries with same id, do the currency backsolving by inspecting all possible price sum combinations
+        # For all entries with same id, do the currency backsolving by finding every way to split their prices into sterling and currency
+        # (see backsolve.py)
         for eid in both_entries:
             indices = entry_id_to_index[eid]
             try:
@@ -151,150 +175,261 @@ def parse(df: pd.DataFrame):
                 if len(to_backsolve) < 2:
                     raise AssertionError()
                 
-                # print(to_backsolve)
+                if toOut[indices[0]].original_money_obj is not None and toOut[indices[0]].original_money_obj_ster is not None:
+                    ster_sum = toOut[indices[0]].original_money_obj_ster
+                    curr_sum = toOut[indices[0]].original_money_obj
+                    currency_indices, sterling_indices = split_currency(list(to_backsolve), curr_sum, ster_sum, config.backsolve_seconds)
+                    for i in currency_indices:
+                        toOut[i]["currency_type"] = "Currency"
+                    for i in sterling_indices:
+                        toOut[i]["currency_type"] = "Sterling"
                 
-                if "original_money_obj" in toOut[indices[0]] and "original_money_obj_ster" in toOut[indices[0]]:
-                    ster_sum = toOut[indices[0]]["original_money_obj_ster"]
-                    curr_sum = toOut[indices[0]]["original_money_obj"]
-                    # print(ster_sum)
-                    # print(curr_sum)
-
-                    valid_currrency_sums = []
-                    valid_sterling_sums = []
-                    for i in range(1, (len(to_backsolve) // 2) + 1):
-                        for combo in combinations(to_backsolve, i):
-                            combo = set(combo)
-                            complement = to_backsolve.difference(combo)
-                            combo_sum = sum(x[1] for x in combo)
-                            complement_sum = sum(x[1] for x in complement)
-                            # print(combo, combo_sum, ster_sum, combo_sum == ster_sum, curr_sum, combo_sum == curr_sum)
-                            # print(complement, complement_sum, curr_sum, complement_sum == curr_sum, ster_sum, complement_sum == ster_sum)
-                            if combo_sum == ster_sum and complement_sum == curr_sum:
-                                if combo not in valid_sterling_sums and complement not in valid_currrency_sums:
-                                    valid_sterling_sums.append(combo)
-                                    valid_currrency_sums.append(complement)
-                            elif combo_sum == curr_sum and complement_sum == ster_sum:
-                                if combo not in valid_currrency_sums and complement not in valid_sterling_sums:
-                                    valid_sterling_sums.append(complement)
-                                    valid_currrency_sums.append(combo)
-                    
-                    if len(valid_currrency_sums) == 1 and len(valid_sterling_sums) == 1:
-                        for i, price in valid_currrency_sums[0]:
-                            toOut[i]["currency_type"] = "Currency"
-                        for i, price in valid_sterling_sums[0]:
-                            toOut[i]["currency_type"] = "Sterling"
+            # When we cannot figure out which items are sterling and which are currency
+            except BacksolveAmbiguous:
+                for index in indices:
+                    if "tobacco_entries" in toOut[index] and toOut[index]["tobacco_entries"]:
+                        pass
+                    elif "errors" in toOut[index]:
+                        toOut[index]["errors"].append(ParserError(BACKSOLVE, "Failed to separate sterling from currency."))
                     else:
-                        # print("Curr sums: ")
-                        # print(valid_currrency_sums)
-                        # print("Ster sums: ")
-                        # print(valid_sterling_sums)
-                        # print()
-                        raise OSError("Intentional error that shouldn't be raised by anything else in this code block")
-                
-                # OSError is our shorthand for when we cannot figure out which items are sterling and which are currency
-            except OSError:
+                        toOut[index]["errors"] = [ParserError(BACKSOLVE, "Failed to separate sterling from currency."), ]
+
+            # When there are too many prices to try every split in time
+            except BacksolveBudgetExceeded:
+                logging.warning(f"Gave up backsolving entry {eid} with {len(to_backsolve)} prices")
                 for index in indices:
+                    error = ParserError(BACKSOLVE_BUDGET, "Failed to separate sterling from currency, too many prices to try every way of splitting them ({} prices).", len(to_backsolve))
                     if "tobacco_entries" in toOut[index] and toOut[index]["tobacco_entries"]:
                         pass
                     elif "errors" in toOut[index]:
-                        toOut[index]["errors"].append("Failed to separate sterling from currency.")
+                        toOut[index]["errors"].append(error)
                     else:
-                        toOut[index]["errors"] = ["Failed to separate sterling from currency.", ]
+                        toOut[index]["errors"] = [error, ]
             
             # Don't backsolve when only 1 entry
             except AssertionError:
                 pass
 
-            except:
+            except Exception as e:
                 for index in indices:
+                    error = ParserError(BACKSOLVE_INTERNAL, "Could not separate sterling from currency due to internal price parsing error. ", exception=e)
                     if "tobacco_entries" in toOut[index] and toOut[index]["tobacco_entries"]:
                         pass
                     elif "errors" in toOut[index]:
-                        toOut[index]["errors"].append("Could not separate sterling from currency due to internal price parsing error. " + traceback.format_exc())
+                        toOut[index]["errors"].append(error)
                     else:
-                        toOut[index]["errors"] = ["Could not separate sterling from currency due to internal price parsing error. " + traceback.format_exc(), ]
+                        toOut[index]["errors"] = [error, ]
         
-        todump.append([{key: val for key, val in x.items() if key != "original_money_obj" and key != "original_money_obj_ster"} for x in toOut])
+        # Remember the codes of the errors before they turn into their messages
+        error_codes.extend(error_code(error) for x in toOut for error in x.get("errors", ()))
+
+        # (token streams in contexts go back to being lists of tuples, errors become their messages)
+        for x in toOut:
+            x.finish()
+        n_transactions += len(toOut)
+        yield toOut
 
-    return todump
+    count("transactions", n_transactions)
+    count("errors", len(error_codes))
+    count_errors(error_codes)
     
 
-# Runs parse_folder but on a single file
-def parse_file_and_dump(folder, filename):
-    logging.info(f"Parsing file: {filename} in folder {folder}.")
+# Parses filename in folder, writing its transactions to filename.json (or whatever output_path says for config), or what went
+# wrong to filename.exception, in out_folder (folder if not given).
+# on_progress, if given, is called with (rows done, rows in the sheet) as the sheet is parsed.
+def _parse_and_write(folder, filename, config: ParserConfig = None, on_progress = None, out_folder = None):
+    if config is None:
+        config = default_config
+    if out_folder is None:
+        out_folder = folder
+    sheet = path.join(folder, filename)
+    # Where the output (and stats) of the sheet go, its name with the output's extension added on
+    target = path.join(out_folder, filename)
     try:
-        out = parse_file(path.join(folder, filename))
-        file = open(path.join(folder, filename) + ".json", 'w')
-        dump(out, file)
-        file.close()
+        makedirs(out_folder, exist_ok=True)
+        # Copy the output of the last time this workbook was parsed if nothing it depends on has changed since
+        results = open_result_cache(config)
+        if results is not None:
+            key = results.key(sheet, config)
+            if not config.force_reparse and results.get(key, output_extension(config), output_path(target, config), stats_path(target)):
+                logging.info(f"Reused the stored output of {filename}")
+                print_debug(f"Finished file {filename}")
+                print_debug()
+                return
+
+        stats = ParseStats(filename)
+        stats.on_progress = on_progress
+        if config.output == "json":
+            out = parse_file(sheet, config, stats)
+            with stats.collect(), stage("dump"), open_output(target, config) as writer:
+                writer.write_all(out)
+        else:
+            # Nothing is kept, groups go to the file as they are finished (the writer deletes the file if the parse fails)
+            with open_output(target, config) as writer:
+                parse_file(sheet, config, stats, writer)
+        stats.log()
+        stats.save(stats_path(target))
+
+        # Whether backsolving ran out of time depends on how busy the machine was, so such outputs aren't worth keeping
+        if results is not None and BACKSOLVE_BUDGET not in stats.errors:
+            # The output is already written, failing to store it is no reason to report the sheet as failed
+            try:
+                results.put(key, output_extension(config), output_path(target, config), stats_path(target))
+            except Exception:
+                logging.warning(f"Failed to store the output of {filename}: {traceback.format_exc()}")
         print_debug(f"Finished file {filename}")
         print_debug()
     except Exception as e:
-        print_debug(f"Parsing file {filename} failed. Exception dumped.")
-        print_debug()
-        file = open(path.join(folder, filename) + ".exception", 'w')
-        file.write(str(e) + "\n" + traceback.format_exc())
-        file.close()
+        _write_exception(out_folder, filename, e, traceback.format_exc())
+
+def _write_exception(folder, filename, e: BaseException, text: str):
+    print_debug(f"Parsing file {filename} failed. Exception dumped. {text}")
+    print_debug()
+    file = open(path.join(folder, filename) + ".exception", 'w')
+    file.write(str(e) + "\n" + text)
+    file.close()
+
+# Runs parse_folder but on a single file
+def parse_file_and_dump(folder, filename, config: ParserConfig = None):
+    logging.info(f"Parsing file: {filename} in folder {folder}.")
+    _parse_and_write(folder, filename, config)
 
-# Reads in an excel file and parses it
-def parse_file(filePath):
+# Reads in an excel file and parses it.
+# Timings and counters for the parse are added to stats if given, otherwise they are logged once the parse is done (see parse_stats.py)
+# If writer (a TransactionWriter) is given, every transaction group is written to it as soon as it is finished instead of being
+# kept, and None is returned.
+def parse_file(filePath, config: ParserConfig = None, stats: ParseStats = None, writer: TransactionWriter = None):
     logging.info(f"Parsing file: {filePath}")
-    df = pd.read_excel(filePath)
-    
-    n = 0
-    while "EntryID" not in df and "[EntryID]" not in df:
-        n += 1
-        df = pd.read_excel(filePath, skiprows=n)
-    for idx in range(0, df.shape[0]-1):
-        if "EntryID" in df:
-            if str(df['EntryID'][idx+1])[:-1] == str(df['EntryID'][idx]):
-                df = df.reset_index(drop=True)
-        else:
-            if str(df['[EntryID]'][idx+1])[:-1] == str(df['[EntryID]'][idx]):
-                df = df.reset_index(drop=True)
-    
-    df = df[get_col(df, "EntryID") != ""]
-    
-    out = parse(df)
+    if config is None:
+        config = default_config
+    log_stats = stats is None
+    if stats is None:
+        stats = ParseStats(filePath)
+
+    # Profile the whole parse if this is the file we were asked to profile
+    profiler = None
+    if config.cprofile and config.cprofile in (str(filePath), path.basename(filePath)):
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        with stats.collect():
+            with stage("read"):
+                if config.streaming:
+                    df = open_sheet(filePath, config.stream_lookahead)
+                else:
+                    df = load_sheet(filePath)
+
+            # Only preprocess the rows that changed since the last time this sheet was parsed
+            row_cache = None
+            if config.incremental:
+                with stage("row cache"):
+                    row_cache = open_row_cache(filePath, config)
 
+            # Everything parse does itself is backsolving and fixing dates, the rest is timed as the stages it calls
+            with stage("backsolve"):
+                if writer is None:
+                    out = parse(df, config, row_cache)
+                else:
+                    out = None
+                    for group in parse_groups(df, config, row_cache):
+                        with stage("dump"):
+                            writer.write(group)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_path = stats_path(filePath, ".prof")
+            makedirs(path.dirname(profile_path), exist_ok=True)
+            profiler.dump_stats(profile_path)
+            logging.info(f"Wrote profile of {filePath} to {profile_path}")
+
+    if log_stats:
+        stats.log()
     return out
 
+# Reads in an excel file, skipping anything above the header row and dropping rows without an entry id
+# The sheet is read once as raw cell values, pandas then reads the frame from the header row on out of those values the same
+# way read_excel would have (read_excel itself hands the cells to a TextParser), giving the same names and types.
+def load_sheet(filePath) -> pd.DataFrame:
+    raw = pd.read_excel(filePath, header=None, dtype=object, na_filter=False)
+    rows = raw.values.tolist()
+
+    # The header row is the first one with an EntryID column
+    for n, row in enumerate(rows):
+        if "EntryID" in row or "[EntryID]" in row:
+            break
+    else:
+        raise EmptyDataError("No columns to parse from file")
+
+    df = TextParser(rows[n:], header=0, skip_blank_lines=False).read()
+    df = df.reset_index(drop=True)
+
+    df = df[get_col(df, "EntryID") != ""]
+
+    return df
+
+# Runs in a worker process of parse_sheets, parses a single file reporting how far it is through it on queue (if given)
+def _parse_file_worker(folder, filename, out_folder, config: ParserConfig, queue = None):
+    key = path.join(folder, filename)
+    _parse_and_write(folder, filename, config, throttled(queue, key) if queue is not None else None, out_folder)
+
 # set_progress is a function that takes a float reprsenting the current parsing progress
-def parse_folder(folder, set_progress = None):
+def parse_folder(folder, set_progress = None, config: ParserConfig = None):
     logging.info(f"Parsing folder: {folder}")
     filenames = listdir(folder)
     filenames = [x for x in filenames if x.split(".")[-1] in ["xls", "xlsx"]]
-    n = 0
-    total = len(filenames)
-    for filename in filenames:
-        try:
-            out = parse_file(path.join(folder, filename))
-            file = open(path.join(folder, filename) + ".json", 'w')
-            dump(out, file)
-            file.close()
-            if set_progress is not None:
-                n += 1
-                set_progress(n / total)
-            print_debug(f"Finished file {filename}")
-            print_debug()
-        except Exception as e:
-            text = traceback.format_exc()
-            print_debug(f"Parsing file {filename} failed. Exception dumped. {text}")
-            print_debug()
-            file = open(path.join(folder, filename) + ".exception", 'w')
-            file.write(str(e) + "\n" + text)
-            file.close()
-            if set_progress is not None:
-                n += 1
-                set_progress(n / total)
+    parse_sheets([(folder, filename, folder) for filename in filenames], set_progress, config)
+
+# Parses every sheet in sheets, a list of (folder, filename, out_folder), writing the output of filename in folder to out_folder.
+# set_progress is a function that takes a float reprsenting the current parsing progress
+# With config.file_workers above 1 the files are spread across that many worker processes (see get_worker_pool), which write
+# their outputs themselves. Progress, including how far through its sheet every file is, is worked out here (see folder_progress.py).
+def parse_sheets(sheets: list, set_progress = None, config: ParserConfig = None):
+    if config is None:
+        config = default_config
+    progress = FolderProgress([path.join(folder, filename) for folder, filename, out_folder in sheets], set_progress)
+
+    if config.file_workers <= 1 or len(sheets) <= 1:
+        for folder, filename, out_folder in sheets:
+            key = path.join(folder, filename)
+            _parse_and_write(folder, filename, config, progress.rows_callback(key), out_folder)
+            progress.file_done(key)
+        return
+
+    # Every file is parsed in a single worker, splitting its rows across more processes on top of that would only oversubscribe
+    worker_config = replace(config, workers=1, file_workers=1)
+    pool = get_worker_pool(config.file_workers, config.profile)
+    # Workers can't call set_progress, they put (path of the sheet, rows done, rows in the sheet) on this queue instead
+    manager = None
+    queue = None
+    if progress.reporting:
+        manager = multiprocessing.get_context("spawn").Manager()
+        queue = manager.Queue()
+
+    try:
+        futures = {pool.submit(_parse_file_worker, folder, filename, out_folder, worker_config, queue): (folder, filename, out_folder) for folder, filename, out_folder in sheets}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if queue is not None:
+                while True:
+                    try:
+                        progress.rows(*queue.get_nowait())
+                    except Empty:
+                        break
+            for future in done:
+                folder, filename, out_folder = futures[future]
+                # _parse_and_write catches everything the parse raises, this is for workers that died part way through
+                e = future.exception()
+                if e is not None:
+                    _write_exception(out_folder, filename, e, "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+                progress.file_done(path.join(folder, filename))
+    finally:
+        if manager is not None:
+            manager.shutdown()
             
     
-# If we are executed directly from command line, parse the file given in the first argument to the program
+# If we are executed directly from command line, run the batch command line on the arguments (see cli.py)
 if __name__ == "__main__":
-    if argv[1] in ("..\..\..\data\Amelia", "..\..\..\data\Mahlon"):
-        parse_folder(argv[1])
-    else:
-        out = parse_file(argv[1])
-        file = open("out.json", 'w')
-        dump(out, file)
-        file.close()
+    from .cli import main
+    main()
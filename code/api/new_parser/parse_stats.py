@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from json import dump
+from os import makedirs
+from os.path import basename, dirname, join
+import logging
+
+# In this file: Timing and counters for a single parse, so we can tell where parse time goes.
+# parse_file collects a ParseStats for the file it parses. Code anywhere in the parser marks a stage with
+# `with stage("annotate"):` (or times the items of an iterator with timed) and bumps counters with count, which do nothing
+# outside of a parse. The current ParseStats is kept in a context variable, so parses running on different threads
+# (see NameRegistry) never mix up their numbers.
+# Stage times are self times: time spent in a stage nested inside another (e.g. annotate inside get_transactions) only counts
+# towards the inner one, so the stages add up to the total.
+# A ParseStats can also be given a progress callback, which get_transactions tells how far through the sheet it is (see report_rows).
+# The errors in the sheet's output are counted by their code (see errors.py), so tools like data/stats.py can tell what
+# went wrong in a folder from the stats files alone.
+
+_current = ContextVar("parse_stats", default=None)
+
+class ParseStats:
+    def __init__(self, file: str):
+        self.file = str(file)
+        self.stages = {}
+        self.counts = {}
+        # Error code -> number of errors with it in the output
+        self.errors = {}
+        # Called with (rows done, rows in the sheet) after every row, if set
+        self.on_progress = None
+        self.seconds = 0
+        # Stages that are currently running, innermost last, as [name, start, time spent in stages nested in it]
+        self._running = []
+
+    # Makes this the ParseStats that stage, timed and count add to, and times everything done inside
+    @contextmanager
+    def collect(self):
+        token = _current.set(self)
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds += perf_counter() - start
+            _current.reset(token)
+
+    def _enter(self, name: str):
+        self._running.append([name, perf_counter(), 0])
+
+    def _exit(self):
+        name, start, nested = self._running.pop()
+        elapsed = perf_counter() - start
+        self.stages[name] = self.stages.get(name, 0) + elapsed - nested
+        if self._running:
+            self._running[-1][2] += elapsed
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def count_errors(self, codes):
+        for code in codes:
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+    def summary(self) -> dict:
+        return {
+            "file": self.file,
+            "seconds": round(self.seconds, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in sorted(self.stages.items(), key=lambda x: -x[1])},
+            "counts": dict(self.counts),
+            "errors": {code: n for code, n in sorted(self.errors.items(), key=lambda x: -x[1])},
+        }
+
+    def log(self):
+        stages = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in sorted(self.stages.items(), key=lambda x: -x[1]))
+        counts = ", ".join(f"{n} {name}" for name, n in self.counts.items())
+        logging.info(f"Parsed {self.file} in {self.seconds:.3f}s ({stages}) {counts}")
+
+    # Writes the summary to path as json
+    def save(self, path: str):
+        makedirs(dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            dump(self.summary(), file, indent=1)
+
+# Returns where the stats (or with extension .prof, the cProfile output) of the sheet at filePath go:
+# a stats folder next to the sheet, so upload_results and check_progress leave them alone
+def stats_path(filePath, extension: str = ".stats") -> str:
+    return join(dirname(str(filePath)), "stats", basename(str(filePath)) + extension)
+
+# Times everything inside towards stage name of the current parse
+@contextmanager
+def stage(name: str):
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    stats._enter(name)
+    try:
+        yield
+    finally:
+        stats._exit()
+
+# Yields the items of iterable, timing the time spent getting each one towards stage name of the current parse
+def timed(iterable, name: str):
+    stats = _current.get()
+    iterator = iter(iterable)
+    if stats is None:
+        yield from iterator
+        return
+    while True:
+        stats._enter(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stats._exit()
+        yield item
+
+# Adds n to counter name of the current parse
+def count(name: str, n: int = 1):
+    stats = _current.get()
+    if stats is not None:
+        stats.count(name, n)
+
+# Adds one error of each code in codes to the current parse
+def count_errors(codes):
+    stats = _current.get()
+    if stats is not None:
+        stats.count_errors(codes)
+
+# Tells the progress callback of the current parse, if it has one, that the first done of total rows of its sheet are done
+def report_rows(done: int, total: int):
+    stats = _current.get()
+    if stats is not None and stats.on_progress is not None:
+        stats.on_progress(done, total)
@@ -8,6 +8,8 @@ from threading import Lock
 import logging
 from json import dumps
 from io import BytesIO
+from tempfile import TemporaryDirectory
+from .transaction import TransactionWriter, read_transactions
 
 
 dump_folder = join(dirname(__file__), "ParseMe")
@@ -129,8 +131,7 @@ def upload_results(client):
         filename = join(dump_folder, filename)
         if ".json" in filename and ".exception" not in filename:
             try:
-                with open(filename, 'rb') as file:
-                    client.upload_fileobj(file, "shoppingstories", f"Parsed/{basename(filename)}")
+                _upload_output(client, filename)
                 succeeded.append(filename)
             except Exception:
                 pass
@@ -146,6 +147,23 @@ def upload_results(client):
     _parsing_lock.release()
     preparsed_lock.release()
 
+# Uploads the output of a sheet to Parsed/<sheet>.json.
+# Whatever format the parser wrote it in (see ParserConfig.output), what is uploaded is the plain json list everything reading
+# Parsed expects, other formats are converted one transaction group at a time.
+def _upload_output(client, filename):
+    if filename.endswith(".json"):
+        with open(filename, 'rb') as file:
+            client.upload_fileobj(file, "shoppingstories", f"Parsed/{basename(filename)}")
+        return
+
+    name = basename(filename).removesuffix(".gz").removesuffix(".jsonl").removesuffix(".json") + ".json"
+    with TemporaryDirectory() as folder:
+        with TransactionWriter(join(folder, name), "json-stream") as writer:
+            for group in read_transactions(filename):
+                writer.write(group)
+        with open(join(folder, name), 'rb') as file:
+            client.upload_fileobj(file, "shoppingstories", f"Parsed/{name}")
+
 _progress_lock = Lock()
 def set_progress(number: float, client):
     prog = {"progress": number}
@@ -4,8 +4,10 @@ from unicodedata import numeric
 import pandas as pd
 from itertools import chain
 from .british_money import Money
-import traceback
+from .token_stream import TokenStream
+from .errors import ParserError, QUANTITY_PARSING, COLONY_CURRENCY_PARSING, STERLING_CURRENCY_PARSING, COMMODITY_TOTALING, CURRENCY_TOTALING
 
+# string can also be a function returning the message, so messages that are expensive to build are only built if printed
 def print_debug(string=""):
     pass
 
@@ -69,20 +71,22 @@ def isNoun(token) -> bool:
         return "VBG" in token.tag_ or "VBN" in token.tag_ or "NN" in token.tag_ or "UH" in token.tag_
 
 # Deal with there sometimes being multiple entries in one entry.
-def handle_multiple_prices(entry: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+def handle_multiple_prices(entry: TokenStream) -> List[TokenStream]:
+    if not isinstance(entry, TokenStream):
+        entry = TokenStream(entry)
     # Search for the number of noun, price pairs, if more than one split around noun followed by price
     # Ignore people and dates because they are definitely not the item being purchased
     found_trans = []
     mltbe = False
     ignoring_prices = False
-    cur_entry = []
+    cur_entry = TokenStream()
     found_noun_last = False
     found_price_last = False
     app_until_to_by = False
     # print("Handling multiple prices: ")
     # print(entry)
-    for word, info, pos in entry:
-        cur_entry.append((word, info, pos))
+    for i, (word, info, pos) in enumerate(entry):
+        cur_entry.append_from(entry, i)
         # If we have a multiline tobacco entry, or otherwise don't want to split up entry by price locations, pass it all through as one entry.
         if pos == "MLTBE":
             mltbe = True
@@ -104,14 +108,14 @@ def handle_multiple_prices(entry: List[Tuple[str, str, str]]) -> List[Tuple[str,
             elif info == "PERSON":
                 if cur_entry:
                     cur_entry.pop()
-                found_trans[-1].append((word, info, pos))
+                found_trans[-1].append_from(entry, i)
                 appd = True
                 app_until_to_by = False
             else:
                 if cur_entry:
                     cur_entry.pop()
                 if pos != "IGNORE_PRICES":
-                    found_trans[-1].append((word, info, pos))
+                    found_trans[-1].append_from(entry, i)
                 appd = True
 
         if found_price_last and (word.lower() in {"per", "[per]"} or info == "PRICE" or "fancy_" in pos or pos == "IGNORE_PRICES"):
@@ -120,7 +124,7 @@ def handle_multiple_prices(entry: List[Tuple[str, str, str]]) -> List[Tuple[str,
                 cur_entry.pop()
             if pos != "IGNORE_PRICES":
                 if not appd:
-                    found_trans[-1].append((word, info, pos))
+                    found_trans[-1].append_from(entry, i)
         
         elif found_price_last:
             found_price_last = False
@@ -129,14 +133,15 @@ def handle_multiple_prices(entry: List[Tuple[str, str, str]]) -> List[Tuple[str,
             found_noun_last = False
             found_price_last = True
             found_trans.append(cur_entry)
-            cur_entry = []
+            cur_entry = TokenStream()
 
         if info == "TRANS" and len(cur_entry) > 1:
             found_price_last = False
             found_noun_last = False
             cur_entry.pop()
             found_trans.append(cur_entry)
-            cur_entry = [(word, info, pos)]
+            cur_entry = TokenStream()
+            cur_entry.append_from(entry, i)
         
         if "NN" in pos and info not in ["PERSON", "DATE"]:
             found_noun_last = True
@@ -150,8 +155,9 @@ def handle_multiple_prices(entry: List[Tuple[str, str, str]]) -> List[Tuple[str,
     # print()
     return found_trans
     
+# Writes error (a ParserError, see errors.py) down in map, along with the error_context it happened in
 def add_error(map, error, error_context):
-    if type(error) is str:
+    if type(error) is str or type(error) is ParserError:
         pass
     else:
         error = str(error)
@@ -168,6 +174,10 @@ def add_error(map, error, error_context):
 # Returns df[colname], allowing for some variations in the exact column names
 # Column names include: "L Currency", "L Sterling", "Colony Currency", "Folio Year", "EntryID", etc.
 def get_col(df, colname: str):
+        # Rows streamed from a sheet have their column names resolved once for the whole sheet
+        if type(df) is RowRecord:
+            return df.values[df.columns.resolve(colname)]
+
         colname2 = colname[:]
         colname3 = colname + " "
         if colname2[0] != "[":
@@ -267,58 +277,188 @@ def get_col_name(df, colname: str):
                 return get_col_name(df, "Store Location")
             raise KeyError(f"Column with name {colname} not in df")
 
+# A spreadsheet row as the parser reads it, from a SheetStream (see sheet_stream.py) or from a DataFrame (see frame_rows).
+# values holds the cells in column order, columns (a ColumnMap) is shared by every row of the sheet, so get_col on a row is
+# a single list lookup.
+class RowRecord:
+    __slots__ = ("name", "values", "columns")
+
+    def __init__(self, name: int, values: list, columns):
+        # Index of the row, same as the name of a row from df.iterrows()
+        self.name = name
+        self.values = values
+        self.columns = columns
+
+    def __contains__(self, colname) -> bool:
+        return colname in self.columns.positions
+
+    def __getitem__(self, colname):
+        return self.values[self.columns.positions[colname]]
+
+    def __setitem__(self, colname, val):
+        self.values[self.columns.positions[colname]] = val
+
+    def to_dict(self) -> dict:
+        return dict(zip(self.columns.names, self.values))
+
+# Raised when a sheet has no column for a name the parser asks get_col for
+class MissingColumnError(KeyError):
+    def __init__(self, colname: str, names: list):
+        super().__init__(f"Column with name {colname} not in df, the sheet's columns are: {', '.join(str(x) for x in names)}")
+        self.colname = colname
+        self.names = names
+
+    # Raised in preprocessing workers too, which send it back pickled
+    def __reduce__(self):
+        return (MissingColumnError, (self.colname, self.names))
+
+    # KeyError puts quotes around its message
+    def __str__(self) -> str:
+        return self.args[0]
+
+# Every name the parser asks get_col for on a row
+canonical_columns = (
+    "EntryID", "Entry", "L Sterling", "s Sterling", "d Sterling", "L Currency", "s Currency", "d Currency", "Colony Currency",
+    "Quantity", "Commodity", "Prefix", "Account First Name", "Account Last Name", "Suffix", "Reel", "Owner", "Folio Year",
+    "Folio Page", "Store", "GenMat", "Marginalia", "Date Year", "_Month", "Day", "Folio Reference", "Final",
+)
+
+# The column names of a sheet, and where to find every name the parser asks get_col for.
+# Column names vary between sheets ("[EntryID]", "L" for "L Sterling", "L.1" for "L Currency", "Marginialia", ...), get_col
+# used to work out which column a name means on every call. A ColumnMap works out every canonical name once per sheet (and
+# any other name the first time it is asked for), so reading a cell of a RowRecord is a dict and a list lookup.
+class ColumnMap:
+    def __init__(self, names: list):
+        self.names = names
+        self.positions = {name: i for i, name in enumerate(names)}
+        # colname -> position of the column get_col finds for it
+        self._resolved = {}
+        # Names the sheet has no column for
+        self._missing = set()
+        for colname in canonical_columns:
+            self._resolve(colname)
+
+    # Indexing the columns gives the name of the column, so get_col(self, colname) resolves colname exactly like it would on a df
+    def __contains__(self, colname) -> bool:
+        return colname in self.positions
+
+    def __getitem__(self, colname):
+        if colname not in self.positions:
+            raise KeyError(colname)
+        return colname
+
+    def _resolve(self, colname: str):
+        try:
+            self._resolved[colname] = self.positions[get_col(self, colname)]
+        except KeyError:
+            self._missing.add(colname)
+
+    # Returns the position of the column get_col(row, colname) would read, raises MissingColumnError if there is none
+    def resolve(self, colname: str) -> int:
+        position = self._resolved.get(colname)
+        if position is None:
+            if colname not in self._missing:
+                self._resolve(colname)
+                return self.resolve(colname)
+            raise MissingColumnError(colname, self.names)
+        return position
+
+# Yields (index, RowRecord) for every row of df, like df.iterrows() but with every row sharing one ColumnMap.
+# The rows are made from df.values, the same 2D array df.iterrows() makes its rows from, so every value has exactly the type
+# it has in a row from df.iterrows().
+def frame_rows(df: pd.DataFrame):
+    columns = ColumnMap(list(df.columns))
+    for name, values in zip(df.index, df.values):
+        yield name, RowRecord(name, list(values), columns)
+
+def _isNull(val: str):
+    return val is None or val == "-" or val == "" or str(val) == "nan"
+
+# Copies marginalia and dates down into a single row, rows have to be given to it in order.
+# names holds the column names from _marginalia_date_names, state is what we have seen in the rows so far (from _new_marginalia_date_state).
+def _fix_marginalia_dates_row(row, names: dict, state: dict):
+    last_date = state["last_date"]
+
+    # Fix marginalia
+    if not _isNull(val := row[names["marg"]]):
+        state["last_marg"] = val
+    else:
+        if state["last_marg"] != "":
+            row[names["marg"]] = state["last_marg"]
+
+    # If in cr, set in_cr to true and reset last date
+    if not state["in_cr"] and row[names["dr_cr"]] == "Cr":
+        state["in_cr"] = True
+        last_date["year"] = None
+        last_date["month"] = None
+        last_date["day"] = None
+
+    # Fix dates
+    # If date is not null, remember it
+    if not _isNull(year := row[names["year"]]):
+        last_date["year"] = year
+        last_date["month"] = None
+        last_date["day"] = None
+        # Sometimes year is defined but no month or day is defined
+        if not _isNull(month := row[names["month"]]):
+            last_date["month"] = month
+        if not _isNull(day := row[names["day"]]):
+            last_date["day"] = day
+
+    # When date is undefined, use the last date we saw
+    else:
+        if last_date["year"] != None:
+            row[names["year"]] = last_date["year"]
+            if  last_date["month"] != None:
+                row[names["month"]] = last_date["month"]
+            if last_date["day"] != None:
+                row[names["day"]] = last_date["day"]
+
+def _marginalia_date_names(df) -> dict:
+    return {
+        "marg": get_col_name(df, "Marginalia"),
+        "year": get_col_name(df, "Date Year"),
+        "month": get_col_name(df, "_Month"),
+        "day": get_col_name(df, "Day"),
+        "dr_cr": get_col_name(df, "Dr/Cr"),
+    }
+
+def _new_marginalia_date_state() -> dict:
+    return {"last_date": {"year": None, "month": None, "day": None}, "last_marg": "", "in_cr": False}
+
+# Lets _fix_marginalia_dates_row read and write row i of a df
+class _DataFrameRow:
+    def __init__(self, df: pd.DataFrame, i: int):
+        self.df = df
+        self.i = i
+
+    def __getitem__(self, colname):
+        return self.df.at[self.i, colname]
+
+    def __setitem__(self, colname, val):
+        self.df.at[self.i, colname] = val
+
 # Modifies the df to copy marginalia values down into rows for which they are null
 # Also does the same for date year, month, and day.
 def fix_marginalia_dates(df: pd.DataFrame):
     nrows = df.shape[0]
-    marg_name = get_col_name(df, "Marginalia")
-    year_name = get_col_name(df, "Date Year")
-    month_name = get_col_name(df, "_Month")
-    day_name = get_col_name(df, "Day")
-    dr_cr_name = get_col_name(df, "Dr/Cr")
-    last_date = {"year": None, "month": None, "day": None}
-    last_marg = ""
+    names = _marginalia_date_names(df)
+    state = _new_marginalia_date_state()
+    for i in range(nrows):
+        _fix_marginalia_dates_row(_DataFrameRow(df, i), names, state)
 
-    in_cr = False
+# Same as fix_marginalia_dates, but for the (index, RowRecord) pairs of a SheetStream, fixing each row as it goes by.
+# Column names are looked up right away, so missing columns fail before any row is read just like with a df.
+def fix_marginalia_dates_stream(rows, columns: ColumnMap):
+    names = _marginalia_date_names(columns)
+    state = _new_marginalia_date_state()
 
-    def isNull(val: str):
-        return val is None or val == "-" or val == "" or str(val) == "nan"
+    def fixed_rows():
+        for i, row in rows:
+            _fix_marginalia_dates_row(row, names, state)
+            yield i, row
 
-    for i in range(nrows):
-        # Fix marginalia
-        if not isNull(val := df.at[i, marg_name]):
-            last_marg = val
-        else:
-            if last_marg != "":
-                df.at[i, marg_name] = last_marg
-
-        # If in cr, set in_cr to true and reset last date
-        if not in_cr and df.at[i, dr_cr_name] == "Cr":
-            in_cr = True
-            last_date["year"] = None
-            last_date["month"] = None
-            last_date["day"] = None
-
-        # Fix dates
-        # If date is not null, remember it
-        if not isNull(year := df.at[i, year_name]):
-            last_date["year"] = year
-            last_date["month"] = None
-            last_date["day"] = None
-            # Sometimes year is defined but no month or day is defined
-            if not isNull(month := df.at[i, month_name]):
-                last_date["month"] = month
-            if not isNull(day := df.at[i, day_name]):
-                last_date["day"] = day
-
-        # When date is undefined, use the last date we saw
-        else:
-            if last_date["year"] != None:
-                df.at[i, year_name] = last_date["year"]
-                if  last_date["month"] != None:
-                    df.at[i, month_name] = last_date["month"]
-                if last_date["day"] != None:
-                    df.at[i, day_name] = last_date["day"]
+    return fixed_rows()
 
 # Checks if there is values in all nullable columns listed in nullable_cols
 # If there is, save it, otherwise, don't.
@@ -332,7 +472,7 @@ def remember_nullable_cols(row_context: dict, nullable_cols: List[str], row):
                 try:
                     row_context[entry_name] = parse_numbers(get_col(row, entry_name))
                 except Exception as e:
-                    add_error(row_context, "Error: Quantity parsing failed in: " + str(e), get_col(row, "Entry"))
+                    add_error(row_context, ParserError(QUANTITY_PARSING, "Error: Quantity parsing failed in: {}", e, row=row.name), get_col(row, "Entry"))
             elif entry_name == "Marginalia":
                 # Marginalia sometimes has funky spacing so remove that
                 row_context[entry_name] = str(get_col(row, entry_name)).strip()
@@ -342,13 +482,19 @@ def remember_nullable_cols(row_context: dict, nullable_cols: List[str], row):
 
 # Mark any rows with no currency as totaling contextless and
 # save all values in the currency columns in the row context
-def setup_row_currency(row_context: dict, row, entries, transactions_context: dict):
+# empty is (whether the colony currency columns are all "-", whether the sterling columns are), read from the row if not given
+def setup_row_currency(row_context: dict, row, entries, transactions_context: dict, empty: tuple = None):
+    if empty is None:
+        empty = (all([get_col(row, x) in ["-", " -", "- "] for x in ["L Currency", "s Currency", "d Currency"]]),
+                 all([get_col(row, x) in ["-", " -", "- "] for x in ["L Sterling", "s Sterling", "d Sterling"]]))
+    no_currency, no_sterling = empty
+
     # If there is no currency money, mark as contextless transaction
-    if all([get_col(row, x) in ["-", " -", "- "] for x in ["L Currency", "s Currency", "d Currency", "L Sterling", "s Sterling", "d Sterling"]]):
+    if no_currency and no_sterling:
         row_context["currency_totaling_contextless"] = True
     
     # If there is Colony Currency Money, remember it
-    elif not all([get_col(row, x) in ["-", " -", "- "] for x in ["L Currency", "s Currency", "d Currency"]]):
+    elif not no_currency:
         row_context["currency_type"] = "Currency"
         row_context["pounds"] = get_col(row, "L Currency")
         row_context["shillings"] = get_col(row, "s Currency")
@@ -363,13 +509,13 @@ def setup_row_currency(row_context: dict, row, entries, transactions_context: di
         except Exception as e:
             row_context["money_obj"] = Money(l=0, s=0, d=0)
             row_context["farthings"] = row_context["money_obj"]["f"]
-            add_error(row_context, "Error in colony currency parsing: " +  traceback.format_exc(), get_col(row, "Entry"))
-            add_error(transactions_context, "Error in colony currency parsing: " + traceback.format_exc(), get_col(row, "Entry"))
+            add_error(row_context, ParserError(COLONY_CURRENCY_PARSING, "Error in colony currency parsing: ", row=row.name, exception=e), get_col(row, "Entry"))
+            add_error(transactions_context, ParserError(COLONY_CURRENCY_PARSING, "Error in colony currency parsing: ", row=row.name, exception=e), get_col(row, "Entry"))
         row_context["currency_totaling_contextless"] = False
     
     # If there is British Sterling Currency Money, remember it, setting currency type to both if there is both
     # Colony currency and sterling.
-    if not all([get_col(row, x) in ["-", " -", "- "] for x in ["L Sterling", "s Sterling", "d Sterling"]]):
+    if not no_sterling:
         if "currency_type" in row_context:
             row_context["currency_type"] = "Both"
         else:
@@ -385,8 +531,8 @@ def setup_row_currency(row_context: dict, row, entries, transactions_context: di
             row_context["shillings_ster"] = row_context["money_obj_ster"]["s"]
             row_context["pounds_ster"] = row_context["money_obj_ster"]["l"]
         except Exception as e:
-            add_error(row_context, "Error in sterling currency parsing " + traceback.format_exc(), get_col(row, "Entry"))
-            add_error(transactions_context, "Error in sterling currency parsing " + traceback.format_exc(), get_col(row, "Entry"))
+            add_error(row_context, ParserError(STERLING_CURRENCY_PARSING, "Error in sterling currency parsing ", row=row.name, exception=e), get_col(row, "Entry"))
+            add_error(transactions_context, ParserError(STERLING_CURRENCY_PARSING, "Error in sterling currency parsing ", row=row.name, exception=e), get_col(row, "Entry"))
             row_context["money_obj_ster"] = Money(l=0, s=0, d=0)
             row_context["farthings_ster"] = row_context["money_obj_ster"]["f"]
         row_context["currency_totaling_contextless"] = False
@@ -401,8 +547,8 @@ def verify_ender_totaling(row_context: dict, transactions: list, row):
     # If there are no errors in the transactions
     else:
         # Check for adding up
-        total_money_curr = sum([x["money_obj"] for x in transactions[:-1] if not x["currency_totaling_contextless"] and "errors" not in x and "money_obj" in x])
-        total_money_ster = sum([x["money_obj_ster"] for x in transactions[:-1] if not x["currency_totaling_contextless"] and "errors" not in x and "money_obj_ster" in x])
+        total_money_curr = sum([x.money_obj for x in transactions[:-1] if not x["currency_totaling_contextless"] and "errors" not in x and x.money_obj is not None])
+        total_money_ster = sum([x.money_obj_ster for x in transactions[:-1] if not x["currency_totaling_contextless"] and "errors" not in x and x.money_obj_ster is not None])
         
         # If there is a quantity in the total, total all commodities
         if not row_context["commodity_totaling_contextless"]:
@@ -411,8 +557,8 @@ def verify_ender_totaling(row_context: dict, transactions: list, row):
             if total_commodity != row_context["Quantity"]:
                 # Add error if commodity totaling fails
                 endl = "\n"
-                print_debug(f"Error: Commodity totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_commodity}, and expected total was {row_context['Quantity']}")
-                add_error(transactions[-1], f"Commodity totaling failed, total was {total_commodity}, expected was {row_context['Quantity']}", get_col(row, "Entry"))
+                print_debug(lambda: f"Error: Commodity totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_commodity}, and expected total was {row_context['Quantity']}")
+                add_error(transactions[-1], ParserError(COMMODITY_TOTALING, "Commodity totaling failed, total was {}, expected was {}", total_commodity, row_context['Quantity'], row=row.name), get_col(row, "Entry"))
         
         # If currency totaling successful do nothing
         if "currency_type" not in row_context:
@@ -424,8 +570,8 @@ def verify_ender_totaling(row_context: dict, transactions: list, row):
             # Otherwise add error
             else:
                 endl = "\n"
-                print_debug(f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotals were {total_money_curr} and {total_money_ster}, and expected totals were {row_context['money_obj']} and {row_context['money_obj_ster']}")
-                add_error(transactions[-1], f"Currency totaling failed, totals were {total_money_curr} and {total_money_ster}, expected were {row_context['money_obj']} and {row_context['money_obj_ster']}", get_col(row, "Entry"))
+                print_debug(lambda: f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotals were {total_money_curr} and {total_money_ster}, and expected totals were {row_context['money_obj']} and {row_context['money_obj_ster']}")
+                add_error(transactions[-1], ParserError(CURRENCY_TOTALING, "Currency totaling failed, totals were {} and {}, expected were {} and {}", total_money_curr, total_money_ster, row_context['money_obj'], row_context['money_obj_ster'], row=row.name), get_col(row, "Entry"))
         
         elif row_context["currency_type"] == "Sterling":
             if total_money_ster == row_context["money_obj_ster"]:
@@ -433,8 +579,8 @@ def verify_ender_totaling(row_context: dict, transactions: list, row):
             # Otherwise add error
             else:
                 endl = "\n"
-                print_debug(f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_money_ster}, and expected total was {row_context['money_obj_ster']}")
-                add_error(transactions[-1], f"Currency totaling failed, total was {total_money_ster}, expected was {row_context['money_obj_ster']}", get_col(row, "Entry"))
+                print_debug(lambda: f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_money_ster}, and expected total was {row_context['money_obj_ster']}")
+                add_error(transactions[-1], ParserError(CURRENCY_TOTALING, "Currency totaling failed, total was {}, expected was {}", total_money_ster, row_context['money_obj_ster'], row=row.name), get_col(row, "Entry"))
         
         elif row_context["currency_type"] == "Currency":
             if total_money_curr == row_context["money_obj"]:
@@ -442,6 +588,6 @@ def verify_ender_totaling(row_context: dict, transactions: list, row):
             # Otherwise add error
             else:
                 endl = "\n"
-                print_debug(f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_money_curr}, and expected total was {row_context['money_obj']}")
-                add_error(transactions[-1], f"Currency totaling failed, total was {total_money_curr}, expected was {row_context['money_obj']}", get_col(row, "Entry"))
+                print_debug(lambda: f"Error: Totaling failed on entries: {''.join(chain(*[str(x) + endl for x in transactions]))}\nTotal was {total_money_curr}, and expected total was {row_context['money_obj']}")
+                add_error(transactions[-1], ParserError(CURRENCY_TOTALING, "Currency totaling failed, total was {}, expected was {}", total_money_curr, row_context['money_obj'], row=row.name), get_col(row, "Entry"))
 
@@ -6,6 +6,7 @@ from traceback import format_exc
 from time import sleep as tsleep
 import asyncio
 from re import sub, search
+from hashlib import sha256
 
 # In this file: We create a continuously updating Map (updates every 30 minutes) from an online spreadsheet that looks like this:
 # {("absalom reid", "widow"): ["sarah reid"], ("person name", "relationship type"): ["relation 1", "relation 2"]}
@@ -20,12 +21,18 @@ familial = frozenset(["son", "daughter", "mother", "father", "wife", "husband",
 
 conjunctions = frozenset(["of", "to"])
 
-namelist = set()
+# Lowercase names (first and first + last) of everyone in the people index.
+# Replaced as a whole whenever the index is reparsed and never changed in place, so it can be read from any thread without a lock.
+_base_names = frozenset()
 
 _data_lock = Lock()
 
 _people_data: pd.DataFrame = None
 _data_updated = True
+# sha256 of the people index spreadsheet _people_data was read from, None until it has been downloaded
+_people_version: str = None
+# _people_version of the data _last_data was made from
+_last_version: str = None
 
 _bg_tasks = set()
 
@@ -33,13 +40,16 @@ _bg_tasks = set()
 def _update_data(i = 0):
     global _people_data
     global _data_updated
+    global _people_version
 
     if i == 3:
         logging.error("Failed to update people file")
         return
     _data_lock.acquire()
     try:
-        _people_data = pd.read_excel(get("https://shoppingstories.s3.amazonaws.com/PeopleIndex/C_1760_PP_Master+List.xlsx").content)
+        content = get("https://shoppingstories.s3.amazonaws.com/PeopleIndex/C_1760_PP_Master+List.xlsx").content
+        _people_data = pd.read_excel(content)
+        _people_version = sha256(content).hexdigest()
         _data_updated = True
         # print("Got data!")
         # print(_people_data)
@@ -63,9 +73,11 @@ async def _update_periodically():
 # Function to put the data in the format we need it in
 def _parse_people_data(data: pd.DataFrame):
     global _last_data
+    global _base_names
     
     try:
         lookup = {}
+        names = set()
 
         # Function to create the lookup data we need, to be used by pd.DataFrame.apply
         def create_lookup_for_row(entry: pd.Series):
@@ -85,7 +97,7 @@ def _parse_people_data(data: pd.DataFrame):
                     if len(toadd[0].split(" ")) == 1:
                         newName = toadd[0]
                         newName += f" {entry['Last Name'].strip().lower()}"
-                        if newName in namelist:
+                        if newName in names:
                             toadd = (newName, toadd[1])
 
                 if "LNU" not in entry["Last Name"]:
@@ -146,13 +158,14 @@ def _parse_people_data(data: pd.DataFrame):
             fn = str(entry["First Name"]).strip().lower()
             ln = str(entry["Last Name"]).strip().lower()
             if "lnu" in ln:
-                namelist.add(fn)
+                names.add(fn)
             elif "fnu" not in fn:
-                namelist.add(fn)
-                namelist.add(fn + " " + ln)
+                names.add(fn)
+                names.add(fn + " " + ln)
 
         data.apply(add_to_namelist, axis=1)
-        data.apply(create_lookup_for_row, axis=1)    
+        data.apply(create_lookup_for_row, axis=1)
+        _base_names = frozenset(names)
         return lookup
     
     except:
@@ -164,6 +177,7 @@ _last_data = None
 def _get_people_data():
     global _last_data
     global _data_updated
+    global _last_version
     
     # Get the data if we have none
     if _last_data is None:
@@ -173,6 +187,7 @@ def _get_people_data():
             _update_data()
             _data_lock.acquire()
         _last_data = _parse_people_data(_people_data.copy())
+        _last_version = _people_version
         _data_updated = False
         _data_lock.release()
 
@@ -182,11 +197,18 @@ def _get_people_data():
             acquired = _data_lock.acquire(False)
             if acquired:
                 _last_data = _parse_people_data(_people_data.copy())
+                _last_version = _people_version
                 _data_updated = False
                 _data_lock.release()
 
     return _last_data
 
+# Returns the version of the people index parses use right now (a hash of its spreadsheet), for anything remembering parser
+# output that depends on it. Downloads the index first if it hasn't been yet.
+def people_index_version() -> str:
+    _get_people_data()
+    return _last_version
+
 async def people_index_coro():
     # Schedule continuous updating of _people_data, make sure we quickly get the data the first time
     _updater = asyncio.create_task(_update_periodically())
@@ -202,6 +224,64 @@ async def people_index_coro():
         print(Person("Absalom Reid")["all_relations"])
         print(Person("absalom reid"))
 
+# Names known to a single parse: everyone in the people index when the parse started, plus the names the parse itself finds.
+# preprocess adds proper nouns it comes across and get_transactions checks words against them.
+# Every parse gets its own registry so files can be parsed at the same time (and in any order) without seeing each other's names.
+class NameRegistry:
+    def __init__(self, base: frozenset = None):
+        if base is None:
+            # Make sure the people index has been read at least once
+            _get_people_data()
+            base = _base_names
+        self.base = base
+        self.found = set()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.found or name in self.base
+
+    def add(self, name: str):
+        self.found.add(name)
+
+    def update(self, names):
+        self.found.update(names)
+
+# Person lookups for a single parse. Works like Person, but remembers every answer it gives and reads the people index once,
+# so a file sees the same index from start to finish and a name that comes up again costs a dict lookup.
+# lookups counts the questions asked and saved how many of them were answered from what it remembered.
+class PersonResolver:
+    def __init__(self):
+        self.people_data = _get_people_data()
+        self.base_names = _base_names
+        self._names = {}
+        self._relations = {}
+        self.lookups = 0
+        self.saved = 0
+
+    # Same as str(Person(name))
+    def name(self, name: str) -> str:
+        self.lookups += 1
+        display = self._names.get(name)
+        if display is None:
+            display = self._names[name] = str(Person(name))
+        else:
+            self.saved += 1
+        return display
+
+    # Same as Person(name)[relationship], for relationship in relationships
+    def relations(self, name: str, relationship: str) -> list:
+        self.lookups += 1
+        key = (name.lower().strip(), relationship.lower())
+        found = self._relations.get(key)
+        if found is None:
+            found = self._relations[key] = self.people_data.get(key, [])
+        else:
+            self.saved += 1
+        return found
+
+    # Same as Person(name)["exists"]
+    def exists(self, name: str) -> bool:
+        return name.lower().strip() in self.base_names
+
 # Helper class for dealing with people, allows you to do Person["son"], Person["daughter"], Person["exists"], etc.
 class Person:
     def __init__(self, name: str):
@@ -224,7 +304,7 @@ class Person:
                 return []
 
         elif key == "exists":
-            return self.full_name in namelist
+            return self.full_name in _base_names
 
         elif "all_relations" in key:
             relations = {}
@@ -0,0 +1,67 @@
+import spacy
+from threading import Lock
+from time import perf_counter
+import logging
+
+# In this file: A process-wide registry of loaded spaCy pipelines.
+# Loading en_core_web_trf takes far longer than actually running it on a sheet, so every model is loaded
+# at most once per process (lazily, the first time something asks for it) and then shared by every parse_file/parse_folder call.
+
+# Pipelines are asked for by profile, which picks the model and which of its components we skip loading.
+# The preprocessor only ever reads tag_ and ent_type_, so the dependency parser and lemmatizer are dead weight,
+# as is the attribute ruler (it only maps tags to the coarse pos tags the lemmatizer uses).
+# Maps profile name to (model name, components to leave out)
+_unused_components = ("parser", "lemmatizer", "attribute_ruler")
+profiles = {
+    # What the parser has always used
+    "trf": ("en_core_web_trf", ()),
+    # Same model with only the transformer, tagger and ner
+    "trf-fast": ("en_core_web_trf", _unused_components),
+    "md": ("en_core_web_md", _unused_components),
+    "sm": ("en_core_web_sm", _unused_components),
+}
+
+default_profile = "trf"
+
+_pipelines = {}
+
+# How long each profile took to load, in seconds
+_load_times = {}
+
+_registry_lock = Lock()
+
+# Returns the model name a profile uses
+def get_profile_model(profile: str = default_profile) -> str:
+    if profile not in profiles:
+        raise ValueError(f"Unknown parser profile {profile}, expected one of {', '.join(profiles)}")
+    return profiles[profile][0]
+
+# Returns the loaded pipeline for profile, loading it if this process has not loaded it yet
+def get_pipeline(profile: str = default_profile):
+    # Fast path, no locking once the profile is loaded
+    nlp = _pipelines.get(profile)
+    if nlp is not None:
+        return nlp
+
+    model_name = get_profile_model(profile)
+    with _registry_lock:
+        # Someone else may have loaded the profile while we were waiting on the lock
+        if profile not in _pipelines:
+            logging.info(f"Loading spaCy model {model_name} for profile {profile}")
+            start = perf_counter()
+            # spacy ignores excluded names the model doesn't have
+            _pipelines[profile] = spacy.load(model_name, exclude=list(profiles[profile][1]))
+            _load_times[profile] = perf_counter() - start
+            logging.info(f"Loaded spaCy model {model_name} for profile {profile} in {_load_times[profile]:.2f}s")
+        return _pipelines[profile]
+
+# Returns a copy of the load times (in seconds) of every profile loaded in this process
+def get_load_times():
+    with _registry_lock:
+        return dict(_load_times)
+
+# Drops every loaded pipeline, mostly useful to free memory once a parse is done
+def clear_pipelines():
+    with _registry_lock:
+        _pipelines.clear()
+        _load_times.clear()
@@ -1,13 +1,28 @@
 import pandas as pd
-from .parser_utils import get_col, get_col_name, add_to_by, isNoun, fix_marginalia_dates
-from re import split, match, search, sub, finditer, Match
-import spacy
+from .parser_utils import get_col, get_col_name, add_to_by, isNoun, fix_marginalia_dates, fix_marginalia_dates_stream, frame_rows
+from re import compile, Match
 from itertools import chain
 from .indices import amount_set, item_set
 import logging
-from .people import namelist
+from collections import deque
+from itertools import islice
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from .people import NameRegistry
+from .pipelines import get_pipeline, get_profile_model
+from .annotation_cache import get_annotation_cache, make_key, serialize_doc, deserialize_tokens
+from .config import ParserConfig, default_config
+from .rewrites import Rewrite, RewriteScanner
+from .fast_tagger import tag_formulaic
+from .sheet_stream import SheetStream
+from .parse_stats import stage, timed, count
+from .token_stream import TokenStream
 
             
+# Bump this whenever a change here should invalidate cached annotations
+PREPROCESSOR_VERSION = 1
+
 # Regex for the price
 price_regex = r"((\d+[Lsdp])|((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+)))"
 
@@ -21,6 +36,17 @@ month_regex = r"(([Jj]an|[Ff]eb|[Mm]ar|[Aa]pr|[Mm]ay|[Jj]un|[Jj]ul|[Aa]ug|[Ss]ep
 # Matches annoying price format: 12..2..4 ¼, extracting the 12, 2, 4, and ¼.
 fancy_price = r"£?(\d+)?\.\.\[?(\d+)\]?\.\.(\[?([0-9]+)\]?)?(\s?([\u00BC-\u00BE\u2150-\u215E]))?"
 
+# Every pattern the preprocessor uses is compiled once here rather than looked up in re's cache on every call
+_price_pattern = compile(price_regex)
+_unit_price_pattern = compile(r"\d+[Lsdp]")
+_slash_price_pattern = compile(r"((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+))")
+_next_price_pattern = compile(r"((\d+[Lsdp])|((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+))?)")
+_number_frac_pattern = compile(r"(?<!/|\d)\d+\s[\u00BC-\u00BE\u2150-\u215E]")
+_bracketed_word_pattern = compile(r"\[\w+\]")
+_letter_entry_id_pattern = compile(r"\s*\d+[a-zA-Z]+\s*")
+_split_pattern = compile(r"(?<!\s)([\n\t]|    )(?!\s)")
+_separator_pattern = compile(r"[\n\t]|    ")
+
 # Simple function to remove the XX tag as it usually indicates a parser error
 def _remove_xx(tag, replacement):
     if tag == "XX":
@@ -29,7 +55,7 @@ def _remove_xx(tag, replacement):
         return tag
 
 def _remove_ditto(match: Match) -> str:
-    newRe = search(r"\[\w+\]", match.group())
+    newRe = _bracketed_word_pattern.search(match.group())
     if newRe:
         newStr = (newRe.group())[1:-1]
         return newStr
@@ -95,6 +121,13 @@ def _handle_fancy_price(match: Match) -> str:
 
     return newStr.strip()
 
+_tobacco_bracket_rewrite = Rewrite("tobacco brackets", r"(\w+)[^\S\r\n]*\[\s*(\w+)\s*\]", handle_bracket_replacements)
+_tobacco_remove_brackets_rewrite = Rewrite("tobacco remove brackets", r"\[\s*(\w+)\s*\]", lambda x: x.group(1))
+_tobacco_location_rewrite = Rewrite("tobacco location", r"on\s+(\w+)", lambda x: " tobacco_location " + x.group(1) + " ")
+_tobacco_final_line = Rewrite("tobacco final line", r"\n\s+(\d+)\s+at\s+((\d+[Lsdp])|((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+)))\s+([^\n]+)")
+_tobacco_whitespace_rewrite = Rewrite("tobacco whitespace", r"\s+|\n", " ")
+_tobacco_and_rewrite = Rewrite("tobacco and", r"(&|[aA]nd)\s+", "")
+
 # Handles entries of the form:
 # By 2 hogshead tobacco on occoquan
 # [TM: 0780 BH] N 1  1116. .130. .986
@@ -105,18 +138,14 @@ def _handle_fancy_price(match: Match) -> str:
 # Except that the [TM: 0780 BH] is already replaced with its replacement when we get here so we don't have to worry about it
 def _handle_multiline_tobacco(tob_match: list[Match], entry: str):
     # Clean up brackets in entry
-    replace_regex = r"(\w+)[^\S\r\n]*\[\s*(\w+)\s*\]"
-    entry = sub(replace_regex, handle_bracket_replacements, entry)
-    remove_brackets_regex = r"\[\s*(\w+)\s*\]"
-    entry = sub(remove_brackets_regex, lambda x: x.group(1), entry)
+    entry = _tobacco_bracket_rewrite.sub(entry)
+    entry = _tobacco_remove_brackets_rewrite.sub(entry)
 
     # If we see a location for the tobacco, flag it as such
-    location_regex = r"on\s+(\w+)"
-    entry = sub(location_regex, lambda x: " tobacco_location " + x.group(1) + " ", entry)
+    entry = _tobacco_location_rewrite.sub(entry)
 
-    # Regex to match the final line of trasactions similar to the above
-    final_line_regex = r"\n\s+(\d+)\s+at\s+((\d+[Lsdp])|((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+)))\s+([^\n]+)"
-    final = [x for x in finditer(final_line_regex, entry)]
+    # Find the final line of trasactions similar to the above
+    final = _tobacco_final_line.finditer(entry)
     if final:
         # Only do this for the actual final line, not if another line looks similar to the final line
         final = final[-1]
@@ -139,8 +168,8 @@ def _handle_multiline_tobacco(tob_match: list[Match], entry: str):
         entry = entry.replace(m.group().strip(), new_str)
         # print(new_str, ",", entry, ",", repr(m.group()))
 
-    entry = sub(r"\s+|\n", " ", entry)
-    entry = sub(r"(&|[aA]nd)\s+", "", entry)
+    entry = _tobacco_whitespace_rewrite.sub(entry)
+    entry = _tobacco_and_rewrite.sub(entry)
     # print(entry)
     return entry
 
@@ -148,455 +177,680 @@ def _handle_multiline_tobacco(tob_match: list[Match], entry: str):
 def _get_tobacco_mark_replacement(mark: Match) -> str:
     return f"tobacco_mark_number {mark.group(1)} tobacco_mark_text {mark.group(2)}"
 
-# Initial processing and labelling of transaction parts e.g. nouns, keywords, etc.
-# Note that this is a generator due to it being slow
-# Goal of this function is to create a list for every row that contains a list of important data from the entry
-# This is done via first tokenizing and then tagging every word in the entry, then combining all tokens with similar enough tags or according to
-# other rules. Conceptually, we want to tag an entry like the following:
+# Some part of a full month name is in every date month_regex matches
+_month_name_parts = ("anuary", "ebruary", "arch", "pril", "May", "may", "une", "uly", "ugust", "eptember", "ctober", "ovember", "ecember")
+
+# Dates, fancy prices, pound signs and tobacco marks are rewritten in one scan of the entry.
+# None of their replacements contain anything the others match (the fancy price pattern eats its own £), see RewriteScanner.
+_entry_scanner = RewriteScanner("entry markers", [
+    Rewrite("dates", month_regex, _handle_dates, requires=_month_name_parts),
+    Rewrite("fancy prices", fancy_price, _handle_fancy_price, requires=("..",)),
+    Rewrite("pound sign", r"£(\d+)", lambda x: x.group(1) + "L", requires=("£",)),
+    Rewrite("tobacco marks", mark_regex, _get_tobacco_mark_replacement, requires=("[TM:",)),
+])
+
+_multiline_tobacco_pattern = Rewrite("multiline tobacco", r"((N|N[oO]|N[oO]\.|Note)\s+)?(\d+)\s+(\d+)\.\s+\.(\d+)\.\s+\.(\d+)(\s+)?\n?", requires=(".",))
+_tobacco_spacing_rewrite = Rewrite("multiline tobacco spacing", r"(\s\s+)|\n", " ")
+_ditto_rewrite = Rewrite("ditto", r"(DO|Do|DITTO|Ditto|D)\.*\s*\[\w+\]", _remove_ditto, requires=("D",))
+_unit_spacing_rewrite = Rewrite("unit spacing", r"(?<=\s)[\u00BC-\u00BE\u2150-\u215E\d]+([Mm]|wt|w)(?=\s\[)", lambda match: match.group(0)[:-2] + " " + match.group(0)[-2:] if "wt" in match.group(0) else match.group(0)[:-1] + " " + match.group(0)[-1], requires=("[",))
+_tobacco_note_pattern = Rewrite("tobacco notes", r"N\s+\d+\s+\d+", requires=("N",))
+_tobacco_note_end_rewrite = Rewrite("tobacco note end", r"(\d+)[^\S\n\r]+(\d+)(([^\S\n\r]?[\S][^\S\n\r]?)+)\Z", lambda x: f"{x.group(1)}, {x.group(2)}{x.group(3)}")
+_tobacco_note_whitespace_rewrite = Rewrite("tobacco note whitespace", r"\s+", " ")
+_tobacco_note_n_rewrite = Rewrite("tobacco note N", r"(N\s+)?(\d+)\s(\d+)\s(?!$)", lambda x: f"N {x.group(2)} {x.group(3)} ")
+_subtotal_rewrite = Rewrite("mini subtotals", r"[\u00a3]?\s?(\d+)?\s?\.\.\s?\d+\s?\.\.\s?\d+\s?[\u00BC-\u00BE\u2150-\u215E]?", " ", requires=("..",))
+
+# Cleans up the entry text of a row (dates, fancy prices, tobacco, brackets, etc.) and splits it into the
+# smaller entries that get sent to spacy.
+# Returns (big_entry, smaller entries), or None if the row has nothing for us to parse.
+def _prepare_row(row):
+    # Ignore rows with no entry text
+    big_entry = get_col(row, "Entry")
+    if big_entry == "-" or big_entry == "" or big_entry is None or str(big_entry) == "nan":
+        return None
+
+    if _letter_entry_id_pattern.match(str(get_col(row, "EntryID"))):
+        return None
+
+    # Remove } from the text as it messes everything up
+    big_entry = big_entry.replace("}", "")
+
+    # Replace dates with easily parseable tokens
+    # Replace difficult to deal with price formats with easily parseable tokens
+    # Remove fancy pounds symbol as that confuses the parser
+    # Replace all tobacco marks with easily parseable tokens
+    big_entry = _entry_scanner.sub(big_entry)
+
+    # print(big_entry)
+    # Check for multiline tobacco entries and use special parsing rules if we find one
+    tob_match = _multiline_tobacco_pattern.finditer(big_entry)
+    if tob_match:
+        if (all([get_col(row, x).strip() in {"-", "", None} for x in ("L Sterling", "s Sterling", "d Sterling", "L Currency", "s Currency", "d Currency")])):
+            pass
+        big_entry = _handle_multiline_tobacco(tob_match, big_entry)
+
+        # Make sure there is not enough leftover whitespace to cause us to automatically split this transaction into multiple later on
+        # print(big_entry)
+        big_entry = _tobacco_spacing_rewrite.sub(big_entry)
+        # print(big_entry)
+        # print()
+
+    # Remove "Ditto"
+    big_entry = _ditto_rewrite.sub(big_entry)
+
+    # Replace 1w with 1 w and 1M with 1 M and so on
+    big_entry = _unit_spacing_rewrite.sub(big_entry)
+
+    # If we see tobacco notes... 
+    if _tobacco_note_pattern.search(big_entry):
+        # If we a have a bunch of these, make sure something looking like a tobacco entry at the end of the string cannot be seen later as a tobacco entry (the final line is guaranteed to not have a tobacco entry in it)
+        # (we do this via inserting a comma between the numbers so later regexes cannot match)
+        if big_entry.count("\n") > 2:
+            big_entry = _tobacco_note_end_rewrite.sub(big_entry)
+
+        # remove spaces so we don't split entry.
+        big_entry = _tobacco_note_whitespace_rewrite.sub(big_entry)
+
+        # Add Ns in front of all tobacco notes
+        big_entry = _tobacco_note_n_rewrite.sub(big_entry)
+
+    # Remove mini subtotals
+    big_entry = _subtotal_rewrite.sub(big_entry)
+
+    # Split the entry by "    " or \n or \t
+    smaller_entries = _split_pattern.split(big_entry)
+    smaller_entries = [x for x in smaller_entries if _separator_pattern.match(x) is None]
+    smaller_entries = add_to_by(smaller_entries)
+    new_smaller_entries = []
+
+    # Remove words before words with [] if they follow our rules
+    # Remove <>[] from words
+    for j, smaller_entry in enumerate(smaller_entries):
+        new_sent = []
+        smaller_entry = smaller_entry.split(" ")
+        for i, word in enumerate(smaller_entry):
+            if word.startswith("<") and word.endswith(">") and not word[1].isnumeric():
+                continue
+            word = word.replace(">", "").replace("<", "").replace("^", "")
+            if "wt." == word[-3:]:
+                word = word.replace("wt.", "wt")
+                smaller_entry[i] = word
+            if word.startswith("[") and i-1 >= 0 and len(word) >= 2 and len(smaller_entry) > 0 and smaller_entry[i-1].lower().startswith(word[1].lower()):
+                new_sent.pop()
+            elif is_exception(word, i, smaller_entry):
+                new_sent.pop()
+            elif word.strip("[]<>^") == ".":
+                continue
+            new_sent.append(word.strip("[]<>^").replace(">", "").replace("<", "").replace("^", "").replace("[", "").replace("]", ""))
+        new_smaller_entries.append(" ".join(new_sent))
+
+    return (big_entry, new_smaller_entries)
+
+# Labels the tokens of a single smaller entry and combines them into the larger tokens the transaction parser wants.
+# Conceptually, we want to tag an entry like the following:
 # By 6 yd bed sheets for Jeff 6:/
 # Should become something like this:
 # [("By", "TRANS", ""), ("6 yd", "AMT", "CARDINAL"), ("bed sheets", "", "NN"), ("for", "", "IN"), ("Jeff", "PERSON", "NNP"), ("6:/", "PRICE", "CD")]
-# This allows us to do a much higher level parse in the next step.
-def preprocess(df: pd.DataFrame):
-    logging.info("Preprocessing.")
-    parsed_entries = []
-    
-    # Fix the marginalia issues present in the underlying spreadsheets
-    # Fix missing dates by imputing with previous data
-    fix_marginalia_dates(df)
+# entry is the list of tokens (anything with text, ent_type_ and tag_, see _annotate) for the smaller entry.
+# Any proper nouns we come across are added to names.
+def _combine_tokens(entry, names: set):
+    entry = [x for x in entry if x.tag_ != "_SP"]
+
+    # Sometimes spacy thinks folio is an incomplete word
+    for x in entry:
+        if x.text == "folio":
+            x.tag_ = "NN"
+
+    # Function to combine tokens based on the context
+    # If they are probably the same thing we want to combine them to be the same thing
+    def combine_tok_with_prev(entries: list, token, space: bool = True, new_ent: str = None, new_pos: str = None, toret: bool=False):
+        old_text, old_ent, old_pos = entries.pop()
+        if not toret:
+            token_text = token.text
+        else:
+            token_text = token[0]
 
-    
-    # For row in df
-    for key, row in df.iterrows():
-        
-        # Ignore rows with no entry text
-        big_entry = get_col(row, "Entry")
-        if big_entry == "-" or big_entry == "" or big_entry is None or str(big_entry) == "nan":
-            continue
+        if new_ent is None:
+            new_ent = old_ent
+        if new_pos is None:
+            new_pos = old_pos
 
-        if match(r"\s*\d+[a-zA-Z]+\s*", str(get_col(row, "EntryID"))):
-            continue
+        if new_ent == "PRICE" and new_pos == "XX":
+            new_pos = "CD"
 
-        # Remove } from the text as it messes everything up
-        big_entry = big_entry.replace("}", "")
+        if space:
+            new_word = (old_text + " " + token_text, new_ent, new_pos)
+        else:
+            new_word = (old_text + token_text, new_ent, new_pos)
 
-        # Replace dates with easily parseable tokens
-        big_entry = sub(month_regex, _handle_dates, big_entry)
+        if not toret:
+            entries.append(new_word)
+        else:
+            return new_word
+
+    # If the token is at the end of the entry and it looks like 8d or 10s or 5/8 it is probably the total price. 
+    def isProbablyPrice(token):
+        if not entry:
+            return False
+        if type(token) is tuple:
+            return entry[-1] == token and (_unit_price_pattern.match(token[0]) or _slash_price_pattern.match(token[0]))
+        else:
+            return entry[-1] == token and (_unit_price_pattern.match(token.text) or _slash_price_pattern.match(token.text))
 
-        # Replace difficult to deal with price formats with easily parseable tokens
-        big_entry = sub(fancy_price, _handle_fancy_price, big_entry)
 
-        # Remove fancy pounds symbol as that confuses the parser
-        big_entry = sub(r"£(\d+)", lambda x: x.group(1) + "L", big_entry)
+    # Token stack
+    new_entry = []
 
-        # Replace all tobacco marks with easily parseable tokens
-        big_entry = sub(mark_regex, _get_tobacco_mark_replacement, big_entry)
+    # Labels specific tokens, and attmepts to combine as many adjacent tokens as possible into larger tokens 
+    for i, token in enumerate(entry):
+        # print(token.text, token.ent_type_, token.tag_)
 
-        # print(big_entry)
-        # Check for multiline tobacco entries and use special parsing rules if we find one
-        tob_match = [x for x in finditer(r"((N|N[oO]|N[oO]\.|Note)\s+)?(\d+)\s+(\d+)\.\s+\.(\d+)\.\s+\.(\d+)(\s+)?\n?", big_entry)]
-        if tob_match:
-            if (all([get_col(row, x).strip() in {"-", "", None} for x in ("L Sterling", "s Sterling", "d Sterling", "L Currency", "s Currency", "d Currency")])):
-                pass
-            big_entry = _handle_multiline_tobacco(tob_match, big_entry)
-            
-            # Make sure there is not enough leftover whitespace to cause us to automatically split this transaction into multiple later on
-            # print(big_entry)
-            big_entry = sub(r"(\s\s+)|\n", " ", big_entry)
-            # print(big_entry)
-            # print()
+        # Initialize prev_token to the last token in the stack and next_token to the next token in the token list
+        prev_token = None
+        next_token = None
+        if new_entry:
+            prev_token = new_entry[-1]
+        if i + 1 < len(entry):
+            next_token = entry[i + 1]
 
-        # Remove "Ditto"
-        big_entry = sub(r"(DO|Do|DITTO|Ditto|D)\.*\s*\[\w+\]", _remove_ditto, big_entry)
+        # Remove strange things like cardinal numbers that are IDd as people
+        if token.ent_type_ == "PERSON":
+            if "NN" not in token.tag_:
+                token.ent_type_ = ""
 
-        # Replace 1w with 1 w and 1M with 1 M and so on
-        big_entry = sub(r"(?<=\s)[\u00BC-\u00BE\u2150-\u215E\d]+([Mm]|wt|w)(?=\s\[)", lambda match: match.group(0)[:-2] + " " + match.group(0)[-2:] if "wt" in match.group(0) else match.group(0)[:-1] + " " + match.group(0)[-1], big_entry)
-        
-        # If we see tobacco notes... 
-        if search(r"N\s+\d+\s+\d+", big_entry):
-            # If we a have a bunch of these, make sure something looking like a tobacco entry at the end of the string cannot be seen later as a tobacco entry (the final line is guaranteed to not have a tobacco entry in it)
-            # (we do this via inserting a comma between the numbers so later regexes cannot match)
-            if big_entry.count("\n") > 2:
-                big_entry = sub(r"(\d+)[^\S\n\r]+(\d+)(([^\S\n\r]?[\S][^\S\n\r]?)+)\Z", lambda x: f"{x.group(1)}, {x.group(2)}{x.group(3)}", big_entry)
-            
-            # remove spaces so we don't split entry.
-            big_entry = sub(r"\s+", " ", big_entry)
-            
-            # Add Ns in front of all tobacco notes
-            big_entry = sub(r"(N\s+)?(\d+)\s(\d+)\s(?!$)", lambda x: f"N {x.group(2)} {x.group(3)} ", big_entry)
+        if token.tag_ == "NNP" and len(token.text.split(" ")) == 1:
+            names.add(token.text.lower())
 
-        # Remove mini subtotals
-        big_entry = sub(r"[\u00a3]?\s?(\d+)?\s?\.\.\s?\d+\s?\.\.\s?\d+\s?[\u00BC-\u00BE\u2150-\u215E]?", " ", big_entry)
-        
-        # Split the entry by "    " or \n or \t
-        smaller_entries = split(r"(?<!\s)([\n\t]|    )(?!\s)", big_entry)
-        smaller_entries = [x for x in smaller_entries if match(r"[\n\t]|    ", x) is None]
-        smaller_entries = add_to_by(smaller_entries)
-        new_smaller_entries = []
-
-        # Remove words before words with [] if they follow our rules
-        # Remove <>[] from words
-        for j, smaller_entry in enumerate(smaller_entries):
-            new_sent = []
-            smaller_entry = smaller_entry.split(" ")
-            for i, word in enumerate(smaller_entry):
-                if word.startswith("<") and word.endswith(">") and not word[1].isnumeric():
-                    continue
-                word = word.replace(">", "").replace("<", "").replace("^", "")
-                if "wt." == word[-3:]:
-                    word = word.replace("wt.", "wt")
-                    smaller_entry[i] = word
-                if word.startswith("[") and i-1 >= 0 and len(word) >= 2 and len(smaller_entry) > 0 and smaller_entry[i-1].lower().startswith(word[1].lower()):
-                    new_sent.pop()
-                elif is_exception(word, i, smaller_entry):
-                    new_sent.pop()
-                elif word.strip("[]<>^") == ".":
-                    continue
-                new_sent.append(word.strip("[]<>^").replace(">", "").replace("<", "").replace("^", "").replace("[", "").replace("]", ""))
-            new_smaller_entries.append(" ".join(new_sent))
-        
+        # If we see the sheriff or the parish collector mark them as people
+        if token.text.lower() == "sherriff" or token.text.lower() == "sheriff" or token.text.lower() == "parish" or token.text.lower() == "collector" or token.text.lower() == "parrish":
+            token.ent_type_ = "PERSON"
+            token.tag_ = "NNP"
 
-        parsed_entries_in_row = []
-        # For entry in row
-        for entry in new_smaller_entries:
-            nlp = spacy.load("en_core_web_trf")
-            entry = nlp(entry)
-
-            entry = [x for x in entry if x.tag_ != "_SP"]
-
-            # Sometimes spacy thinks folio is an incomplete word
-            for x in entry:
-                if x.text == "folio":
-                    x.tag_ = "NN"
-                    
-            # Function to combine tokens based on the context
-            # If they are probably the same thing we want to combine them to be the same thing
-            def combine_tok_with_prev(entries: list, token, space: bool = True, new_ent: str = None, new_pos: str = None, toret: bool=False):
-                old_text, old_ent, old_pos = entries.pop()
-                if not toret:
-                    token_text = token.text
-                else:
-                    token_text = token[0]
-
-                if new_ent is None:
-                    new_ent = old_ent
-                if new_pos is None:
-                    new_pos = old_pos
-                
-                if new_ent == "PRICE" and new_pos == "XX":
-                    new_pos = "CD"
-
-                if space:
-                    new_word = (old_text + " " + token_text, new_ent, new_pos)
-                else:
-                    new_word = (old_text + token_text, new_ent, new_pos)
-                
-                if not toret:
-                    entries.append(new_word)
-                else:
-                    return new_word
-
-            # If the token is at the end of the entry and it looks like 8d or 10s or 5/8 it is probably the total price. 
-            def isProbablyPrice(token):
-                if not entry:
-                    return False
-                if type(token) is tuple:
-                    return entry[-1] == token and (match(r"\d+[Lsdp]", token[0]) or match(r"((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+))", token[0]))
-                else:
-                    return entry[-1] == token and (match(r"\d+[Lsdp]", token.text) or match(r"((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+))", token.text))
+        # Allows us to start elif chain
+        if False:
+            pass
 
+        # Handle special markers for fancy price format
+        elif "fancy_" in token.text:
+            new_entry.append(("", "", "IGNORE_PRICES"))
+            new_entry.append(("", token.text, token.text + "_APP_NEXT"))
 
-            # Token stack
-            new_entry = []
+        # Handle special markers for dates
+        elif token.text == "date_month":
+            new_entry.append(("", "DATE.MONTH", "DATE_APP_NEXT"))
 
-            # Labels specific tokens, and attmepts to combine as many adjacent tokens as possible into larger tokens 
-            for i, token in enumerate(entry):
-                # print(token.text, token.ent_type_, token.tag_)
-                
-                # Initialize prev_token to the last token in the stack and next_token to the next token in the token list
-                prev_token = None
-                next_token = None
-                if new_entry:
-                    prev_token = new_entry[-1]
-                if i + 1 < len(entry):
-                    next_token = entry[i + 1]
-
-                # Remove strange things like cardinal numbers that are IDd as people
-                if token.ent_type_ == "PERSON":
-                    if "NN" not in token.tag_:
-                        token.ent_type_ = ""
-                
-                if token.tag_ == "NNP" and len(token.text.split(" ")) == 1:
-                    namelist.add(token.text.lower())
-
-                # If we see the sheriff or the parish collector mark them as people
-                if token.text.lower() == "sherriff" or token.text.lower() == "sheriff" or token.text.lower() == "parish" or token.text.lower() == "collector" or token.text.lower() == "parrish":
-                    token.ent_type_ = "PERSON"
-                    token.tag_ = "NNP"
-
-                # Allows us to start elif chain
-                if False:
-                    pass
-
-                # Handle special markers for fancy price format
-                elif "fancy_" in token.text:
-                    new_entry.append(("", "", "IGNORE_PRICES"))
-                    new_entry.append(("", token.text, token.text + "_APP_NEXT"))
-
-                # Handle special markers for dates
-                elif token.text == "date_month":
-                    new_entry.append(("", "DATE.MONTH", "DATE_APP_NEXT"))
-
-                elif token.text == "date_day":
-                    new_entry.append(("", "DATE.DAY", "DATE_APP_NEXT"))
-
-                elif token.text == "end_date":
-                    pass
-
-                # Make sure sundries are not marked as people
-                elif token.text.lower() in {"sundries", "sundrys", "sundry"}:
-                    new_entry.append((token.text, "", "NN"))
-
-                # Handle special markers from tobacco marks, applying these ent_type and tag to the token following them
-                elif token.text == "tobacco_mark_number":
-                    new_entry.append(("", "TM#", "TMs"))
-                
-                elif token.text == "tobacco_mark_text":
-                    new_entry.append(("", "TM.TEXT", "TMs"))
-
-                # Handle special markers from multiline tobacco entries, applying these ent_type and tag to the token following them
-                elif token.text == "tobacco_note":
-                    new_entry.append(("", "TB_N", "MLTBE"))
-                
-                elif token.text == "total_weight":
-                    new_entry.append(("", "TB_GW", "MLTBE"))
-
-                elif token.text == "tare_weight":
-                    new_entry.append(("", "TB_TW", "MLTBE"))
-
-                elif token.text == "tobacco_weight":
-                    new_entry.append(("", "TB_W", "MLTBE"))
-
-                # In case we can't find the tobacco totaling line, mark this entry to be combined with the next entry later.
-                elif token.text == "no_final_tobacco":
-                    new_entry.append(("", "TB_NF", "MLTBE"))
-
-                elif token.text == "final_weight":
-                    new_entry.append(("", "TB_FW", "MLTBE"))
-                
-                elif token.text == "unit_price":
-                    new_entry.append(("", "TB_UP", "MLTBE"))
-                
-                elif token.text == "tobacco_location":
-                    new_entry.append(("", "TB_LOC", "MLTBE"))
-
-                # Handle random tobacco notes like N 15  39
-                elif token.text == "N" and next_token is not None and next_token.text.isnumeric():
-                    new_entry.append(("", "TB_NOTE", "SLTBE"))
-
-                elif prev_token is not None and prev_token[2] == "SLTBE":
-                    if prev_token[0] == "":
-                        combine_tok_with_prev(new_entry, token, space=False)
-                    elif prev_token[0].lower() == "for":
-                        # Ignore the word for in these
-                        pass
-                    else:
-                        if next_token is not None and next_token.text in ["pound", "pounds"]:
-                            combine_tok_with_prev(new_entry, token)
-                        else:
-                            # print(next_token.text, new_entry[-1][0])
-                            combine_tok_with_prev(new_entry, token, new_pos="SLTBE_F")
-                            # print(next_token.text, new_entry[-1][0])
-
-                # When the previous token was a date marker, remember what follows it as part of a date
-                elif prev_token is not None and prev_token[2] == "DATE_APP_NEXT":
-                    combine_tok_with_prev(new_entry, token, space=False, new_pos="DATE_REGEX")
-
-                # If token pos tells us specifically to append the next thing we see
-                elif prev_token is not None and prev_token[2].endswith("_APP_NEXT"):
-                    combine_tok_with_prev(new_entry, token, space=False, new_pos=prev_token[2].removesuffix("_APP_NEXT")) 
-
-                # If we find a cardinal in the item set, it is probably not a cardinal.
-                elif token.tag_ == "CD" and token.text.lower() in item_set:
-                    new_entry.append((token.text, "", "NN"))
-
-                # Label tokens indicating record type as TRANS
-                elif token.text == "By" or token.text == "To":
-                    new_entry.append((token.text, "TRANS", token.tag_))
- 
-                # Label end of list tokens as ENDER
-                elif token.text == "Total" or token.text == "Subtotal":
-                    new_entry.append((token.text, "ENDER", token.tag_))
-                
-                # Label prices as PRICE
-                elif isProbablyPrice(token):
-                    new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
-                
-                # If we find something in the amount word index, combine it with the previous token and mark as amt unless there are no numbers to combine it with
-                elif prev_token is not None and token.text.lower() in amount_set and prev_token[2] not in ["DATE_REGEX"] and (prev_token[2] in {"DT", "CD"} or prev_token[1] == "CARDINAL" or prev_token[1] == "QUANTITY" or prev_token[1] == "COMB.QUANTITY" or prev_token[1] == "AMT" or prev_token[0] in amount_set or prev_token[0].isnumeric()):
-                    combine_tok_with_prev(new_entry, token, new_ent="AMT")
+        elif token.text == "date_day":
+            new_entry.append(("", "DATE.DAY", "DATE_APP_NEXT"))
 
-                elif token.text.lower() in amount_set and "VB" in token.tag_:
-                    new_entry.append(("1 " + token.text, "AMT", "CARDINAL"))
+        elif token.text == "end_date":
+            pass
 
-                # Check for 1 ⅔ style mixed numbers, combine them if found
-                # The regex makes extra super sure we don't have a price when we do this
-                elif prev_token is not None and token.text.isnumeric() and prev_token[0].isnumeric() and prev_token[2] not in ["DATE_REGEX"] and search(r"(?<!/|\d)\d+\s[\u00BC-\u00BE\u2150-\u215E]", " ".join((prev_token[0], token.text))):
-                    combine_tok_with_prev(new_entry, token)
-                
-                # Attempt to combine similar tokens into 1 token for easier parsing
-                elif prev_token is not None and token.ent_type_ != "" and new_entry and token.ent_type_ == prev_token[1] and token.tag_ == prev_token[2]:
-                    # Only combine cardinals if they are prices
-                    if token.ent_type_ == "CARDINAL":
-                        if entry[-1] == token:
-                            # Is probably a price
-                            combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
-                        elif token.ent_type_ == "CARDINAL" and match(price_regex, token.text):
-                            # Is probably a price
-                            new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
-                        else:
-                            new_entry.append((token.text, token.ent_type_, token.tag_))
-                    # Label Liber things as LIBER when combining
-                    elif prev_token[0] == "Liber" and token.text in "ABCDEFGabcdefg":
-                        combine_tok_with_prev(new_entry, token, new_ent="LIBER")
-                    # Combine normally
-                    else:
-                        combine_tok_with_prev(new_entry, token)
-                
-                # Apply the special markings to tobacco marks and multiline tobacco entires, markings were setup in the previous token.
-                elif prev_token is not None and prev_token[2] in {"TMs", "MLTBE"} and prev_token[0] == "":
-                    combine_tok_with_prev(new_entry, token, space=False)
-
-                # Combine Quantities into 1 larger Quantity Token
-                elif prev_token is not None and token.ent_type_ == "QUANTITY" and prev_token[1] == "QUANTITY":
-                    token = (token.text, token.ent_type_, token.tag_)
-                    while (prev_token is not None) and ("QUANTITY" in prev_token[1] or prev_token[2] == "CD" or prev_token[2] == "DT") and "PRICE" not in prev_token[1]:
-                        token = combine_tok_with_prev(new_entry, token, new_ent="COMB.QUANTITY", new_pos="CD", toret=True)
-                        if new_entry:
-                            prev_token = new_entry[-1]
-                        else:
-                            prev_token = None
-                    new_entry.append(token)
-                
-                # Combine Dates into 1 larger date unless the date is probably a price misclassified as a date
-                elif prev_token is not None and token.ent_type_ == "DATE" and prev_token[1] == "DATE" and "NN" in prev_token[2] and not isProbablyPrice(token):
-                    combine_tok_with_prev(new_entry, token)
-                
-                # Combine Liber followed by A/B/C/D/etc.
-                elif prev_token is not None and prev_token[0] == "Liber" and token.text in "ABCDEFGabcdefg":
-                    combine_tok_with_prev(new_entry, token, new_ent="LIBER")
+        # Make sure sundries are not marked as people
+        elif token.text.lower() in {"sundries", "sundrys", "sundry"}:
+            new_entry.append((token.text, "", "NN"))
 
-                # If we see money, combine it with any previous prices
-                elif prev_token is not None and prev_token[1] == "PRICE" and token.ent_type_ == "MONEY":
-                    combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
+        # Handle special markers from tobacco marks, applying these ent_type and tag to the token following them
+        elif token.text == "tobacco_mark_number":
+            new_entry.append(("", "TM#", "TMs"))
 
-                # Combine nouns into larger nouns
-                elif prev_token is not None and isNoun(token) and isNoun(prev_token):
-                    # Don't do it if it is a verb gerund as that probably will be the start of a phrase describing the item, and not the item itself
-                    if token.tag_ == "VBG" and "NN" in prev_token[2]:
-                        new_entry.append((token.text, "NOUN.PHRASE", "IN"))
-                    else:
-                        combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token.tag_)
-                
-                # If we see 10/ in the last token and : in this token, combine into a single price token of 10/:
-                elif token.text == ":" and prev_token[0].endswith("/"):
-                    combine_tok_with_prev(new_entry, token, space=False, new_ent="PRICE")
-                
-                # If there are a bunch of cardinal numbers at the end, combine them into 1 price
-                elif prev_token is not None and entry[-1] == token and prev_token[2] == "CD" and token.tag_ == "CD" and not prev_token[0].isalpha():
-                    combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
-                
-                # Combine [adj]+[noun] (+ is regex greedy +) into 1 big noun token
-                elif prev_token is not None and isNoun(token) and "JJ" in prev_token[2]:
-                    token = (token.text, token.ent_type_, token.tag_)
-                    while prev_token is not None and isNoun(token) and prev_token[2] == "JJ":
-                        token = combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token[2], toret=True)
-                        if new_entry:
-                            prev_token = new_entry[-1]
-                        else:
-                            prev_token = None
-                    new_entry.append(token)
-
-                # Combine adverbs and verb participles
-                elif prev_token is not None and prev_token[2] in ["VBN", "VBG"] and "RB" in token.tag_:
-                    combine_tok_with_prev(new_entry, token)
+        elif token.text == "tobacco_mark_text":
+            new_entry.append(("", "TM.TEXT", "TMs"))
 
-                # Label Cash transactions as CASH
-                elif token.text == "Cash":
-                    new_entry.append((token.text, "CASH", token.tag_))
-                
-                # If we see coordinating conjunctions, attempt to combine the things they conjoin into 1 token, only do it if we find 2 nouns on either side of the CC
-                elif prev_token is not None and prev_token[2] == "CC" and isNoun(token):
-                    combine_tok_with_prev(new_entry, token, new_pos=token.tag_)
-                elif prev_token is not None and isNoun(prev_token) and token.tag_ == "CC" and next_token is not None and isNoun(next_token):
-                    # Only mark as COMB.NOUN if it is not an important entity (e.g. person)
-                    if prev_token[1] == "":
-                        combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token.tag_)
-                    else:
-                        combine_tok_with_prev(new_entry, token, new_pos=token.tag_)
-                
-                # If the coordinating conjunction cannot find nouns on either side of it, mark as CC.DENIED so we don't try and combine it later
-                elif token.tag_ == "CC":
-                    # If there is what appears to be a price following the CC, allow certain entries to use that as extra money added on later
-                    if next_token is not None and match(r"((\d+[Lsdp])|((\:|(\d+))\/)?(\:|(\d+))\/(\:|(\d+))?)", next_token.text):
-                        new_entry.append((token.text, "CC.TOB", "CC.DENIED"))
-                    else:
-                        new_entry.append((token.text, "CC", "CC.DENIED"))
-                
-                # If a cardinal number is probably a price but is not at the end, mark as price
-                elif token.ent_type_ == "CARDINAL" and match(price_regex, token.text):
-                    new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
-                
-                # Label Money ent type as price
-                elif token.ent_type_ == "MONEY":
-                    new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
+        # Handle special markers from multiline tobacco entries, applying these ent_type and tag to the token following them
+        elif token.text == "tobacco_note":
+            new_entry.append(("", "TB_N", "MLTBE"))
 
-                # If we have a cardinal number that appears to be a price, mark it as such.
-                elif prev_token is not None and prev_token[0] != "at" and token.tag_ == "CD" and match(price_regex, token.text):
-                    new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
+        elif token.text == "total_weight":
+            new_entry.append(("", "TB_GW", "MLTBE"))
+
+        elif token.text == "tare_weight":
+            new_entry.append(("", "TB_TW", "MLTBE"))
+
+        elif token.text == "tobacco_weight":
+            new_entry.append(("", "TB_W", "MLTBE"))
+
+        # In case we can't find the tobacco totaling line, mark this entry to be combined with the next entry later.
+        elif token.text == "no_final_tobacco":
+            new_entry.append(("", "TB_NF", "MLTBE"))
+
+        elif token.text == "final_weight":
+            new_entry.append(("", "TB_FW", "MLTBE"))
+
+        elif token.text == "unit_price":
+            new_entry.append(("", "TB_UP", "MLTBE"))
+
+        elif token.text == "tobacco_location":
+            new_entry.append(("", "TB_LOC", "MLTBE"))
 
-                # Otherwise just add token to stack
+        # Handle random tobacco notes like N 15  39
+        elif token.text == "N" and next_token is not None and next_token.text.isnumeric():
+            new_entry.append(("", "TB_NOTE", "SLTBE"))
+
+        elif prev_token is not None and prev_token[2] == "SLTBE":
+            if prev_token[0] == "":
+                combine_tok_with_prev(new_entry, token, space=False)
+            elif prev_token[0].lower() == "for":
+                # Ignore the word for in these
+                pass
+            else:
+                if next_token is not None and next_token.text in ["pound", "pounds"]:
+                    combine_tok_with_prev(new_entry, token)
+                else:
+                    # print(next_token.text, new_entry[-1][0])
+                    combine_tok_with_prev(new_entry, token, new_pos="SLTBE_F")
+                    # print(next_token.text, new_entry[-1][0])
+
+        # When the previous token was a date marker, remember what follows it as part of a date
+        elif prev_token is not None and prev_token[2] == "DATE_APP_NEXT":
+            combine_tok_with_prev(new_entry, token, space=False, new_pos="DATE_REGEX")
+
+        # If token pos tells us specifically to append the next thing we see
+        elif prev_token is not None and prev_token[2].endswith("_APP_NEXT"):
+            combine_tok_with_prev(new_entry, token, space=False, new_pos=prev_token[2].removesuffix("_APP_NEXT")) 
+
+        # If we find a cardinal in the item set, it is probably not a cardinal.
+        elif token.tag_ == "CD" and token.text.lower() in item_set:
+            new_entry.append((token.text, "", "NN"))
+
+        # Label tokens indicating record type as TRANS
+        elif token.text == "By" or token.text == "To":
+            new_entry.append((token.text, "TRANS", token.tag_))
+
+        # Label end of list tokens as ENDER
+        elif token.text == "Total" or token.text == "Subtotal":
+            new_entry.append((token.text, "ENDER", token.tag_))
+
+        # Label prices as PRICE
+        elif isProbablyPrice(token):
+            new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
+
+        # If we find something in the amount word index, combine it with the previous token and mark as amt unless there are no numbers to combine it with
+        elif prev_token is not None and token.text.lower() in amount_set and prev_token[2] not in ["DATE_REGEX"] and (prev_token[2] in {"DT", "CD"} or prev_token[1] == "CARDINAL" or prev_token[1] == "QUANTITY" or prev_token[1] == "COMB.QUANTITY" or prev_token[1] == "AMT" or prev_token[0] in amount_set or prev_token[0].isnumeric()):
+            combine_tok_with_prev(new_entry, token, new_ent="AMT")
+
+        elif token.text.lower() in amount_set and "VB" in token.tag_:
+            new_entry.append(("1 " + token.text, "AMT", "CARDINAL"))
+
+        # Check for 1 ⅔ style mixed numbers, combine them if found
+        # The regex makes extra super sure we don't have a price when we do this
+        elif prev_token is not None and token.text.isnumeric() and prev_token[0].isnumeric() and prev_token[2] not in ["DATE_REGEX"] and _number_frac_pattern.search(" ".join((prev_token[0], token.text))):
+            combine_tok_with_prev(new_entry, token)
+
+        # Attempt to combine similar tokens into 1 token for easier parsing
+        elif prev_token is not None and token.ent_type_ != "" and new_entry and token.ent_type_ == prev_token[1] and token.tag_ == prev_token[2]:
+            # Only combine cardinals if they are prices
+            if token.ent_type_ == "CARDINAL":
+                if entry[-1] == token:
+                    # Is probably a price
+                    combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
+                elif token.ent_type_ == "CARDINAL" and _price_pattern.match(token.text):
+                    # Is probably a price
+                    new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
                 else:
                     new_entry.append((token.text, token.ent_type_, token.tag_))
-            
-            def stack_append(stack: list, token, info=None, tag=None):
-                if info is None:
-                    info = token[1]
-                if tag is None:
-                    tag = token[2]
-                stack.append((token[0], info, tag))
-
-            # Makes a second pass, checking for issues resulting from token combination
-            token_stack = []
-            for i, token in enumerate(new_entry):
-                prev_token = None
-                next_token = None
-                if token_stack:
-                    prev_token = token_stack[-1]
-                if i + 1 < len(new_entry):
-                    next_token = new_entry[i + 1]
-                # TODO: Allow for bulk prices and overall prices at once.
-                if token[0].lower() == "at" and next_token[1] in ["PRICE", "COMB.PRICE"]:
-                    stack_append(token_stack, token, "IS.BULK")
+            # Label Liber things as LIBER when combining
+            elif prev_token[0] == "Liber" and token.text in "ABCDEFGabcdefg":
+                combine_tok_with_prev(new_entry, token, new_ent="LIBER")
+            # Combine normally
+            else:
+                combine_tok_with_prev(new_entry, token)
+
+        # Apply the special markings to tobacco marks and multiline tobacco entires, markings were setup in the previous token.
+        elif prev_token is not None and prev_token[2] in {"TMs", "MLTBE"} and prev_token[0] == "":
+            combine_tok_with_prev(new_entry, token, space=False)
+
+        # Combine Quantities into 1 larger Quantity Token
+        elif prev_token is not None and token.ent_type_ == "QUANTITY" and prev_token[1] == "QUANTITY":
+            token = (token.text, token.ent_type_, token.tag_)
+            while (prev_token is not None) and ("QUANTITY" in prev_token[1] or prev_token[2] == "CD" or prev_token[2] == "DT") and "PRICE" not in prev_token[1]:
+                token = combine_tok_with_prev(new_entry, token, new_ent="COMB.QUANTITY", new_pos="CD", toret=True)
+                if new_entry:
+                    prev_token = new_entry[-1]
                 else:
-                    stack_append(token_stack, token)
+                    prev_token = None
+            new_entry.append(token)
+
+        # Combine Dates into 1 larger date unless the date is probably a price misclassified as a date
+        elif prev_token is not None and token.ent_type_ == "DATE" and prev_token[1] == "DATE" and "NN" in prev_token[2] and not isProbablyPrice(token):
+            combine_tok_with_prev(new_entry, token)
+
+        # Combine Liber followed by A/B/C/D/etc.
+        elif prev_token is not None and prev_token[0] == "Liber" and token.text in "ABCDEFGabcdefg":
+            combine_tok_with_prev(new_entry, token, new_ent="LIBER")
+
+        # If we see money, combine it with any previous prices
+        elif prev_token is not None and prev_token[1] == "PRICE" and token.ent_type_ == "MONEY":
+            combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
+
+        # Combine nouns into larger nouns
+        elif prev_token is not None and isNoun(token) and isNoun(prev_token):
+            # Don't do it if it is a verb gerund as that probably will be the start of a phrase describing the item, and not the item itself
+            if token.tag_ == "VBG" and "NN" in prev_token[2]:
+                new_entry.append((token.text, "NOUN.PHRASE", "IN"))
+            else:
+                combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token.tag_)
 
-            # If we detect weird characters (e.g. *), stop processing the row
-            parsed_entries_in_row.append(token_stack)
-            if any((x[2] == "XX" for x in token_stack)):
-                break
-        
-        # If there is weird stuff, we know we probably have a bad entry and we will pass it through as such.
-        if any([x[2] == "XX" for x in chain(*parsed_entries_in_row)]):
-            # print(f"Error, Bad entry: {big_entry}")
-            # print(parsed_entries_in_row)
-            if parsed_entries_in_row:
-                parsed_entries_in_row[0] = "BAD_ENTRY"
-                parsed_entries_in_row.append(big_entry)
+        # If we see 10/ in the last token and : in this token, combine into a single price token of 10/:
+        elif token.text == ":" and prev_token[0].endswith("/"):
+            combine_tok_with_prev(new_entry, token, space=False, new_ent="PRICE")
+
+        # If there are a bunch of cardinal numbers at the end, combine them into 1 price
+        elif prev_token is not None and entry[-1] == token and prev_token[2] == "CD" and token.tag_ == "CD" and not prev_token[0].isalpha():
+            combine_tok_with_prev(new_entry, token, new_ent="COMB.PRICE")
+
+        # Combine [adj]+[noun] (+ is regex greedy +) into 1 big noun token
+        elif prev_token is not None and isNoun(token) and "JJ" in prev_token[2]:
+            token = (token.text, token.ent_type_, token.tag_)
+            while prev_token is not None and isNoun(token) and prev_token[2] == "JJ":
+                token = combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token[2], toret=True)
+                if new_entry:
+                    prev_token = new_entry[-1]
+                else:
+                    prev_token = None
+            new_entry.append(token)
+
+        # Combine adverbs and verb participles
+        elif prev_token is not None and prev_token[2] in ["VBN", "VBG"] and "RB" in token.tag_:
+            combine_tok_with_prev(new_entry, token)
+
+        # Label Cash transactions as CASH
+        elif token.text == "Cash":
+            new_entry.append((token.text, "CASH", token.tag_))
+
+        # If we see coordinating conjunctions, attempt to combine the things they conjoin into 1 token, only do it if we find 2 nouns on either side of the CC
+        elif prev_token is not None and prev_token[2] == "CC" and isNoun(token):
+            combine_tok_with_prev(new_entry, token, new_pos=token.tag_)
+        elif prev_token is not None and isNoun(prev_token) and token.tag_ == "CC" and next_token is not None and isNoun(next_token):
+            # Only mark as COMB.NOUN if it is not an important entity (e.g. person)
+            if prev_token[1] == "":
+                combine_tok_with_prev(new_entry, token, new_ent="COMB.NOUN", new_pos=token.tag_)
+            else:
+                combine_tok_with_prev(new_entry, token, new_pos=token.tag_)
+
+        # If the coordinating conjunction cannot find nouns on either side of it, mark as CC.DENIED so we don't try and combine it later
+        elif token.tag_ == "CC":
+            # If there is what appears to be a price following the CC, allow certain entries to use that as extra money added on later
+            if next_token is not None and _next_price_pattern.match(next_token.text):
+                new_entry.append((token.text, "CC.TOB", "CC.DENIED"))
             else:
-                parsed_entries_in_row.append("BAD_ENTRY")
-                parsed_entries_in_row.append(big_entry)
-            yield (parsed_entries_in_row, row)
+                new_entry.append((token.text, "CC", "CC.DENIED"))
+
+        # If a cardinal number is probably a price but is not at the end, mark as price
+        elif token.ent_type_ == "CARDINAL" and _price_pattern.match(token.text):
+            new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
+
+        # Label Money ent type as price
+        elif token.ent_type_ == "MONEY":
+            new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
 
+        # If we have a cardinal number that appears to be a price, mark it as such.
+        elif prev_token is not None and prev_token[0] != "at" and token.tag_ == "CD" and _price_pattern.match(token.text):
+            new_entry.append((token.text, "PRICE", _remove_xx(token.tag_, "CD")))
+
+        # Otherwise just add token to stack
+        else:
+            new_entry.append((token.text, token.ent_type_, token.tag_))
+
+    def stack_append(stack: TokenStream, token, info=None, tag=None):
+        if info is None:
+            info = token[1]
+        if tag is None:
+            tag = token[2]
+        stack.append((token[0], info, tag))
+
+    # Makes a second pass, checking for issues resulting from token combination
+    token_stack = TokenStream()
+    for i, token in enumerate(new_entry):
+        prev_token = None
+        next_token = None
+        if token_stack:
+            prev_token = token_stack[-1]
+        if i + 1 < len(new_entry):
+            next_token = new_entry[i + 1]
+        # TODO: Allow for bulk prices and overall prices at once.
+        if token[0].lower() == "at" and next_token[1] in ["PRICE", "COMB.PRICE"]:
+            stack_append(token_stack, token, "IS.BULK")
+        else:
+            stack_append(token_stack, token)
+
+    return token_stack
+
+# Runs the combination pass on every annotated smaller entry of a row and packages the results the way get_transactions expects
+def _finish_row(big_entry: str, docs: list, names: set):
+    parsed_entries_in_row = []
+    # For entry in row
+    for entry in docs:
+        token_stack = _combine_tokens(entry, names)
+
+        # If we detect weird characters (e.g. *), stop processing the row
+        parsed_entries_in_row.append(token_stack)
+        if token_stack.has_tag("XX"):
+            break
+    
+    # If there is weird stuff, we know we probably have a bad entry and we will pass it through as such.
+    if any(x.has_tag("XX") for x in parsed_entries_in_row):
+        # print(f"Error, Bad entry: {big_entry}")
+        # print(parsed_entries_in_row)
+        if parsed_entries_in_row:
+            parsed_entries_in_row[0] = "BAD_ENTRY"
+            parsed_entries_in_row.append(big_entry)
         else:
-            yield (parsed_entries_in_row, row)    
\ No newline at end of file
+            parsed_entries_in_row.append("BAD_ENTRY")
+            parsed_entries_in_row.append(big_entry)
+
+    return parsed_entries_in_row
+
+# Tags every smaller entry in fragments, with the rule based tagger if config.fast_path is on and it can, otherwise with spacy
+# Returns a list with the tokens (AnnotatedTokens) of every fragment
+def _annotate(fragments: list, config: ParserConfig) -> list:
+    if not config.fast_path:
+        return _annotate_with_spacy(fragments, config)
+
+    tokenizer = get_pipeline(config.profile).tokenizer
+    annotated = [tag_formulaic(fragment, tokenizer) for fragment in fragments]
+    remaining = [i for i, tokens in enumerate(annotated) if tokens is None]
+    for i, tokens in zip(remaining, _annotate_with_spacy([fragments[i] for i in remaining], config)):
+        annotated[i] = tokens
+    return annotated
+
+# Tags every smaller entry in fragments with spacy, skipping anything already in the annotation cache
+def _annotate_with_spacy(fragments: list, config: ParserConfig) -> list:
+    nlp = get_pipeline(config.profile)
+    if not config.annotation_cache:
+        return [deserialize_tokens(serialize_doc(doc)) for doc in nlp.pipe(fragments, batch_size=config.batch_size)]
+
+    cache = get_annotation_cache(config.annotation_cache, config.annotation_cache_size)
+    # Profiles that share a model can still tag differently, so the profile is part of the key
+    model_name = f"{get_profile_model(config.profile)}/{config.profile}"
+    keys = [make_key(fragment, model_name, nlp.meta.get("version", ""), PREPROCESSOR_VERSION) for fragment in fragments]
+    annotations = cache.get_many(keys)
+
+    # Only run spacy once per distinct fragment we haven't seen before
+    missing = {}
+    for key, fragment in zip(keys, fragments):
+        if key not in annotations and key not in missing:
+            missing[key] = fragment
+    new_annotations = {key: serialize_doc(doc) for key, doc in zip(missing.keys(), nlp.pipe(missing.values(), batch_size=config.batch_size))}
+    cache.put_many(new_annotations)
+    annotations.update(new_annotations)
+
+    # Every fragment gets its own tokens as the combination pass edits them
+    return [deserialize_tokens(annotations[key]) for key in keys]
+
+# Reads rows until we have at least lookahead smaller entries waiting to be annotated (or we run out of rows)
+# Returns a list of (row, prepared) where prepared is the output of _prepare_row
+def _read_window(rows, lookahead: int):
+    window = []
+    n_fragments = 0
+    for key, row in rows:
+        with stage("rewrites"):
+            prepared = _prepare_row(row)
+        window.append((row, prepared))
+        if prepared is not None:
+            n_fragments += len(prepared[1])
+        if n_fragments >= lookahead:
+            break
+    return window
+
+# Initial processing and labelling of transaction parts e.g. nouns, keywords, etc.
+# Note that this is a generator due to it being slow
+# Goal of this function is to create a list for every row that contains a list of important data from the entry
+# This is done in two steps:
+# First we clean up every row in a window of rows and collect all of their smaller entries, then we tag all of those entries
+# at once with nlp.pipe so spacy (and especially the transformer) can batch them.
+# The token combination pass (see _combine_tokens) then runs on each row right before it is yielded, so the sheet is still
+# streamed through a bounded look-ahead window instead of being annotated all at once.
+# df is either the sheet's DataFrame or a SheetStream reading it row by row (see sheet_stream.py).
+# Proper nouns are added to names (a new NameRegistry if not given), which the caller can check words against as rows come out.
+# If a row_cache (see row_cache.py) is given, only rows it has no output for are preprocessed.
+def preprocess(df, config: ParserConfig = None, names: NameRegistry = None, row_cache = None):
+    logging.info("Preprocessing.")
+    if config is None:
+        config = default_config
+    if names is None:
+        names = NameRegistry()
+    
+    # Fix the marginalia issues present in the underlying spreadsheets
+    # Fix missing dates by imputing with previous data
+    # (a stream reads and fixes rows as they are needed, so both are timed per row)
+    if isinstance(df, SheetStream):
+        rows = timed(fix_marginalia_dates_stream(timed(df, "read"), df.columns), "fix_marginalia_dates")
+    else:
+        with stage("fix_marginalia_dates"):
+            fix_marginalia_dates(df)
+        rows = timed(frame_rows(df), "read")
+
+    if config.annotation_cache:
+        cache = get_annotation_cache(config.annotation_cache, config.annotation_cache_size)
+        hits, misses = cache.hits, cache.misses
+
+    if row_cache is not None:
+        results = _preprocess_incremental(rows, config, row_cache)
+    elif config.workers > 1:
+        results = _preprocess_parallel(rows, config)
+    else:
+        results = _preprocess_sequential(rows, config)
+
+    # Names found in a row are only added to names right before the row is yielded, so however the rows were preprocessed
+    # get_transactions sees the names in the same order.
+    for row, result in results:
+        count("rows")
+        if result is None:
+            continue
+        parsed_entries_in_row, row_names = result
+        # (bad entries hold strings along with their token stacks)
+        token_stacks = [x for x in parsed_entries_in_row if isinstance(x, TokenStream)]
+        count("fragments", len(token_stacks))
+        count("tokens", sum(len(x) for x in token_stacks))
+        names.update(row_names)
+        yield (parsed_entries_in_row, row)
+
+    # Worker processes keep their own counters, so this only covers annotation done in this process
+    if config.annotation_cache:
+        cache_stats = cache.stats()
+        logging.info(f"Annotation cache: {cache_stats['hits'] - hits} hits, {cache_stats['misses'] - misses} misses, {cache_stats['entries']} entries")
+
+# Does the preprocessing of rows (an iterator of (key, row)) in this process, see preprocess.
+# Yields (row, result) for every row, where result is either (parsed_entries_in_row, names found in the row) or None if the row is skipped.
+def _preprocess_sequential(rows, config: ParserConfig):
+    while (window := _read_window(rows, config.lookahead)):
+        # Annotate every smaller entry in the window in one go
+        fragments = list(chain(*[prepared[1] for row, prepared in window if prepared is not None]))
+        with stage("annotate"):
+            docs = iter(_annotate(fragments, config))
+
+        for row, prepared in window:
+            if prepared is None:
+                yield (row, None)
+                continue
+            big_entry, smaller_entries = prepared
+            names = set()
+            row_docs = [next(docs) for x in smaller_entries]
+            with stage("combine"):
+                result = (_finish_row(big_entry, row_docs, names), names)
+            yield (row, result)
+
+# Process pools for parallel preprocessing (and parallel parse_folder), keyed by (number of workers, profile).
+# They are kept around between files so every worker only loads its model once.
+_pools = {}
+_pools_lock = Lock()
+
+# Loads the profile's model as soon as a worker process starts
+def _warm_worker(profile: str):
+    get_pipeline(profile)
+
+def get_worker_pool(workers: int, profile: str) -> ProcessPoolExecutor:
+    with _pools_lock:
+        # A pool one of whose workers died can't run anything any more, start a new one
+        if (workers, profile) not in _pools or getattr(_pools[(workers, profile)], "_broken", False):
+            # Use spawn, forking a process that may have torch loaded (or the people updating threads running) is asking for trouble
+            _pools[(workers, profile)] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm_worker, initargs=(profile,))
+        return _pools[(workers, profile)]
+
+# Runs in a worker process, does all of the preprocessing for a chunk of rows.
+# Returns a list with, for every row, either (parsed_entries_in_row, names found in the row) or None if the row is skipped.
+def _preprocess_chunk(rows: list, config: ParserConfig):
+    prepared_rows = [_prepare_row(row) for row in rows]
+    fragments = list(chain(*[prepared[1] for prepared in prepared_rows if prepared is not None]))
+    docs = iter(_annotate(fragments, config))
+
+    out = []
+    for prepared in prepared_rows:
+        if prepared is None:
+            out.append(None)
+            continue
+        big_entry, smaller_entries = prepared
+        names = set()
+        row_docs = [next(docs) for x in smaller_entries]
+        out.append((_finish_row(big_entry, row_docs, names), names))
+    return out
+
+# Same as _preprocess_sequential, except rows are sent in chunks to a pool of config.workers processes.
+# Results are yielded in the original row order, so get_transactions sees exactly what it would see with the sequential version.
+def _preprocess_parallel(rows, config: ParserConfig):
+    pool = get_worker_pool(config.workers, config.profile)
+    in_flight = deque()
+
+    # Sends the next chunk of rows off to the pool, returns False when there are no rows left
+    def submit_chunk():
+        chunk = list(islice(rows, config.worker_chunk_rows))
+        if not chunk:
+            return False
+        in_flight.append((chunk, pool.submit(_preprocess_chunk, [row for key, row in chunk], config)))
+        return True
+
+    # Keep every worker busy without reading the whole sheet ahead
+    for i in range(2 * config.workers):
+        if not submit_chunk():
+            break
+    
+    while in_flight:
+        chunk, future = in_flight.popleft()
+        # Everything the workers do is timed as waiting for them
+        with stage("preprocess workers"):
+            results = future.result()
+        submit_chunk()
+        for (key, row), result in zip(chunk, results):
+            yield (row, result)
+
+# Same as _preprocess_sequential (or _preprocess_parallel), except rows row_cache already has output for aren't preprocessed again.
+# The rows are all read up front to find the ones that changed, so a SheetStream is no longer streamed.
+def _preprocess_incremental(rows, config: ParserConfig, row_cache):
+    rows = list(rows)
+    with stage("row cache"):
+        rows = [(key, row, row_cache.fingerprint(row)) for key, row in rows]
+        cached = [row_cache.get(fingerprint) for key, row, fingerprint in rows]
+    count("rows reused", row_cache.hits)
+    changed = iter([(key, row) for (key, row, fingerprint), result in zip(rows, cached) if result is row_cache.missing])
+    if config.workers > 1:
+        results = _preprocess_parallel(changed, config)
+    else:
+        results = _preprocess_sequential(changed, config)
+
+    for (key, row, fingerprint), result in zip(rows, cached):
+        if result is row_cache.missing:
+            row, result = next(results)
+            with stage("row cache"):
+                row_cache.put(fingerprint, result)
+        yield (row, result)
+    with stage("row cache"):
+        row_cache.save()
@@ -0,0 +1,145 @@
+from hashlib import sha256
+from json import dump, load
+from os import listdir, makedirs, remove, replace, utime
+from os.path import dirname, exists, getmtime, getsize, isdir, join
+from shutil import copyfile
+from threading import Lock
+from time import time
+import logging
+from spacy.util import get_package_version
+from .pipelines import get_profile_model
+from .people import people_index_version
+
+# In this file: Remembers the output of whole sheets, so a workbook that is uploaded again unchanged (or parsed again after
+# a run failed for some other reason) is copied from the last time it was parsed instead of parsed again. See
+# ParserConfig.result_cache.
+# A sheet's output is looked up by a key made of the sha256 of the workbook's bytes and everything else the output depends on:
+# the parser's own code and index files, the model and profile that tag the entries, the backsolving time budget, the
+# version of the people index and, when streaming, how far the stream reads ahead.
+# Outputs where backsolving ran out of time aren't stored at all, since on a busy machine that can happen to any sheet.
+# Entries are the output file exactly as it was written (in whatever format, see transaction.py) plus the sheet's stats, kept
+# in cache/results under the parser's dump folder, a subfolder so upload_results leaves it alone.
+# The stats copied back with an output say "cached": true, since their timings are those of the parse that made it, not of now.
+# Entries not used for max_days are evicted, and then the least recently used ones until the cache is under max_bytes.
+# ParserConfig.force_reparse parses every sheet again (and stores the new output) without looking at the cache.
+
+default_result_cache_path = join(dirname(__file__), "ParseMe", "cache", "results")
+
+# Bump this whenever the way outputs are stored changes, so old entries are never used
+RESULT_CACHE_VERSION = 1
+
+_code_version = None
+_code_version_lock = Lock()
+
+# Returns a hash of the parser's source and index files, so changing any of them makes every stored output stale
+def parser_code_version() -> str:
+    global _code_version
+    with _code_version_lock:
+        if _code_version is None:
+            digest = sha256()
+            folder = dirname(__file__)
+            for name in sorted(listdir(folder)):
+                if name.endswith(".py") or name.endswith(".json"):
+                    with open(join(folder, name), "rb") as file:
+                        digest.update(name.encode("UTF-8") + b"\0" + file.read() + b"\0")
+            _code_version = digest.hexdigest()
+        return _code_version
+
+# Returns the sha256 of the file at filePath
+def file_digest(filePath) -> str:
+    digest = sha256()
+    with open(filePath, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, path: str = default_result_cache_path, max_bytes: int = 2 * 2 ** 30, max_days: float = 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        makedirs(path, exist_ok=True)
+
+    # Returns the key of the output of the sheet at filePath parsed with config
+    def key(self, filePath, config) -> str:
+        model = get_profile_model(config.profile)
+        try:
+            model_version = get_package_version(model)
+        except Exception:
+            model_version = None
+        parts = [RESULT_CACHE_VERSION, file_digest(filePath), parser_code_version(), model, model_version, config.profile,
+                 config.fast_path, config.backsolve_seconds, people_index_version()]
+        # A stream can type columns differently from a DataFrame, see sheet_stream.py
+        if config.streaming:
+            parts += ["streaming", config.stream_lookahead]
+        return sha256("\x1f".join(str(x) for x in parts).encode("UTF-8")).hexdigest()
+
+    # Path of an entry, extension is that of the output file (e.g. .jsonl.gz) so outputs in different formats are kept apart
+    def _entry(self, key: str, extension: str) -> str:
+        return join(self.path, key + extension)
+
+    # Copies the stored output for key to output (and its stats to stats, if both exist, marked as cached). Returns False if there is none.
+    def get(self, key: str, extension: str, output: str, stats: str = None) -> bool:
+        entry = self._entry(key, extension)
+        try:
+            copyfile(entry, output)
+        except FileNotFoundError:
+            return False
+        # Mark the entry as recently used
+        utime(entry)
+        if stats is not None and exists(entry + ".stats"):
+            makedirs(dirname(stats), exist_ok=True)
+            with open(entry + ".stats") as file:
+                summary = load(file)
+            summary["cached"] = True
+            with open(stats, "w") as file:
+                dump(summary, file, indent=1)
+        return True
+
+    # Stores output (and stats, if it exists) as the output for key, then evicts whatever has to go
+    def put(self, key: str, extension: str, output: str, stats: str = None):
+        entry = self._entry(key, extension)
+        # Copied under a temporary name first, so nothing ever reads half an entry
+        if stats is not None and exists(stats):
+            copyfile(stats, entry + ".stats.tmp")
+            replace(entry + ".stats.tmp", entry + ".stats")
+        copyfile(output, entry + ".tmp")
+        replace(entry + ".tmp", entry)
+        self.evict()
+
+    # Removes entries not used for max_days, then the least recently used ones until the cache is under max_bytes
+    def evict(self):
+        entries = []
+        for name in listdir(self.path):
+            if name.endswith(".tmp") or name.endswith(".stats") or isdir(join(self.path, name)):
+                continue
+            entry = join(self.path, name)
+            try:
+                size = getsize(entry) + (getsize(entry + ".stats") if exists(entry + ".stats") else 0)
+                entries.append((getmtime(entry), size, entry))
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                continue
+
+        entries.sort()
+        total = sum(x[1] for x in entries)
+        oldest = time() - self.max_days * 24 * 60 * 60
+        evicted = 0
+        for used, size, entry in entries:
+            if used >= oldest and total <= self.max_bytes:
+                break
+            for name in (entry, entry + ".stats"):
+                try:
+                    remove(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            evicted += 1
+        if evicted:
+            logging.info(f"Evicted {evicted} parse results from {self.path}")
+
+# Returns the result cache config asks for, None if it is turned off
+def open_result_cache(config):
+    if config.result_cache is None:
+        return None
+    return ResultCache(config.result_cache, config.result_cache_bytes, config.result_cache_days)
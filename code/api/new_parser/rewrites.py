@@ -0,0 +1,152 @@
+import re
+from threading import Lock
+from time import perf_counter
+
+# In this file: Precompiled regex rewrites for the preprocessor, with counters of how often each one runs, matches and how long it takes.
+# A Rewrite is a single compiled pattern (with its replacement if it is used with sub).
+# A RewriteScanner applies a list of Rewrites in one left to right scan of the text instead of one re.sub pass each.
+# It gives the same result as running them one after the other as long as no replacement produces text that a later rewrite matches,
+# which has to be true of the rewrites it is given. Where two of them match overlapping text, the scanner falls back to running them
+# one after the other, so whichever came first in the list still wins exactly like it used to.
+# Most entries contain none of the things a rewrite is looking for, so a rewrite can also be given the literal strings it can't match
+# without (at least one of which has to be in the text), letting us skip the regex entirely with a few substring checks.
+
+# name: {"calls": number of times the pattern was run, "matches": number of matches, "seconds": time spent}
+_stats = {}
+_stats_lock = Lock()
+
+def _record(name: str, calls: int, matches: int, seconds: float):
+    with _stats_lock:
+        stats = _stats.setdefault(name, {"calls": 0, "matches": 0, "seconds": 0.0})
+        stats["calls"] += calls
+        stats["matches"] += matches
+        stats["seconds"] += seconds
+
+# Returns a copy of the counters of every rewrite (and scanner) that has run in this process
+def get_rewrite_stats() -> dict:
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+def reset_rewrite_stats():
+    with _stats_lock:
+        _stats.clear()
+
+class Rewrite:
+    def __init__(self, name: str, pattern: str, repl=None, requires: tuple = None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        # Either a string template or a function taking the match, just like re.sub
+        self.repl = repl
+        # Every match contains at least one of these, None if we can't say
+        self.requires = requires
+
+    # False if the pattern can't possibly match text
+    def could_match(self, text: str) -> bool:
+        return self.requires is None or any(x in text for x in self.requires)
+
+    # Replacement text for a single match of this pattern
+    def expand(self, m: re.Match) -> str:
+        if callable(self.repl):
+            return self.repl(m)
+        return m.expand(self.repl)
+
+    def sub(self, text: str) -> str:
+        start = perf_counter()
+        n = 0
+        if self.could_match(text):
+            text, n = self.pattern.subn(self.repl, text)
+        _record(self.name, 1, n, perf_counter() - start)
+        return text
+
+    def finditer(self, text: str) -> list:
+        start = perf_counter()
+        matches = list(self.pattern.finditer(text)) if self.could_match(text) else []
+        _record(self.name, 1, len(matches), perf_counter() - start)
+        return matches
+
+    def search(self, text: str):
+        start = perf_counter()
+        m = self.pattern.search(text) if self.could_match(text) else None
+        _record(self.name, 1, m is not None, perf_counter() - start)
+        return m
+
+    def __repr__(self) -> str:
+        return f"Rewrite({self.name!r}, {self.pattern.pattern!r})"
+
+class RewriteScanner:
+    def __init__(self, name: str, rewrites: list):
+        self.name = name
+        self.rewrites = rewrites
+        # Combined patterns for every set of rewrites that could match some text, compiled the first time we need them
+        self._combined = {}
+        self._combined_lock = Lock()
+
+    # One pattern matching any of the given rewrites (by index), tried in order at every position.
+    # Every rewrite is wrapped in its own named group so we can tell which one matched.
+    # The wrapping group is always the last one to close, so it is what m.lastgroup names.
+    def _get_combined(self, active: tuple):
+        combined = self._combined.get(active)
+        if combined is None:
+            with self._combined_lock:
+                combined = re.compile("|".join(f"(?P<_r{i}>{self.rewrites[i].pattern.pattern})" for i in active))
+                self._combined[active] = combined
+        return combined
+
+    # Same as calling rewrite.sub for every rewrite in order
+    def sub(self, text: str) -> str:
+        start = perf_counter()
+        active = tuple(i for i, rewrite in enumerate(self.rewrites) if rewrite.could_match(text))
+
+        # Nothing to scan for, or only one thing in which case a plain sub is faster
+        if len(active) <= 1:
+            for i in active:
+                text = self.rewrites[i].sub(text)
+            _record(self.name, 1, 0, perf_counter() - start)
+            return text
+
+        out = []
+        pos = 0
+        matches = [0] * len(self.rewrites)
+        seconds = [0.0] * len(self.rewrites)
+        # Leftmost match of every rewrite at or after some position, only searched for when we need it
+        next_matches = [None] * len(self.rewrites)
+
+        for m in self._get_combined(active).finditer(text):
+            i = int(m.lastgroup[2:])
+
+            # If an earlier rewrite matches starting inside this match, running them in order would have let it go first
+            for j in active:
+                if j >= i:
+                    break
+                if next_matches[j] is None or next_matches[j].start() <= m.start():
+                    next_matches[j] = self.rewrites[j].pattern.search(text, m.start() + 1) or _no_match
+                if next_matches[j].start() < m.end():
+                    _record(self.name + " (fallback)", 1, 0, perf_counter() - start)
+                    return self._sub_in_order(text)
+
+            # Match the rewrite on its own so its replacement sees the group numbers it expects
+            rewrite_start = perf_counter()
+            rewrite = self.rewrites[i]
+            out.append(text[pos:m.start()])
+            out.append(rewrite.expand(rewrite.pattern.match(text, m.start())))
+            pos = m.end()
+            matches[i] += 1
+            seconds[i] += perf_counter() - rewrite_start
+
+        out.append(text[pos:])
+        for i in active:
+            _record(self.rewrites[i].name, 1, matches[i], seconds[i])
+        _record(self.name, 1, sum(matches), perf_counter() - start)
+        return "".join(out)
+
+    def _sub_in_order(self, text: str) -> str:
+        for rewrite in self.rewrites:
+            text = rewrite.sub(text)
+        return text
+
+# Stands in for a match that starts after the end of any text
+class _NoMatch:
+    def start(self):
+        return float("inf")
+
+_no_match = _NoMatch()
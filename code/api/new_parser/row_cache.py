@@ -0,0 +1,105 @@
+from json import dump, load, dumps, loads
+from hashlib import sha256
+from os import makedirs, replace
+from os.path import basename, dirname, exists, join
+import logging
+from spacy.util import get_package_version
+from .parser_utils import get_col
+from .pipelines import get_profile_model
+from .config import ParserConfig
+from .preprocessor import PREPROCESSOR_VERSION
+from .token_stream import TokenStream, plain_tokens
+
+# In this file: Remembers what preprocess produced for every row of a sheet, so re-parsing a corrected sheet only runs
+# preprocess (and spacy) on the rows that actually changed. See ParserConfig.incremental.
+# A row's preprocess output only depends on the cells _prepare_row reads, so those cells are the row's fingerprint.
+# Date and marginalia carry-forward only changes cells get_transactions reads, and get_transactions always runs on every row,
+# so rows that depend on a changed row through carry-forward are handled without re-running preprocess on them.
+# The output for a sheet is kept in rows/<sheet name>.rows next to the sheet, a subfolder so upload_results leaves it alone
+# (and a name without .json in it so nothing mistakes it for parser output).
+
+# Bump this whenever the combination pass changes what preprocess outputs for a row, so old row caches are thrown away
+# (changes to the cleanup before spacy bump PREPROCESSOR_VERSION, which throws them away too)
+ROW_CACHE_VERSION = 1
+
+# Every cell _prepare_row reads
+_fingerprint_columns = ("EntryID", "Entry", "L Sterling", "s Sterling", "d Sterling", "L Currency", "s Currency", "d Currency")
+
+# Returns a fingerprint of everything preprocess reads from row
+def row_fingerprint(row) -> str:
+    cells = []
+    for column in _fingerprint_columns:
+        try:
+            cells.append(repr(get_col(row, column)))
+        except KeyError:
+            cells.append(None)
+    return sha256(dumps(cells).encode("UTF-8")).hexdigest()
+
+# Turns a row result loaded from json back into what preprocess yields
+def _restore(result):
+    if result is None:
+        return None
+    parsed_entries_in_row, names = result
+    return ([TokenStream(x) if isinstance(x, list) else x for x in parsed_entries_in_row], names)
+
+class RowCache:
+    # Returned by get for rows we have no output for
+    missing = object()
+
+    def __init__(self, path: str, signature: list):
+        self.path = path
+        self.signature = signature
+        self.hits = 0
+        self.misses = 0
+        self._old = {}
+        self._new = {}
+        if exists(path):
+            try:
+                with open(path) as file:
+                    data = load(file)
+                if data["signature"] == signature:
+                    self._old = data["rows"]
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable row cache {path}: {e}")
+
+    def fingerprint(self, row) -> str:
+        return row_fingerprint(row)
+
+    # Returns the output preprocess gave last time for a row with this fingerprint, or RowCache.missing
+    def get(self, fingerprint: str):
+        if fingerprint in self._new:
+            self.hits += 1
+            return _restore(self._new[fingerprint])
+        if fingerprint in self._old:
+            self.hits += 1
+            self._new[fingerprint] = self._old[fingerprint]
+            return _restore(self._old[fingerprint])
+        self.misses += 1
+        return self.missing
+
+    # Remembers the output of preprocess for a row.
+    # The result is copied right away since get_transactions edits what preprocess gives it.
+    def put(self, fingerprint: str, result):
+        if result is not None:
+            result = (plain_tokens(result[0]), sorted(result[1]))
+        self._new[fingerprint] = loads(dumps(result))
+
+    # Writes every row seen in this parse to disk, rows that are no longer in the sheet are dropped
+    def save(self):
+        logging.info(f"Row cache: {self.hits} rows reused, {self.misses} rows preprocessed")
+        makedirs(dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as file:
+            dump({"signature": self.signature, "rows": self._new}, file)
+        replace(self.path + ".tmp", self.path)
+
+# Opens the row cache for the sheet at filePath.
+# Anything that changes how rows are preprocessed is part of the signature, if it doesn't match the cache is started over.
+def open_row_cache(filePath, config: ParserConfig) -> RowCache:
+    filePath = str(filePath)
+    model = get_profile_model(config.profile)
+    try:
+        model_version = get_package_version(model)
+    except Exception:
+        model_version = None
+    signature = [ROW_CACHE_VERSION, PREPROCESSOR_VERSION, model, model_version, config.profile, config.fast_path]
+    return RowCache(join(dirname(filePath), "rows", basename(filePath) + ".rows"), signature)
@@ -0,0 +1,185 @@
+from re import split
+import numpy as np
+import pandas as pd
+from .parser_utils import get_col, ColumnMap
+
+# In this file: The parts of a row's context that come straight from its cells (account name, reel, folio, entry id, genmat,
+# whether its money and commodity columns are empty, ...), worked out for a whole sheet at once.
+# get_transactions used to read every one of these with get_col on every row. RowContextColumns reads each column once
+# and does the conversions on whole columns with pandas, so a row only has to index a few lists.
+# Anything that can't be done for the whole sheet (a stream instead of a DataFrame, a missing or duplicated column) and any
+# row whose values would raise (e.g. a GenMat that isn't a number) is left to row_context_values, which reads the row itself
+# the way get_transactions always did, so errors are still raised on the row they belong to.
+
+_dashes = ["-", " -", "- "]
+_currency_cols = ["L Currency", "s Currency", "d Currency"]
+_sterling_cols = ["L Sterling", "s Sterling", "d Sterling"]
+_account_name_cols = ("Prefix", "Account First Name", "Account Last Name", "Suffix")
+
+# Drops the word before every word in brackets, and the brackets, e.g. "John Jon [Jones]" becomes "John Jones"
+def _strip_account_name_brackets(acct_name: str) -> str:
+    acct_name = split(r"\s+", acct_name)
+    n_acct_name = []
+    for word in acct_name:
+        if "[" in word:
+            n_acct_name.pop()
+        n_acct_name.append(word.strip("[]"))
+    return " ".join(n_acct_name)
+
+# Returns a tuple of:
+# (colony currency columns empty, sterling columns empty, commodity_totaling_contextless, account_name, reel, store_owner,
+#  folio_year, folio_page, entry_id, store, genmat, currency_colony, original_entry)
+# for row, read one cell at a time.
+def row_context_values(row) -> tuple:
+    no_currency = all([get_col(row, x) in _dashes for x in _currency_cols])
+    no_sterling = all([get_col(row, x) in _dashes for x in _sterling_cols])
+
+    # Detect if we need to do commodity totaling
+    if all([get_col(row, x) in _dashes for x in ["Quantity", "Commodity"]]):
+        commodity_totaling_contextless = True
+
+    # If we find both a quantity and a commodity, mark the transaction for commodity totaling
+    elif all([get_col(row, x) != "-" for x in ["Quantity", "Commodity"]]):
+        commodity_totaling_contextless = False
+
+    # Do not do commodity totaling if there is only partial information
+    else:
+        commodity_totaling_contextless = True
+
+    # Remember account holder, data, folio reference, etc.
+    acct_name = " ".join([get_col(row, x).strip() for x in _account_name_cols if get_col(row, x) != "-"])
+    if "[" in acct_name:
+        acct_name = _strip_account_name_brackets(acct_name)
+
+    return (
+        no_currency,
+        no_sterling,
+        commodity_totaling_contextless,
+        acct_name,
+        get_col(row, "Reel"),
+        get_col(row, "Owner"),
+        get_col(row, "Folio Year"),
+        get_col(row, "Folio Page"),
+        str(get_col(row, "EntryID")),
+        get_col(row, "Store"),
+        (int(float(str(get_col(row, "GenMat")))), get_col(row, "EntryID")),
+        get_col(row, "Colony Currency"),
+        get_col(row, "Entry"),
+    )
+
+# .str.strip() of a column, or all NaN if none of its values are strings (pandas refuses .str on those)
+def _strip(col: pd.Series) -> pd.Series:
+    try:
+        return col.str.strip()
+    except AttributeError:
+        return pd.Series(float("nan"), index=col.index, dtype=object)
+
+# The row context values (see row_context_values) of every row of a DataFrame.
+# Has to be made after preprocess has fixed up the df (i.e. once it has yielded a row), since the cells of the rows it
+# yields are the cells of the fixed df.
+class RowContextColumns:
+    def __init__(self, df):
+        # Row name -> position, None if the values have to be read from the rows
+        self.positions = None
+        if not isinstance(df, pd.DataFrame) or not df.index.is_unique:
+            return
+        try:
+            self._compute(df)
+        except Exception:
+            # Every row gets read by itself, raising whatever this ran into on the first row as it always did
+            return
+        self.positions = {name: i for i, name in enumerate(df.index)}
+
+    def _compute(self, df: pd.DataFrame):
+        # The same 2D array df.iterrows() makes its rows from, so every value has exactly the type it has in the row
+        values = df.values
+        column_map = ColumnMap(list(df.columns))
+        columns = {}
+
+        def column(name: str) -> pd.Series:
+            if name not in columns:
+                position = column_map.resolve(name)
+                if column_map.names.count(column_map.names[position]) > 1:
+                    raise KeyError(f"Column {name} is not unique")
+                columns[name] = pd.Series(values[:, position], dtype=object)
+            return columns[name]
+
+        def all_dashes(names) -> np.ndarray:
+            return np.logical_and.reduce([column(name).isin(_dashes).to_numpy() for name in names])
+
+        no_currency = all_dashes(_currency_cols)
+        no_sterling = all_dashes(_sterling_cols)
+        quantity = column("Quantity").ne("-").to_numpy()
+        commodity = column("Commodity").ne("-").to_numpy()
+        commodity_totaling_contextless = all_dashes(["Quantity", "Commodity"]) | ~(quantity & commodity)
+
+        # Rows that have to be read by themselves
+        irregular = np.zeros(len(df), dtype=bool)
+
+        # " ".join of the stripped name parts that aren't "-", done as " " + part for every part, minus the first space
+        acct_name = None
+        for name in _account_name_cols:
+            col = column(name)
+            included = col.ne("-")
+            stripped = _strip(col)
+            # Parts that aren't strings can't be stripped
+            irregular |= (included & stripped.isna()).to_numpy()
+            part = (" " + stripped.fillna("")).where(included, "")
+            acct_name = part if acct_name is None else acct_name + part
+        acct_name = acct_name.str[1:].tolist()
+        for i, name in enumerate(acct_name):
+            if "[" in name:
+                try:
+                    acct_name[i] = _strip_account_name_brackets(name)
+                except IndexError:
+                    irregular[i] = True
+
+        # int(float(str(GenMat))) for every distinct GenMat
+        codes, uniques = pd.factorize(column("GenMat").astype(str))
+        genmat_values = []
+        for value in uniques:
+            try:
+                genmat_values.append(int(float(value)))
+            except (ValueError, OverflowError):
+                genmat_values.append(None)
+        genmat = [genmat_values[x] for x in codes]
+        irregular |= np.array([x is None for x in genmat], dtype=bool)
+
+        self.no_currency = no_currency.tolist()
+        self.no_sterling = no_sterling.tolist()
+        self.commodity_totaling_contextless = commodity_totaling_contextless.tolist()
+        self.acct_name = acct_name
+        self.reel = list(column("Reel"))
+        self.store_owner = list(column("Owner"))
+        self.folio_year = list(column("Folio Year"))
+        self.folio_page = list(column("Folio Page"))
+        self.entry_id = column("EntryID").astype(str).tolist()
+        self.raw_entry_id = list(column("EntryID"))
+        self.store = list(column("Store"))
+        self.genmat = genmat
+        self.currency_colony = list(column("Colony Currency"))
+        self.original_entry = list(column("Entry"))
+        self.irregular = irregular.tolist()
+
+    # Returns row_context_values(row), from the precomputed columns if possible
+    def get(self, row) -> tuple:
+        if self.positions is None:
+            return row_context_values(row)
+        i = self.positions.get(row.name)
+        if i is None or self.irregular[i]:
+            return row_context_values(row)
+        return (
+            self.no_currency[i],
+            self.no_sterling[i],
+            self.commodity_totaling_contextless[i],
+            self.acct_name[i],
+            self.reel[i],
+            self.store_owner[i],
+            self.folio_year[i],
+            self.folio_page[i],
+            self.entry_id[i],
+            self.store[i],
+            (self.genmat[i], self.raw_entry_id[i]),
+            self.currency_colony[i],
+            self.original_entry[i],
+        )
@@ -0,0 +1,282 @@
+from collections import deque
+from datetime import time
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from pandas._libs.parsers import STR_NA_VALUES
+from pandas.errors import EmptyDataError
+from .parser_utils import RowRecord, ColumnMap
+from .parse_stats import count
+
+# In this file: Reads the first sheet of a spreadsheet one row at a time instead of loading it into a DataFrame.
+# .xlsx files are read with openpyxl in read only mode, which never holds more than a row of the sheet. .xls files are read with
+# xlrd, which has no way of reading a sheet without loading all of its cells, so for them streaming saves the DataFrame but not the cells.
+# Every row comes out as a RowRecord holding the values the same row of load_sheet's DataFrame holds, so the rest of the parser
+# can't tell the difference. The file is only read once:
+# pandas decides a column's type from the kinds of values in it (int, float, numeric text, missing, etc.), so for every column we keep
+# one example of each kind seen so far and let pandas read just the header and those examples to learn the names and types it would
+# give the columns. Rows are read lookahead rows ahead of the one being yielded, and a row's values are only converted to their
+# column's type as it is yielded. Whenever a row shows a column a kind of value it hadn't had, the types are worked out again, so
+# the rows still waiting to be yielded come out with the new type.
+# Rows yielded before that keep the type the column had then, so a sheet with a new kind of value more than lookahead rows below the
+# first one with its old kind (e.g. a missing value far down a column of whole numbers, which pandas would make floats) reads
+# differently from its DataFrame. Every such change is counted as "columns retyped" in the stats of the parse.
+
+# Rows read ahead of the one being yielded by default, see SheetStream (every sheet under data/ reads exactly like its DataFrame with 128)
+LOOKAHEAD = 128
+
+# Reads the cells of every row of an .xlsx file, converted the same way pandas does.
+# The first thing yielded is the number of rows the file says the sheet has (0 if it doesn't say), see _read_rows.
+def _read_xlsx(filePath: str):
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    book = load_workbook(filePath, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = book.worksheets[0]
+        yield sheet.max_row or 0
+        # The dimensions files claim are often wrong, so read every row there is
+        sheet.reset_dimensions()
+        for row in sheet.rows:
+            converted = []
+            for cell in row:
+                if cell.value is None:
+                    converted.append("")
+                elif cell.data_type == TYPE_ERROR:
+                    converted.append(np.nan)
+                elif cell.data_type == TYPE_NUMERIC and int(cell.value) == cell.value:
+                    converted.append(int(cell.value))
+                else:
+                    converted.append(cell.value)
+            # Trailing empty cells are dropped and added back later as padding
+            while converted and converted[-1] == "":
+                converted.pop()
+            yield converted
+    finally:
+        book.close()
+
+# Reads the cells of every row of an .xls file, converted the same way pandas does.
+# The first thing yielded is the number of rows of the sheet, see _read_rows.
+def _read_xls(filePath: str):
+    from xlrd import open_workbook, XL_CELL_BOOLEAN, XL_CELL_DATE, XL_CELL_ERROR, XL_CELL_NUMBER, xldate
+
+    book = open_workbook(filePath, on_demand=True)
+    try:
+        # Loads every cell of the sheet, xlrd can't do it row by row
+        sheet = book.sheet_by_index(0)
+        epoch1904 = book.datemode
+        yield sheet.nrows
+        for i in range(sheet.nrows):
+            converted = []
+            for val, typ in zip(sheet.row_values(i), sheet.row_types(i)):
+                if typ == XL_CELL_DATE:
+                    try:
+                        val = xldate.xldate_as_datetime(val, epoch1904)
+                    except OverflowError:
+                        converted.append(val)
+                        continue
+                    # Dates on the epoch are times
+                    year = val.timetuple()[0:3]
+                    if (not epoch1904 and year == (1899, 12, 31)) or (epoch1904 and year == (1904, 1, 1)):
+                        val = time(val.hour, val.minute, val.second, val.microsecond)
+                elif typ == XL_CELL_ERROR:
+                    val = np.nan
+                elif typ == XL_CELL_BOOLEAN:
+                    val = bool(val)
+                elif typ == XL_CELL_NUMBER and int(val) == val:
+                    val = int(val)
+                converted.append(val)
+            yield converted
+    finally:
+        book.release_resources()
+
+# Yields the number of rows the sheet has (as far as the file says, it can be off), then the cells of every row as a list
+# with the trailing empty ones dropped
+def _read_rows(filePath: str):
+    if filePath.endswith(".xls"):
+        return _read_xls(filePath)
+    return _read_xlsx(filePath)
+
+# Returns a key that is the same for any two values pandas treats the same way when working out a column's type
+def _kind(val):
+    if isinstance(val, str):
+        if val in STR_NA_VALUES:
+            return "missing"
+        if val in ("True", "TRUE", "true", "False", "FALSE", "false"):
+            return "bool text"
+        try:
+            if "_" not in val:
+                number = float(val)
+                if number != number or abs(number) == float("inf"):
+                    return "special number text"
+                if "." in val or "e" in val or "E" in val:
+                    return "float text"
+                return "negative int text" if number < 0 else "int text"
+        except ValueError:
+            pass
+        return "text"
+    if isinstance(val, bool):
+        return "bool"
+    if isinstance(val, int):
+        if val < 0:
+            return "negative int"
+        return "big int" if val >= 2 ** 63 else "int"
+    if isinstance(val, float):
+        return "nan" if val != val else "float"
+    return type(val)
+
+# Returns a function converting a value of a column to what pandas would put in a column of dtype
+def _converter(dtype):
+    if dtype == np.int64:
+        return int
+    if dtype == np.float64:
+        return lambda val: np.nan if isinstance(val, str) and val in STR_NA_VALUES else float(val)
+    if dtype == np.bool_:
+        return lambda val: val if isinstance(val, bool) else val.lower() == "true"
+    if str(dtype).startswith("datetime64"):
+        return lambda val: pd.NaT if isinstance(val, str) and val in STR_NA_VALUES else pd.Timestamp(val)
+    return lambda val: np.nan if isinstance(val, str) and val in STR_NA_VALUES else val
+
+class SheetStream:
+    def __init__(self, filePath: str, lookahead: int = LOOKAHEAD):
+        self.filePath = filePath
+        self.lookahead = lookahead
+        rows = _read_rows(filePath)
+        self._estimate = next(rows)
+
+        # The header is the first row with an EntryID column
+        width = 0
+        header_row = None
+        for i, row in enumerate(rows):
+            width = max(width, len(row))
+            if "EntryID" in row or "[EntryID]" in row:
+                header_row = i
+                header = row
+                break
+        if header_row is None:
+            raise EmptyDataError("No columns to parse from file")
+        self._header_row = header_row
+
+        # The sheet is as wide as its widest row, which can only be known for the rows read so far. Cells further right than that
+        # (always under an empty header, as the header row has been read) are dropped, nothing reads a column without a name.
+        ahead = []
+        for row in rows:
+            width = max(width, len(row))
+            ahead.append(row)
+            if len(ahead) >= lookahead:
+                break
+        self._width = width
+        self._header = header + [""] * (width - len(header))
+
+        # For every column, {kind: example} of the values below the header
+        self._kinds = [{} for i in range(width)]
+        # Rows below the header read but not yielded yet, padded to the width of the sheet
+        self._buffer = deque()
+        # Empty rows read since the last one with anything in it, only part of the sheet if something follows them
+        self._blank = 0
+        # Rows added to the buffer so far, and rows yielded so far
+        self._n_read = 0
+        self._n_yielded = 0
+        # Whether every row has been read
+        self._done = False
+        for row in ahead:
+            self._add(row, False)
+        self._rows = rows
+        self._retype(False)
+
+    # Works out the names and types pandas would give the columns from the header and enough rows to show it every kind of value
+    # in every column. Any example of a kind stands in for all of them, so columns with fewer kinds just repeat theirs.
+    def _retype(self, counted: bool = True):
+        n_examples = max((len(x) for x in self._kinds), default=0)
+        sample = [list(x.values()) for x in self._kinds]
+        sample_rows = [[x[k % len(x)] if x else "" for x in sample] for k in range(n_examples)]
+        sample_df = TextParser([self._header] + sample_rows, header=0, skip_blank_lines=False).read()
+
+        dtypes = list(sample_df.dtypes)
+        if counted:
+            count("columns retyped", sum(1 for a, b in zip(self.dtypes, dtypes) if a != b))
+        else:
+            self.columns = ColumnMap(list(sample_df.columns))
+        self.dtypes = dtypes
+        self._converters = [_converter(dtype) for dtype in dtypes]
+        # A row of a df with only one numeric type holds numpy values rather than python ones
+        if len(set(dtypes)) == 1 and dtypes[0] != np.object_:
+            scalar = dtypes[0].type
+            self._converters = [lambda val, f=f: scalar(f(val)) for f in self._converters]
+
+    # Adds a row read from the file to the buffer, working out the types again if it has a new kind of value in some column
+    # (only if retype, otherwise the caller has to)
+    def _add(self, row: list, retype: bool = True):
+        if not row:
+            self._blank += 1
+            return
+        width = self._width
+        if len(row) > width:
+            row = row[:width]
+        # Empty rows followed by this one are part of the sheet after all
+        if self._blank:
+            rows = [[""] * width for i in range(self._blank)] + [row + [""] * (width - len(row))]
+            self._blank = 0
+        else:
+            rows = [row + [""] * (width - len(row))]
+
+        new_kind = False
+        for row in rows:
+            for kinds, val in zip(self._kinds, row):
+                kind = _kind(val)
+                if kind not in kinds:
+                    kinds[kind] = val
+                    new_kind = True
+            self._buffer.append(row)
+            self._n_read += 1
+        if new_kind and retype:
+            self._retype()
+
+    # Number of rows below the header, like len() of the df load_sheet returns.
+    # Until every row has been read this is the number of rows the file says the sheet has, which can count empty rows at its end
+    def __len__(self) -> int:
+        if self._done:
+            return self._n_read
+        return max(self._estimate - self._header_row - 1, self._n_read)
+
+    def _record(self, row: list) -> RowRecord:
+        record = RowRecord(self._n_yielded, [f(val) for f, val in zip(self._converters, row)], self.columns)
+        self._n_yielded += 1
+        return record
+
+    # Yields (index, RowRecord) for every row below the header, like df.iterrows() on the df load_sheet returns.
+    # (load_sheet also drops rows whose entry id is "", but pandas has made every "" missing by then so that never drops anything)
+    # Iterating again reads the file again, with the types the columns ended up with.
+    def __iter__(self):
+        if self._rows is None:
+            self._restart()
+        rows = self._rows
+        self._rows = None
+        buffer = self._buffer
+        lookahead = self.lookahead
+        for row in rows:
+            self._add(row)
+            while len(buffer) > lookahead:
+                record = self._record(buffer.popleft())
+                yield record.name, record
+        self._done = True
+        while buffer:
+            record = self._record(buffer.popleft())
+            yield record.name, record
+
+    # Goes back to the first row below the header
+    def _restart(self):
+        rows = _read_rows(self.filePath)
+        next(rows)
+        for i, row in zip(range(self._header_row + 1), rows):
+            pass
+        self._rows = rows
+        self._buffer = deque()
+        self._blank = 0
+        self._n_read = 0
+        self._n_yielded = 0
+        self._done = False
+
+# Opens a spreadsheet for streaming, see SheetStream
+def open_sheet(filePath, lookahead: int = LOOKAHEAD) -> SheetStream:
+    return SheetStream(str(filePath), lookahead)
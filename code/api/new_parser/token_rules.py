@@ -0,0 +1,467 @@
+from re import search, split
+from .parser_utils import isNoun, add_error
+from .transaction import Transaction
+from .errors import ParserError, TOBACCO_WEIGHTS, TOBACCO_FINAL_WEIGHT, COMPLEX_NOTE, CONJUNCTION
+from .indices import item_set
+
+# In this file: The rules get_transactions uses to turn the tokens of an entry into a transaction.
+# Every rule is registered with @rule, saying which tokens it is for (by their (info, pos) labels) and optionally a further
+# condition on the token or the transaction so far. For each token, the first rule in registration order that matches it
+# runs, and no others do, so the order rules are registered in is their priority.
+# The rules that can apply to an (info, pos) pair are worked out once, so a token only gets checked against the rules
+# that can possibly match it instead of the whole list.
+
+_rules = []
+
+# Registers the decorated function as the rule for tokens where applies_to(info, pos) is true (every token if None)
+# and when(ctx) is true (always if None). A rule returns True if the token should not be added to the current phrase.
+def rule(applies_to=None, when=None):
+    def register(handler):
+        _rules.append((applies_to, when, handler))
+        _compiled.clear()
+        return handler
+    return register
+
+# (info, pos) -> the (when, handler) pairs of the rules that can apply to it, in order, up to the first one that always applies
+_compiled = {}
+
+def _rules_for(info: str, pos: str) -> tuple:
+    rules = _compiled.get((info, pos))
+    if rules is None:
+        rules = []
+        for applies_to, when, handler in _rules:
+            if applies_to is None or applies_to(info, pos):
+                rules.append((when, handler))
+                if when is None:
+                    break
+        rules = _compiled[(info, pos)] = tuple(rules)
+    return rules
+
+# Everything the rules know about the entry being parsed: the transaction being built, what has been written down about it
+# so far, and the current token with its neighbours
+class TokenContext:
+    __slots__ = ("entry", "transaction", "row_context", "nouns", "phrase_depth", "phrases", "cur_phrase", "poss_amounts",
+                 "tobacco_marks", "cur_tobacco_entry", "tobacco_entries", "add_price_to_item",
+                 "i", "word", "info", "pos", "prev_word", "prev_pos", "next_word")
+
+    def __init__(self, entry, row_context: dict, add_price_to_item: bool = False):
+        self.entry = entry
+        self.transaction = Transaction()
+        self.row_context = row_context
+        self.nouns = []
+        self.phrase_depth = 0
+        self.phrases = []
+        self.cur_phrase = {"modifies": "", "phrase": []}
+        self.poss_amounts = []
+        self.tobacco_marks = []
+        self.cur_tobacco_entry = {}
+        self.tobacco_entries = []
+        # Carries over between the entries of a row
+        self.add_price_to_item = add_price_to_item
+
+# Runs the rules over every token of ctx.entry
+def apply_token_rules(ctx: TokenContext):
+    entry = ctx.entry
+    transaction = ctx.transaction
+    n = len(entry)
+    # Rules only ever change tokens after the current one, so the previous token is the one we looked at last
+    last_word = None
+    last_pos = None
+    for i, ex in enumerate(entry):
+        word, info, pos = ex
+        prev_word, prev_pos = last_word, last_pos
+        last_word, last_pos = word, pos
+
+        if i + 1 < n:
+            next_word = entry[i + 1][0]
+        else:
+            next_word = None
+
+        # Leftover code to uncombine coordinating conjunctions that failed to combine
+        if pos == "CC" and len(word.split(" ")) > 1:
+            word = " ".join(word.split(" ")[:-1])
+            pos = "NN"
+
+        # If the previous word was coordinating conjunection in a tobacco entry and a price follows it,
+        # that price is part of what was transacted.
+        if ctx.add_price_to_item and "PRICE" in info:
+            transaction["item"] += " & " + word
+            continue
+
+        # Ignore IGNORE_PRICES tokens
+        if pos == "IGNORE_PRICES":
+            continue
+
+        if ctx.add_price_to_item:
+            ctx.add_price_to_item = False
+
+        ctx.i = i
+        ctx.word = word
+        ctx.info = info
+        ctx.pos = pos
+        ctx.prev_word = prev_word
+        ctx.prev_pos = prev_pos
+        ctx.next_word = next_word
+
+        skip_phrase = False
+        rules = _compiled.get((info, pos))
+        if rules is None:
+            rules = _rules_for(info, pos)
+        for when, handler in rules:
+            if when is None or when(ctx):
+                skip_phrase = handler(ctx)
+                break
+        if skip_phrase:
+            continue
+
+        # Save all phrases contained in the entry for later, along with which words they modify.
+        # If the thing the phrase modifies is in the item set and we have not id'd an item yet,
+        # that is probably the item.
+        if ctx.phrase_depth > 0:
+            cur_phrase = ctx.cur_phrase
+            if prev_word is not None and ctx.phrase_depth == 1:
+                if "modifies" not in cur_phrase or cur_phrase["modifies"] == "":
+                    cur_phrase["modifies"] = prev_word
+                    if prev_word.lower() in item_set and "item" not in transaction:
+                        transaction["item"] = prev_word
+            cur_phrase["phrase"].append(word)
+
+# Sets the item to the word, along with the adjective before it if there is one
+def _set_item(ctx: TokenContext):
+    if ctx.prev_pos is not None and "JJ" in ctx.prev_pos:
+        ctx.transaction["item"] = f"{ctx.prev_word} {ctx.word}"
+    else:
+        ctx.transaction["item"] = ctx.word
+
+def _is_tobacco(transaction: dict) -> bool:
+    return "item" in transaction and "tobacco" in transaction["item"].lower()
+
+# Whether something after token i of entry can be what an amount is counting
+def _noun_follows(entry, i: int, excluded: tuple) -> bool:
+    for w, e_m, tag in entry[i + 1:]:
+        # Allow verbs to be nouns for this purpose
+        if (isNoun((w, e_m, tag)) and e_m not in excluded) or "VB" in tag or w.lower() in item_set:
+            return True
+    return False
+
+# If we don't know yet whether the row is a debit record or credit record and we
+# see a word telling us that info, write it down
+@rule(lambda info, pos: info == "TRANS", when=lambda ctx: "debit_or_credit" not in ctx.row_context)
+def _transaction_type(ctx: TokenContext):
+    if ctx.word == "To":
+        ctx.row_context["debit_or_credit"] = "Dr"
+    elif ctx.word == "By":
+        ctx.row_context["debit_or_credit"] = "Cr"
+
+@rule(lambda info, pos: "fancy_" in pos)
+def _fancy_price(ctx: TokenContext):
+    unit = ctx.pos.split("_")[1]
+
+    if unit == "pounds":
+        ctx.transaction["real_price"] = ctx.word
+    elif unit != "frac":
+        ctx.transaction["real_price"] += "/" + ctx.word
+    elif unit == "frac" and ctx.word != "0":
+        ctx.transaction["real_price"] += " " + ctx.word
+
+# Handle our date regex to fix dates later
+@rule(lambda info, pos: pos == "DATE_REGEX")
+def _date(ctx: TokenContext):
+    if ctx.info == "DATE.MONTH":
+        ctx.transaction["date_month"] = ctx.word
+
+    elif ctx.info == "DATE.DAY":
+        ctx.transaction["date_day"] = ctx.word
+
+# Handle multiline tobacco entries
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_LOC")
+def _tobacco_location(ctx: TokenContext):
+    ctx.transaction["tobacco_location"] = ctx.word
+
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_N")
+def _tobacco_number(ctx: TokenContext):
+    ctx.cur_tobacco_entry["number"] = ctx.word
+    ctx.transaction["item"] = "Tobacco"
+
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_GW")
+def _tobacco_gross_weight(ctx: TokenContext):
+    ctx.cur_tobacco_entry["gross_weight"] = ctx.word
+
+@rule(lambda info, pos: pos == "MLTBE" and info == "PRICE")
+def _tobacco_price(ctx: TokenContext):
+    ctx.transaction["price"] = ctx.word
+
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_TW")
+def _tobacco_tare_weight(ctx: TokenContext):
+    ctx.cur_tobacco_entry["tare_weight"] = ctx.word
+
+# When we get to the tobacco weight, append the tobacco entry to the row context.
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_W")
+def _tobacco_weight(ctx: TokenContext):
+    cur_tobacco_entry = ctx.cur_tobacco_entry
+    cur_tobacco_entry["weight"] = ctx.word
+
+    ctx.tobacco_entries.append(cur_tobacco_entry)
+    ctx.transaction["tobacco_entries"] = ctx.tobacco_entries
+
+    # If the math doesn't work out
+    if int(gross := cur_tobacco_entry["gross_weight"]) - int(tare := cur_tobacco_entry["tare_weight"]) != int(tobacco := cur_tobacco_entry["weight"]):
+        add_error(ctx.transaction, ParserError(TOBACCO_WEIGHTS, "Error: Tobacco entry weights don't add up. Gross {} - Tare {} != tobacco {}", gross, tare, tobacco), ctx.entry)
+
+    ctx.cur_tobacco_entry = {}
+
+# If we see that we can't find the final tobacco weight
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_NF", when=lambda ctx: "Quantity" not in ctx.row_context)
+def _tobacco_weight_not_found(ctx: TokenContext):
+    add_error(ctx.transaction, ParserError(TOBACCO_FINAL_WEIGHT, "Error: Cannot find final tobacco weight in this tobacco transaction, likely indicates multiple tobacco transactions rolled into 1 in a later transaction"), ctx.entry)
+
+# Remember tobacco weight as amount, and unit price as price
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_FW")
+def _tobacco_final_weight(ctx: TokenContext):
+    ctx.transaction["amount"] = ctx.word
+
+@rule(lambda info, pos: pos == "MLTBE" and info == "TB_UP")
+def _tobacco_unit_price(ctx: TokenContext):
+    ctx.transaction["price"] = ctx.word
+
+# Any other part of a multiline tobacco entry is ignored
+@rule(lambda info, pos: pos == "MLTBE")
+def _tobacco_other(ctx: TokenContext):
+    pass
+
+# Handle random tobacco notes
+@rule(lambda info, pos: pos == "SLTBE_F")
+def _tobacco_note(ctx: TokenContext):
+    m = search(r"(\d+)\s+(\d+)", ctx.word)
+    if m is None:
+        add_error(ctx.transaction, ParserError(COMPLEX_NOTE, "Complex note confused parser."), ctx.word)
+    else:
+        ctx.cur_tobacco_entry["number"] = m.group(1)
+        ctx.cur_tobacco_entry["weight"] = m.group(2)
+        ctx.tobacco_entries.append(ctx.cur_tobacco_entry)
+        ctx.transaction["tobacco_entries"] = ctx.tobacco_entries
+        ctx.cur_tobacco_entry = {}
+        ctx.transaction["item"] = "Tobacco"
+        ctx.transaction["amount_unreliable"] = True
+
+# Handle tobacco marks
+@rule(lambda info, pos: info == "TM.TEXT")
+def _tobacco_mark(ctx: TokenContext):
+    # The previous token is guaranteed to be the mark number if this one is the mark text
+    ctx.tobacco_marks.append({"mark_number": ctx.prev_word, "mark_text": ctx.word})
+
+# Remember if the entry is a cash transaction
+@rule(lambda info, pos: info == "CASH")
+def _cash(ctx: TokenContext):
+    ctx.transaction["type"] = "Cash"
+
+# Remember if the price is the unit price or the total price
+@rule(lambda info, pos: info == "IS.BULK")
+def _bulk(ctx: TokenContext):
+    ctx.transaction["price_is_bulk"] = True
+
+# Specific carve out for tobacco, auto add it to commodity if found
+@rule(when=lambda ctx: ctx.word.lower() == "tobacco")
+def _tobacco(ctx: TokenContext):
+    row_context = ctx.row_context
+    if "Quantity" in row_context and row_context["Quantity"] not in {"", "-"}:
+        row_context["Commodity"] = "Tobacco"
+
+    ctx.transaction["item"] = "Tobacco"
+
+# In case of not being able to find nouns for the coordinating conjunction
+@rule(lambda info, pos: pos == "CC.DENIED")
+def _denied_conjunction(ctx: TokenContext):
+    # If this is a tobacco entry and the next
+    if _is_tobacco(ctx.transaction) and ctx.info == "CC.TOB":
+        ctx.add_price_to_item = True
+    # Mark as error if we can't figure out how to use the Coordinating Conjunction
+    else:
+        add_error(ctx.transaction, ParserError(CONJUNCTION, "Error: Likely parsing failure due to complex use of coordinating conjunction."), ctx.entry)
+
+# Remember if the entry is a Liber transaction
+@rule(lambda info, pos: info == "LIBER")
+def _liber(ctx: TokenContext):
+    ctx.transaction["type"] = "Liber"
+    ctx.transaction["liber_book"] = ctx.word.split(" ")[1]
+
+# If we see something from the amount index, search for a noun following it and if it exists, mark this as the real amount
+@rule(lambda info, pos: info == "AMT")
+def _amount_index(ctx: TokenContext):
+    transaction = ctx.transaction
+    if ctx.prev_word is not None and ctx.prev_word.lower() == "off":
+        transaction["tobacco_off"] = ctx.word
+    # If it is in a phrase, use poss_amounts instead as if this is the only amount it will still get set the amount at the end
+    if ctx.phrase_depth == 0:
+        if _is_tobacco(transaction):
+            pass
+        else:
+            # Make sure that there is a noun after the amount
+            if ctx.i < len(ctx.entry) - 1:
+                # If we find a noun after the amount
+                if _noun_follows(ctx.entry, ctx.i, ("DATE",)):
+                    transaction["amount"] = ctx.word
+                    # Remove the currently found item as it is definitely not right
+                    if "item" in transaction:
+                        del transaction["item"]
+                    transaction["amount_is_combo"] = False
+                else:
+                    ctx.poss_amounts.append(ctx.word)
+            else:
+                ctx.poss_amounts.append(ctx.word)
+    else:
+        ctx.poss_amounts.append(ctx.word)
+
+# Remember the price of the entry, marking if it is a complex price
+@rule(lambda info, pos: info in ("PRICE", "COMB.PRICE"))
+def _price(ctx: TokenContext):
+    transaction = ctx.transaction
+    # If there is an existing price with a / in it it might be an amount, so write that down as a poss amount.
+    if "price" in transaction and "/" in transaction["price"]:
+        ctx.poss_amounts.append(transaction["price"])
+
+    # If this is a pennyweight for nails, add it to the following token as a modifier
+    if ctx.next_word is not None and ctx.next_word.lower() == "nails":
+        ctx.entry[ctx.i + 1] = (f"{ctx.word} {ctx.next_word}", "", "NN")
+        return True
+
+    # Write this down as the price
+    transaction["price"] = ctx.word
+    transaction["price_is_combo"] = False
+
+    # Add combination metadata
+    if ctx.info == "COMB.PRICE":
+        transaction["price_is_combo"] = True
+
+# Remember all the nouns in the entry, setting item to the last noun not inside a phrase
+@rule(lambda info, pos: "NN" in pos, when=lambda ctx: ctx.phrase_depth == 0)
+def _noun(ctx: TokenContext):
+    word, info = ctx.word, ctx.info
+    ctx.nouns.append((word, info, ctx.pos))
+    # If something is an organization, don't set it as the item
+    if info != "ORG" or word.lower() in item_set:
+        if ((info == "PERSON" or info == "DATE") and word.lower() not in item_set) or _is_tobacco(ctx.transaction):
+            ctx.nouns.append((word, info, ctx.pos))
+        else:
+            _set_item(ctx)
+            # If there is a per phrase in the noun, split it out.
+            if search(r"\s+Per\s+", ctx.transaction["item"]):
+                ctx.transaction["item"] = split(r"\s+Per\s+", ctx.transaction["item"])[0]
+
+# If the preprocesser thinks we have an interjection but it is in the item set, it is probably the item
+@rule(lambda info, pos: "UH" in pos, when=lambda ctx: ctx.word.lower() in item_set)
+def _interjection_item(ctx: TokenContext):
+    _set_item(ctx)
+
+# If we see a verb gerund (noun) and there is no item in our transaction, it is probably a misclassification
+@rule(lambda info, pos: "VBG" in pos, when=lambda ctx: "item" not in ctx.transaction)
+def _gerund_item(ctx: TokenContext):
+    _set_item(ctx)
+
+# Remember all nouns, including verb gerund
+@rule(lambda info, pos: "VBG" in pos)
+def _gerund(ctx: TokenContext):
+    ctx.nouns.append((ctx.word, ctx.info, ctx.pos))
+
+# If we see a verb and there is no item in our transaction and the verb is capitalized for some strange reason (i.e. its not a verb), mark it as our item
+@rule(lambda info, pos: "VB" in pos, when=lambda ctx: "item" not in ctx.transaction and ctx.word[0].isupper())
+def _capitalized_verb_item(ctx: TokenContext):
+    _set_item(ctx)
+
+# If we see a verb in the transaction and it is in the object index, it is actually the item.
+@rule(lambda info, pos: "VB" in pos, when=lambda ctx: ctx.word.lower() in item_set)
+def _verb_item(ctx: TokenContext):
+    _set_item(ctx)
+
+# Same thing as above but for adjective/adverb
+@rule(lambda info, pos: "JJ" in pos, when=lambda ctx: "item" not in ctx.transaction and ctx.word.lower() in item_set)
+def _adjective_item(ctx: TokenContext):
+    _set_item(ctx)
+
+# If we see something appearing to be a verb in a short entry it is probably the item
+@rule(lambda info, pos: "VB" in pos, when=lambda ctx: len(ctx.entry) <= 4 and "item" not in ctx.transaction)
+def _short_entry_verb_item(ctx: TokenContext):
+    ctx.transaction["item"] = ctx.word
+
+# When we see nouns that are the object of phrases, only mark them as the item if the phrase starts with "for" or "of"
+# as those are likely to be telling us what the transaction is FOR (of is often inside for e.g. for <verb gerund> of <item>) where verb gerund is like making or storing, etc.
+# Only do this if the item is in the object index, though, as it might be a person.
+# Also used for COMB.NOUNs with weird POS identification.
+@rule(lambda info, pos: "NN" in pos or info == "COMB.NOUN", when=lambda ctx: ctx.phrase_depth > 0)
+def _phrase_object(ctx: TokenContext):
+    word = ctx.word
+    ctx.phrase_depth -= 1
+    ctx.nouns.append((word, ctx.info, ctx.pos))
+    if ctx.phrase_depth == 0:
+        cur_phrase = ctx.cur_phrase
+        cur_phrase["phrase"].append(word)
+        ctx.phrases.append(cur_phrase)
+        if (cur_phrase["phrase"][0] == "for" or cur_phrase["phrase"][0] == "of") and word.lower() in item_set:
+            if _is_tobacco(ctx.transaction):
+                ctx.nouns.append((word, ctx.info, ctx.pos))
+            else:
+                ctx.transaction["item"] = word
+        ctx.cur_phrase = {"modifies": "", "phrase": []}
+
+# If we see a definite cardinal number or quantity, write it down as the amount
+@rule(lambda info, pos: info == "CARDINAL")
+def _cardinal(ctx: TokenContext):
+    transaction = ctx.transaction
+    # Make sure that there is a noun after the amount
+    if ctx.i < len(ctx.entry) - 1:
+        # If we find a noun after the amount
+        if _noun_follows(ctx.entry, ctx.i, ("PERSON", "DATE")) and not _is_tobacco(transaction):
+            transaction["amount"] = ctx.word
+
+            # Remove the currently found item as it is definitely not right
+            if "item" in transaction:
+                del transaction["item"]
+
+            transaction["amount_is_combo"] = False
+
+# If we have something labelled specifically as quantity, write it down as amount
+@rule(lambda info, pos: info == "QUANTITY" or info == "COMB.QUANTITY")
+def _quantity(ctx: TokenContext):
+    transaction = ctx.transaction
+    # Make sure that there is a noun after the amount
+    if ctx.i < len(ctx.entry) - 1:
+        # If we find a noun after the amount
+        if _noun_follows(ctx.entry, ctx.i, ("PERSON", "DATE")) and not _is_tobacco(transaction):
+            transaction["amount"] = ctx.word
+
+            # Remove the currently found item as it is definitely not right
+            if "item" in transaction:
+                del transaction["item"]
+
+            if ctx.info == "COMB.QUANTITY":
+                transaction["amount_is_combo"] = True
+            else:
+                transaction["amount_is_combo"] = False
+        else:
+            # If we don't find an amount, still write this down as a possible amount since it was marked as a quantity
+            ctx.poss_amounts.append(ctx.word)
+    else:
+        # Still append to poss_amounts even if this is the last thing in the transaction
+        ctx.poss_amounts.append(ctx.word)
+
+# If we see \d+ off in a tobacco transaction mark it as an amount off
+@rule(when=lambda ctx: ctx.word.lower() == "off" and "item" in ctx.transaction and ("Tobacco" in ctx.transaction["item"].lower() or ("Commodity" in ctx.row_context and "tobacco" in ctx.row_context["Commodity"].lower())) and ctx.prev_word is not None and ctx.prev_word.isnumeric())
+def _tobacco_amount_off(ctx: TokenContext):
+    ctx.transaction["tobacco_amount_off"] = ctx.prev_word
+
+# If we see a preposition that is not telling us the transaction type, mark the start of a phrase
+@rule(lambda info, pos: pos == "IN" and info != "TRANS")
+def _preposition(ctx: TokenContext):
+    ctx.phrase_depth += 1
+
+# If there is a random cardinal that was not classified as definitely a cardinal, or there is a random determiner
+# (determiners are words like a, an, the), mark it down as possibly an amount
+@rule(lambda info, pos: pos == "CD" or pos == "DT")
+def _possible_amount(ctx: TokenContext):
+    ctx.poss_amounts.append(ctx.word)
+
+# If we see a list ender word, mark down the row as being an ender row.
+@rule(lambda info, pos: info == "ENDER")
+def _ender(ctx: TokenContext):
+    ctx.row_context["is_ender"] = True
+    ctx.transaction["type"] = "Ender"
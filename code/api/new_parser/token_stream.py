@@ -0,0 +1,109 @@
+from array import array
+from threading import Lock
+
+# In this file: The compact form preprocess hands tokens to get_transactions in.
+# A smaller entry used to be a list of (text, info, pos) tuples, each holding its own copy of labels like "PRICE" and "NN".
+# A TokenStream keeps the texts in a list and the labels as small integer codes in two arrays, so a token costs a pointer and
+# two ints instead of a tuple and up to two strings.
+# It behaves like the list of tuples it replaces: indexing gives (text, info, pos) tuples, it can be iterated, sliced,
+# compared with lists and appended to, and its repr is the list's, since entries end up inside error messages.
+# Parser output never holds TokenStreams, parse turns them back into lists (see plain_tokens).
+
+# Every label we have seen, a label's code is its index
+_labels = []
+_label_codes = {}
+_labels_lock = Lock()
+
+def _code(label: str) -> int:
+    code = _label_codes.get(label)
+    if code is None:
+        with _labels_lock:
+            code = _label_codes.get(label)
+            if code is None:
+                code = len(_labels)
+                _labels.append(label)
+                _label_codes[label] = code
+    return code
+
+class TokenStream:
+    __slots__ = ("texts", "infos", "tags")
+
+    def __init__(self, tokens=()):
+        self.texts = []
+        self.infos = array("I")
+        self.tags = array("I")
+        for token in tokens:
+            self.append(token)
+
+    def append(self, token):
+        text, info, tag = token
+        self.texts.append(text)
+        self.infos.append(_code(info))
+        self.tags.append(_code(tag))
+
+    # Appends token i of another TokenStream without decoding its labels
+    def append_from(self, other, i: int):
+        self.texts.append(other.texts[i])
+        self.infos.append(other.infos[i])
+        self.tags.append(other.tags[i])
+
+    def pop(self, i: int = -1):
+        return (self.texts.pop(i), _labels[self.infos.pop(i)], _labels[self.tags.pop(i)])
+
+    def has_tag(self, tag: str) -> bool:
+        code = _label_codes.get(tag)
+        return code is not None and code in self.tags
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        if i.__class__ is int:
+            return (self.texts[i], _labels[self.infos[i]], _labels[self.tags[i]])
+        # Slices copy the arrays, which is just a memcpy
+        out = TokenStream.__new__(TokenStream)
+        out.texts = self.texts[i]
+        out.infos = self.infos[i]
+        out.tags = self.tags[i]
+        return out
+
+    def __setitem__(self, i: int, token):
+        text, info, tag = token
+        self.texts[i] = text
+        self.infos[i] = _code(info)
+        self.tags[i] = _code(tag)
+
+    def __iter__(self):
+        return zip(self.texts, map(_labels.__getitem__, self.infos), map(_labels.__getitem__, self.tags))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TokenStream):
+            return self.texts == other.texts and self.infos == other.infos and self.tags == other.tags
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+    # Label codes only mean something in the process that made them, so TokenStreams are pickled (e.g. sent back from
+    # preprocessing workers) as plain tuples
+    def __reduce__(self):
+        return (TokenStream, (self.to_list(),))
+
+    def to_list(self) -> list:
+        return list(self)
+
+# Returns value with every TokenStream in it (including in lists, tuples and dicts) turned back into a list of tuples
+def plain_tokens(value):
+    if isinstance(value, TokenStream):
+        return value.to_list()
+    if isinstance(value, list):
+        return [plain_tokens(x) for x in value]
+    if isinstance(value, tuple):
+        return tuple(plain_tokens(x) for x in value)
+    if isinstance(value, dict):
+        return {key: plain_tokens(val) for key, val in value.items()}
+    return value
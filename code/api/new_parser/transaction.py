@@ -0,0 +1,121 @@
+from json import dumps, loads, load
+from os import remove
+import gzip
+from .british_money import Money
+from .token_stream import plain_tokens
+from .errors import render_errors
+
+# In this file: The record a transaction is kept in from get_transactions until it is written out.
+# A Transaction is the dict that ends up in the output (see ParserOutput in api_types.py), so its keys keep the order they
+# were written down in and it can be handed to json as is. The Money objects the parser works with on the way are kept in
+# slots next to the dict instead of in it, so nothing has to copy the dict to leave them out of the output.
+# The only values left that json can't write themselves are token streams in context and error_context and the
+# ParserErrors in errors, which finish turns into plain data in place once parse is done with the transaction.
+# The output of a sheet is a list of transaction groups, written next to the sheet in one of these formats (ParserConfig.output):
+# - json: the whole list encoded at once once the sheet is parsed, what the parser has always written
+# - json-stream: the same json list, byte for byte, written one group at a time as parse finishes them
+# - jsonl: one group per line, written one group at a time, so the file can be read before it is finished
+# With ParserConfig.output_gzip the file is gzip compressed and gets .gz on the end of its name.
+
+class Transaction(dict):
+    __slots__ = ("money_obj", "money_obj_ster", "original_money_obj", "original_money_obj_ster")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Price of the transaction in colony currency / sterling, None if it has none
+        self.money_obj: Money = None
+        self.money_obj_ster: Money = None
+        # Total colony currency / sterling of the row the transaction came from, None if there is none
+        self.original_money_obj: Money = None
+        self.original_money_obj_ster: Money = None
+
+    # Turns the token streams and errors of the transaction into lists and strings
+    def finish(self):
+        if "context" in self:
+            self["context"] = plain_tokens(self["context"])
+        if "error_context" in self:
+            self["error_context"] = plain_tokens(self["error_context"])
+        if "errors" in self:
+            self["errors"] = render_errors(self["errors"])
+
+# Writes the output of parse to file as json.
+# json.dump encodes in python bit by bit, dumps encodes the whole output at once in C.
+def write_transactions(out: list, file):
+    file.write(dumps(out))
+
+# Extension of the output file of every output format
+output_extensions = {"json": ".json", "json-stream": ".json", "jsonl": ".jsonl"}
+
+# Returns what the name of the output of a sheet written with config ends in
+def output_extension(config) -> str:
+    return output_extensions[config.output] + (".gz" if config.output_gzip else "")
+
+# Returns the path the output of the sheet at filePath is written to with config
+def output_path(filePath, config) -> str:
+    return str(filePath) + output_extension(config)
+
+# Writes the transaction groups of a sheet to an output file, see the formats above
+class TransactionWriter:
+    def __init__(self, path: str, output: str = "json", gzipped: bool = False):
+        if output not in output_extensions:
+            raise ValueError(f"Unknown output format {output}, expected one of {', '.join(output_extensions)}")
+        self.path = path
+        self.lines = output == "jsonl"
+        self.groups = 0
+        self.file = gzip.open(path, "wt") if gzipped else open(path, "w")
+
+    # Writes one group
+    def write(self, group: list):
+        if self.lines:
+            self.file.write(dumps(group) + "\n")
+        else:
+            # dumps separates the items of a list with ", "
+            self.file.write(("[" if self.groups == 0 else ", ") + dumps(group))
+        self.groups += 1
+
+    # Writes every group of out at once
+    def write_all(self, out: list):
+        if self.lines or self.groups or not out:
+            for group in out:
+                self.write(group)
+        else:
+            # Everything but the closing bracket, which close writes
+            self.file.write(dumps(out)[:-1])
+            self.groups = len(out)
+
+    def close(self):
+        if not self.lines:
+            self.file.write("]" if self.groups else "[]")
+        self.file.close()
+
+    # Closes and deletes the file, for when the sheet failed part way through and its output is incomplete
+    def abort(self):
+        self.file.close()
+        try:
+            remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+# Opens a writer for the output of the sheet at filePath in the format config asks for
+def open_output(filePath, config) -> TransactionWriter:
+    return TransactionWriter(output_path(filePath, config), config.output, config.output_gzip)
+
+# Yields the transaction groups of an output file written in any of the formats
+def read_transactions(path: str):
+    file = gzip.open(path, "rt") if path.endswith(".gz") else open(path)
+    with file:
+        if path.removesuffix(".gz").endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield from load(file)
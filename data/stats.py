@@ -1,6 +1,18 @@
 from os import listdir, path
 from sys import argv
-from json import load
+from json import load, loads
+import gzip
+
+# Yields the transaction groups of a parser output file, whichever format the parser wrote it in (.json, .jsonl, either gzipped)
+def read_groups(file_path):
+    file = gzip.open(file_path, "rt") if file_path.endswith(".gz") else open(file_path)
+    with file:
+        if file_path.removesuffix(".gz").endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield from load(file)
 
 if __name__ == "__main__":
     if len(argv) > 1:
@@ -9,13 +21,24 @@ if __name__ == "__main__":
         total_rows = 0
         explicit_error_rows = 0
         for filename in contents:
-            if filename.split(".")[-1] == "json":
-                file = open(path.join(folder, filename))
-                data = load(file)
-                file.close()
-                for translist in data:
+            if filename.removesuffix(".gz").split(".")[-1] in ("json", "jsonl"):
+                for translist in read_groups(path.join(folder, filename)):
                     for row in translist:
                         if "errors" in row:
                             explicit_error_rows += 1
                         total_rows += 1
         print(f"Total explicit error rows: {explicit_error_rows}, total rows: {total_rows}")
+
+        # Errors by code, from the stats the parser writes next to the sheets it parses
+        stats_folder = path.join(folder, "stats")
+        if path.isdir(stats_folder):
+            errors = {}
+            for filename in listdir(stats_folder):
+                if filename.split(".")[-1] == "stats":
+                    file = open(path.join(stats_folder, filename))
+                    summary = load(file)
+                    file.close()
+                    for code, n in summary.get("errors", {}).items():
+                        errors[code] = errors.get(code, 0) + n
+            for code, n in sorted(errors.items(), key=lambda x: -x[1]):
+                print(f"{code}: {n}")